@@ -0,0 +1,212 @@
+"""
+Benchmark the alignment components on synthetic document pairs
+
+Every case runs in a fresh process, so that the reported peak RSS
+(resident set size) belongs to that case only. Reports wall time, peak RSS and
+throughput (DP cells per second for `Aligner.nw_align`, tokens per second for
+everything else) for every case and document size.
+
+Usage:
+
+    python scripts/benchmark.py
+    python scripts/benchmark.py --cases nw_align pipeline --sizes 500 1000
+    python scripts/benchmark.py --nw-kwargs '{"gap_cost_initial": 1}' --json out.json
+"""
+
+from typing import Callable, Dict, List, Optional
+
+import argparse
+import json
+import multiprocessing
+import resource
+import time
+
+import textalign
+from textalign import sentences, translit, util
+from textalign.docsplit import DocSplitter
+
+import synthetic_corpus
+
+# Default document sizes (in tokens) for every case
+DEFAULT_SIZES = {
+    "nw_align": [100, 300, 1000],
+    "clean_bidirectional": [1000, 5000],
+    "find_split_positions": [10000, 50000],
+    "get_aligned_sentences": [10000, 100000],
+    "pipeline": [2000, 10000],
+}
+
+NW_KWARGS = {
+    "similarity_func": textalign.aligner.levsim_rescored,
+    "gap_cost_func": textalign.aligner.decreasing_gap_cost,
+    "gap_cost_length_discount": textalign.aligner.length_discount,
+    "gap_cost_initial": 0.5,
+}
+
+SPLITTER_KWARGS = {
+    "max_len_split": 1000,
+    "subseq_len": 7,
+    "max_lev_dist": 7,
+    "step_size": 50,
+    "translit_func": translit.unidecode_ger,
+}
+
+
+def _flat_tokens(doc: List[List[str]]) -> List[str]:
+    return [tok for sent in doc for tok in sent]
+
+
+def _splitter_kwargs(size: int) -> Dict:
+    """Splitter parameters, with shorter splits for small documents"""
+    max_len_split = min(SPLITTER_KWARGS["max_len_split"], size // 4)
+    return {**SPLITTER_KWARGS, "max_len_split": max_len_split}
+
+
+def bench_nw_align(size: int, seed: int, nw_kwargs: Dict) -> Dict:
+    hist, norm = synthetic_corpus.make_document_pair(size, seed)
+    aligner = textalign.Aligner(_flat_tokens(hist), _flat_tokens(norm))
+    aligner.translit_tokens(translit.unidecode_ger)
+    start = time.perf_counter()
+    aligner.nw_align(**nw_kwargs)
+    duration = time.perf_counter() - start
+    n_cells = len(aligner.tokens_a) * len(aligner.tokens_b)
+    return {"time": duration, "cells": n_cells, "cells/s": n_cells / duration}
+
+
+def bench_clean_bidirectional(size: int, seed: int, nw_kwargs: Dict) -> Dict:
+    # Only the alignment of the full document is needed, compute it per split
+    hist, norm = synthetic_corpus.make_document_pair(size, seed)
+    splitter = DocSplitter(
+        _flat_tokens(hist), _flat_tokens(norm), **_splitter_kwargs(size)
+    )
+    aligner = textalign.Aligner()
+    for split_a, split_b in splitter.split():
+        aligner_split = textalign.Aligner(split_a, split_b)
+        aligner_split.translit_tokens(translit.unidecode_ger)
+        aligner_split.nw_align(**nw_kwargs)
+        aligner.extend(aligner_split)
+    start = time.perf_counter()
+    aligner.clean_bidirectional()
+    duration = time.perf_counter() - start
+    n_tokens = len(aligner.tokens_a) + len(aligner.tokens_b)
+    return {"time": duration, "tokens": n_tokens, "tokens/s": n_tokens / duration}
+
+
+def bench_find_split_positions(size: int, seed: int, nw_kwargs: Dict) -> Dict:
+    hist, norm = synthetic_corpus.make_document_pair(size, seed)
+    splitter = DocSplitter(
+        _flat_tokens(hist), _flat_tokens(norm), **_splitter_kwargs(size)
+    )
+    start = time.perf_counter()
+    split_positions = splitter.find_split_positions()
+    duration = time.perf_counter() - start
+    n_tokens = len(splitter.tokens_a) + len(splitter.tokens_b)
+    return {
+        "time": duration,
+        "tokens": n_tokens,
+        "tokens/s": n_tokens / duration,
+        "splits": len(split_positions) + 1,
+    }
+
+
+def bench_get_aligned_sentences(size: int, seed: int, nw_kwargs: Dict) -> Dict:
+    # Use an identity alignment: only the sentence segmentation is measured
+    hist, norm = synthetic_corpus.make_document_pair(size, seed)
+    doc_a = util.parse_waste_output(synthetic_corpus.to_waste(norm))
+    doc_b = util.parse_waste_output(synthetic_corpus.to_waste(norm))
+    flat_a = [tok for sent in doc_a for tok in sent]
+    flat_b = [tok for sent in doc_b for tok in sent]
+    alignment = [textalign.AlignedPair(i, i) for i in range(len(flat_a))]
+    start_idxs = util.get_sentence_start_idxs(doc_a)
+    start = time.perf_counter()
+    sentences.get_aligned_sentences(alignment, start_idxs, flat_a, flat_b)
+    duration = time.perf_counter() - start
+    n_tokens = len(flat_a)
+    return {"time": duration, "tokens": n_tokens, "tokens/s": n_tokens / duration}
+
+
+def bench_pipeline(size: int, seed: int, nw_kwargs: Dict) -> Dict:
+    hist, norm = synthetic_corpus.make_document_pair(size, seed)
+    config = {
+        "translit_func": translit.unidecode_ger,
+        "aligner": nw_kwargs,
+        "max_aligned_tokens": 4,
+        "splitter": _splitter_kwargs(size),
+    }
+    pipeline = textalign.AlignmentPipeline(config)
+    waste_hist = synthetic_corpus.to_waste(hist)
+    waste_norm = synthetic_corpus.to_waste(norm)
+    start = time.perf_counter()
+    pipeline(waste_hist, waste_norm)
+    duration = time.perf_counter() - start
+    n_tokens = sum(map(len, hist)) + sum(map(len, norm))
+    return {"time": duration, "tokens": n_tokens, "tokens/s": n_tokens / duration}
+
+
+CASES: Dict[str, Callable[[int, int, Dict], Dict]] = {
+    "nw_align": bench_nw_align,
+    "clean_bidirectional": bench_clean_bidirectional,
+    "find_split_positions": bench_find_split_positions,
+    "get_aligned_sentences": bench_get_aligned_sentences,
+    "pipeline": bench_pipeline,
+}
+
+
+def _run_case(case: str, size: int, seed: int, nw_kwargs: Dict) -> Dict:
+    """Run a single case (in a child process) and add the peak RSS"""
+    result = CASES[case](size, seed, nw_kwargs)
+    # ru_maxrss is given in kilobytes on Linux
+    result["peak_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return result
+
+
+def run(
+    cases: List[str],
+    sizes: Optional[List[int]] = None,
+    seed: int = 0,
+    nw_kwargs: Optional[Dict] = None,
+) -> List[Dict]:
+    nw_kwargs = {**NW_KWARGS, **(nw_kwargs or {})}
+    context = multiprocessing.get_context("spawn")
+    results = []
+    for case in cases:
+        for size in sizes or DEFAULT_SIZES[case]:
+            with context.Pool(1) as pool:
+                result = pool.apply(_run_case, (case, size, seed, nw_kwargs))
+            result = {"case": case, "size": size, **result}
+            results.append(result)
+            print(_format_result(result), flush=True)
+    return results
+
+
+def _format_result(result: Dict) -> str:
+    throughput = (
+        f"{result['cells/s']:>12,.0f} cells/s"
+        if "cells/s" in result
+        else f"{result['tokens/s']:>11,.0f} tokens/s"
+    )
+    return (
+        f"{result['case']:<22} {result['size']:>7} "
+        f"{result['time']:>9.3f} s {result['peak_rss_mb']:>8.1f} MB {throughput}"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--cases", nargs="+", choices=list(CASES), default=list(CASES))
+    parser.add_argument("--sizes", nargs="+", type=int, help="Document sizes (tokens)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--nw-kwargs",
+        type=json.loads,
+        default={},
+        help="JSON dict of additional keyword arguments for `Aligner.nw_align`",
+    )
+    parser.add_argument("--json", help="Write results to this JSON file")
+    args = parser.parse_args()
+
+    print(f"{'case':<22} {'size':>7} {'time':>11} {'peak RSS':>11} throughput")
+    results = run(args.cases, args.sizes, args.seed, args.nw_kwargs)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
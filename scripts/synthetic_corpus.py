@@ -0,0 +1,153 @@
+"""
+Generate synthetic document pairs with historical spelling variation
+
+Text B is a "modern" text built from a Zipf-distributed vocabulary, text A is a
+"historical" version of it with typical variation (ſ/s, v/u, combining e for
+Umlauts, / for commas, th for t) and with dropped, inserted, split and merged
+tokens. Both documents can be written in WASTE format, so they can be read
+with `textalign.util.parse_waste_output` and used by the `AlignmentPipeline`.
+
+Usage:
+
+    python scripts/synthetic_corpus.py 10000 hist.txt norm.txt --seed 1
+"""
+
+from typing import List, Tuple
+
+import argparse
+import random
+
+FUNCTION_WORDS = [
+    "und", "der", "die", "das", "ich", "so", "sie", "es", "in", "zu", "mit",
+    "sich", "nicht", "auf", "daß", "als", "auch", "aber", "was", "wie", "um",
+    "mein", "sein", "ihn", "uns", "unter", "vor", "bis", "noch", "nun",
+]  # fmt: skip
+
+SYLLABLES = [
+    "ver", "ge", "un", "be", "sch", "st", "ein", "haus", "mann", "lich", "keit",
+    "ung", "en", "er", "wal", "tu", "sa", "ro", "mü", "bä", "lö", "gut", "fel",
+    "stein", "berg", "wis", "sen", "tag", "nacht", "gott", "ter", "ra", "vo",
+]  # fmt: skip
+
+# Per-token probabilities of structural changes in the historical text
+P_DROP = 0.01
+P_INSERT = 0.005
+P_SPLIT = 0.02
+P_MERGE = 0.01
+
+
+def make_vocabulary(size: int, rng: random.Random) -> List[str]:
+    """Create `size` distinct content words from random syllables"""
+    vocab = set()
+    while len(vocab) < size:
+        word = "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(1, 4)))
+        vocab.add(word.capitalize() if rng.random() < 0.3 else word)
+    return sorted(vocab)
+
+
+def make_modern_doc(
+    n_tokens: int, rng: random.Random, vocab_size: int = 2000
+) -> List[List[str]]:
+    """Create a document of about `n_tokens` tokens, split into sentences"""
+    vocab = FUNCTION_WORDS + make_vocabulary(vocab_size, rng)
+    # Zipf-like weights: the most frequent words are the function words
+    weights = [1 / (rank + 1) for rank in range(len(vocab))]
+    doc = []
+    n = 0
+    while n < n_tokens:
+        length = rng.randint(5, 30)
+        sent = rng.choices(vocab, weights, k=length)
+        sent[0] = sent[0].capitalize()
+        # Commas within the sentence
+        for _ in range(length // 8):
+            sent.insert(rng.randint(1, len(sent) - 1), ",")
+        sent.append(".")
+        doc.append(sent)
+        n += len(sent)
+    return doc
+
+
+def historize_token(token: str, rng: random.Random) -> str:
+    """Apply historical spelling variation to a single token"""
+    if token == ",":
+        return "/" if rng.random() < 0.8 else token
+    if token.startswith("u") and rng.random() < 0.7:
+        token = "v" + token[1:]
+    if "t" in token and rng.random() < 0.2:
+        token = token.replace("t", "th", 1)
+    for umlaut, base in (("ä", "a"), ("ö", "o"), ("ü", "u")):
+        if umlaut in token and rng.random() < 0.7:
+            token = token.replace(umlaut, base + "\u0364")
+    # Long s, except at the end of a word
+    if "s" in token[:-1] and rng.random() < 0.9:
+        token = token[:-1].replace("s", "ſ") + token[-1]
+    return token
+
+
+def make_historical_doc(
+    modern_doc: List[List[str]], rng: random.Random
+) -> List[List[str]]:
+    """Create a historical version of `modern_doc`"""
+    doc = []
+    for modern_sent in modern_doc:
+        sent: List[str] = []
+        for token in modern_sent:
+            r = rng.random()
+            if r < P_DROP:
+                continue
+            elif r < P_DROP + P_INSERT:
+                sent.append(str(rng.randint(1, 500)))  # e.g. a page number
+            token = historize_token(token, rng)
+            if len(token) > 7 and rng.random() < P_SPLIT:
+                middle = len(token) // 2
+                sent.extend([token[:middle], token[middle:]])
+            elif sent and token.isalpha() and rng.random() < P_MERGE:
+                sent[-1] += token
+            else:
+                sent.append(token)
+        if sent:
+            doc.append(sent)
+    return doc
+
+
+def make_document_pair(
+    n_tokens: int, seed: int = 0
+) -> Tuple[List[List[str]], List[List[str]]]:
+    """
+    Return a pair of sentencized documents (historical, modern) with about
+    `n_tokens` tokens each
+    """
+    rng = random.Random(seed)
+    modern_doc = make_modern_doc(n_tokens, rng)
+    historical_doc = make_historical_doc(modern_doc, rng)
+    return historical_doc, modern_doc
+
+
+def to_waste(doc: List[List[str]]) -> str:
+    """Serialize a sentencized document in WASTE format (token, offset, length)"""
+    sentences = []
+    offset = 0
+    for sent in doc:
+        lines = []
+        for token in sent:
+            # Whitespace before every token but punctuation
+            if offset and token not in {",", ".", "/"}:
+                offset += 1
+            lines.append(f"{token}\t{offset} {len(token)}")
+            offset += len(token)
+        sentences.append("\n".join(lines))
+    return "\n\n".join(sentences) + "\n"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("n_tokens", type=int, help="Approximate number of tokens")
+    parser.add_argument("file_hist", help="Output file for the historical text")
+    parser.add_argument("file_norm", help="Output file for the modern text")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    hist, norm = make_document_pair(args.n_tokens, args.seed)
+    for path, doc in ((args.file_hist, hist), (args.file_norm, norm)):
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(to_waste(doc))
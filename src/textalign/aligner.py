@@ -1,9 +1,16 @@
-from typing import Callable, List, Optional, Union
-from dataclasses import astuple, dataclass
+from typing import Callable, Dict, Iterator, List, Optional, Tuple, Union
+from dataclasses import dataclass
+
+import functools
+import itertools
 
 import Levenshtein as lev
 import numpy as np
 
+from . import anchors
+from . import kernels
+from . import translit
+
 
 def monotonic_cost(cost=1):
     return cost
@@ -37,7 +44,9 @@ def decreasing_gap_cost(
 
 def jaro_rescored(a: str, b: str) -> int:
     # Compute and rescore similarity
-    sim = lev.jaro(a, b)
+    # (similarities below the cutoff are returned as 0 and all end up in the
+    # lowest bucket, so `Levenshtein` can stop early for them)
+    sim = lev.jaro(a, b, score_cutoff=0.33)
     if sim < 0.33:
         sim = -1
     elif sim < 0.66:
@@ -56,15 +65,39 @@ def levsim(a: str, b: str) -> float:
     return 1 - levdistance_normal(a, b)
 
 
+def levsim_max_distance(max_len: int) -> int:
+    """
+    Largest Levenshtein distance for which `levsim` is not rescored to -1 by
+    `levsim_rescored`, for tokens with maximum length `max_len`
+    """
+    try:
+        return _LEVSIM_MAX_DISTANCE[max_len]
+    except KeyError:
+        pass
+    # Evaluate the same float expression as `levsim`, so that the bound is exact
+    dist = max_len
+    while dist >= 0 and 1 - (dist / max_len) < 0.33:
+        dist -= 1
+    _LEVSIM_MAX_DISTANCE[max_len] = dist
+    return dist
+
+
+_LEVSIM_MAX_DISTANCE: Dict[int, int] = {}
+
+
 def levsim_rescored(a: str, b: str) -> int:
-    sim = levsim(a, b)
-    if sim < 0.33:
-        sim = -1
-    # elif sim < 0.66:
-    #     sim = 0
-    # else:
-    #     sim = 1
-    return sim
+    len_a = len(a)
+    len_b = len(b)
+    max_len = max(len_a, len_b)
+    max_dist = levsim_max_distance(max_len)
+    # The distance is at least the difference in length; beyond `max_dist`,
+    # `Levenshtein` stops early and returns `max_dist + 1`
+    if abs(len_a - len_b) > max_dist:
+        return -1
+    dist = lev.distance(a, b, score_cutoff=max_dist)
+    if dist > max_dist:
+        return -1
+    return 1 - (dist / max_len)
 
 
 def length_discount(gap_cost, token):
@@ -84,7 +117,8 @@ class AlignedPair:
     b: Union[int, None]
 
     def __iter__(self):
-        return iter(astuple(self))
+        # Not `dataclasses.astuple`, which deep-copies the fields
+        return iter((self.a, self.b))
 
 
 class Aligner:
@@ -93,9 +127,13 @@ class Aligner:
         tokens_a: Optional[List[str]] = None,
         tokens_b: Optional[List[str]] = None,
         aligned_tokidxs: Optional[List[AlignedPair]] = None,
+        workspace: Optional[kernels.Workspace] = None,
     ):
         """
         Class for creating alignments of two tokenized texts
+
+        `workspace` : Buffers for the DP kernels, pass the same workspace to
+        many aligners (e.g. one per split) to reuse them
         """
 
         # String representation of tokens
@@ -112,6 +150,23 @@ class Aligner:
             [] if aligned_tokidxs is None else aligned_tokidxs
         )
 
+        # Distance function for the refinement of alignments (`clean_alignments`)
+        self.distance_func: Callable[[str, str], float] = levdistance_normal
+
+        # DP strategy used by the last call of `nw_align`
+        self.strategy: Optional[str] = None
+
+        # Buffers for the DP kernels
+        self.workspace: kernels.Workspace = (
+            kernels.Workspace() if workspace is None else workspace
+        )
+
+        # Counters
+        # Number of DP cells computed by the alignment algorithm
+        self.n_dp_cells: int = 0
+        # Number of calls to the similarity function
+        self.n_similarity_calls: int = 0
+
     def nw_align(
         self,
         a: Optional[List[str]] = None,
@@ -121,9 +176,47 @@ class Aligner:
         gap_cost_length_discount: Callable = length_discount,
         gap_cost_initial: float = 0.5,
         cost_reduction_factor: float = 0.1,
+        strategy: str = "auto",
+        memory_budget: int = kernels.DEFAULT_MEMORY_BUDGET,
+        band_width: int = kernels.DEFAULT_BAND_WIDTH,
+        gap_model: str = "running",
+        trim_identical: bool = False,
+        anchor_unique: bool = False,
+        sparse_density: float = kernels.DEFAULT_SPARSE_DENSITY,
+        sparse_min_similarity: float = kernels.DEFAULT_SPARSE_MIN_SIMILARITY,
     ) -> None:
         """
         Needleman-Wunsch algorithm for global alignment
+
+        `strategy` : How much of the DP matrix to keep in memory, one of `full`,
+        `checkpoint` (same result as `full` with much less memory, but twice the
+        compute) or `banded` (only cells within `band_width` tokens around the
+        diagonal). With `auto`, the first strategy (in this order) whose
+        estimated memory fits into `memory_budget` (bytes) is selected; pointer
+        matrices that the workspace spills to disk don't count (see
+        `kernels.Workspace`).
+        `sparse` only considers cells of tokens with a similarity above
+        `sparse_min_similarity` and finds the best chain of them with linear gap
+        costs (see `kernels.SparseChainKernel`, not exact w.r.t.
+        `gap_cost_func`); if more than `sparse_density` of all cells are
+        candidates, `auto` is used.
+
+        `gap_model` : `running` threads a single gap cost through all cells
+        (see `gap_cost_func`). `affine` uses position-independent affine gap
+        costs (Gotoh): opening a gap costs `gap_cost_initial`, extending it
+        costs `gap_cost_initial * (1 - cost_reduction_factor)`, discounted by
+        `gap_cost_length_discount`; `gap_cost_func` is ignored. The affine
+        model is computed with array operations, but only supports strategy
+        `full`.
+
+        `trim_identical` : Align identical leading and trailing tokens of `a` and
+        `b` 1:1 and only run the DP on the tokens in between. If `a` and `b` are
+        identical, no DP is run at all (strategy `identical`).
+
+        `anchor_unique` : Align tokens that occur exactly once in both `a` and
+        `b` 1:1 (longest chain of such tokens in the same order) and only run
+        the DP on the tokens between consecutive anchors. `strategy` is the
+        strategy of the largest of these DPs.
         """
 
         if a is None:
@@ -131,102 +224,460 @@ class Aligner:
         if b is None:
             b = self._tokens_b
 
-        gap_cost = gap_cost_initial
+        # Peel off identical leading and trailing tokens
+        prefix, suffix = 0, 0
+        if trim_identical:
+            prefix, suffix = kernels.common_affixes(a, b)
+            if prefix == len(a) == len(b):
+                self.strategy = "identical"
+                self.aligned_tokidxs = [AlignedPair(i, i) for i in range(prefix)]
+                return
+            a = a[prefix : len(a) - suffix]
+            b = b[prefix : len(b) - suffix]
 
         n_a = len(a)
         n_b = len(b)
-        # Optimal score at each possible pair
-        scores = np.zeros((n_a + 1, n_b + 1))
-        scores[:, 0] = np.linspace(0, -n_a * gap_cost_initial, n_a + 1)
-        scores[0, :] = np.linspace(0, -n_b * gap_cost_initial, n_b + 1)
-
-        # Pointers to trace through an optimal aligment
-        pointers = np.zeros((n_a + 1, n_b + 1))
-        pointers[:, 0] = 3
-        pointers[0, :] = 4
-
-        # Temporary scores
-        t = np.zeros(3)
-        for i in range(n_a):
-            for j in range(n_b):
-                sim = similarity_func(a[i], b[j])
-
-                # Similarity as score for moving down right in the matrix
-                t[0] = scores[i, j] + sim
-
-                # Set costs
-                # TODO for now this only works with 'decreasing_gap_cost'
-                gap_cost_func_args = {
-                    "pointer": pointers[i, j],
-                    "cost": gap_cost,
-                    "initial_cost": gap_cost_initial,
-                    "cost_reduction_factor": cost_reduction_factor,
-                }
-                gap_cost = gap_cost_func(**gap_cost_func_args)
-
-                # Enter best score
-                # Optional: cost discount for short elements
-                # i.e. penalize dropping a short token less than dropping a longer one
-                if gap_cost_length_discount is not None:
-                    gap_cost_1 = gap_cost_length_discount(gap_cost, a[i])
-                    gap_cost_2 = gap_cost_length_discount(gap_cost, b[j])
-                else:
-                    gap_cost_1, gap_cost_2 = gap_cost
-                t[1] = scores[i, j + 1] - gap_cost_1
-                t[2] = scores[i + 1, j] - gap_cost_2
-                tmax = np.max(t)
-                scores[i + 1, j + 1] = tmax
-
-                # Adjust pointer
-                if t[0] == tmax:
-                    pointers[i + 1, j + 1] += 2
-                if t[1] == tmax:
-                    pointers[i + 1, j + 1] += 3
-                if t[2] == tmax:
-                    pointers[i + 1, j + 1] += 4
-
-        # Trace through an optimal alignment from bottom-right to top-left
-        i = n_a
-        j = n_b
-        rev_a: List[Union[int, None]] = []
-        rev_b: List[Union[int, None]] = []
-        while i > 0 or j > 0:
-            if pointers[i, j] in [2, 5, 6, 9]:
-                rev_a.append(i - 1)
-                rev_b.append(j - 1)
-                i -= 1
-                j -= 1
-            elif pointers[i, j] in [3, 5, 7, 9]:
-                rev_a.append(i - 1)
-                rev_b.append(None)
-                i -= 1
-            elif pointers[i, j] in [4, 6, 7, 9]:
-                rev_a.append(None)
-                rev_b.append(j - 1)
-                j -= 1
-
-        # Reverse the sequences and assign to class variable
+
+        if gap_model not in kernels.GAP_MODELS:
+            raise ValueError(
+                f"Unknown gap model: {gap_model}, must be in {kernels.GAP_MODELS}"
+            )
+        if strategy not in ("auto", "sparse", *kernels.STRATEGIES):
+            raise ValueError(
+                f"Unknown strategy: {strategy}, must be in {kernels.STRATEGIES}, "
+                "'auto' or 'sparse'"
+            )
+        if gap_model == "affine" and strategy not in ("auto", "full"):
+            raise ValueError(
+                f"Strategy {strategy} is not supported by gap model {gap_model}"
+            )
+
+        # Precompute the gap costs, the decreasing gap cost is computed inline
+        cost_model = kernels.GapCostModel.from_callables(
+            a,
+            b,
+            gap_cost_length_discount,
+            gap_cost_initial,
+            cost_reduction_factor,
+            None if gap_cost_func is decreasing_gap_cost else gap_cost_func,
+        )
+
+        # Tokens that occur exactly once in a and b, chained monotonically
+        chain = anchors.unique_anchors(a, b) if anchor_unique else []
+
+        # Run the DP on the segments between consecutive anchors
+        aligned_tokidxs = [AlignedPair(i, i) for i in range(prefix)]
+        largest_segment = -1
+        start_a, start_b = 0, 0
+        for end_a, end_b in chain + [(n_a, n_b)]:
+            n_cells = (end_a - start_a) * (end_b - start_b)
+            if end_a > start_a or end_b > start_b or largest_segment < 0:
+                segment_strategy = self._run_kernel(
+                    a[start_a:end_a],
+                    b[start_b:end_b],
+                    aligned_tokidxs,
+                    prefix + start_a,
+                    prefix + start_b,
+                    similarity_func,
+                    cost_model.slice(start_a, end_a, start_b, end_b),
+                    strategy,
+                    memory_budget,
+                    band_width,
+                    gap_model,
+                    sparse_density,
+                    sparse_min_similarity,
+                )
+                # Report the strategy of the largest segment
+                if n_cells > largest_segment:
+                    largest_segment = n_cells
+                    self.strategy = segment_strategy
+            if end_a < n_a:
+                aligned_tokidxs.append(AlignedPair(prefix + end_a, prefix + end_b))
+            start_a, start_b = end_a + 1, end_b + 1
+
+        aligned_tokidxs.extend(
+            AlignedPair(prefix + n_a + k, prefix + n_b + k) for k in range(suffix)
+        )
+        self.aligned_tokidxs = aligned_tokidxs
+
+        return
+
+    def _run_kernel(
+        self,
+        a: List[str],
+        b: List[str],
+        aligned_tokidxs: List[AlignedPair],
+        offset_a: int,
+        offset_b: int,
+        similarity_func: Callable,
+        cost_model: kernels.GapCostModel,
+        strategy: str,
+        memory_budget: int,
+        band_width: int,
+        gap_model: str,
+        sparse_density: float = kernels.DEFAULT_SPARSE_DENSITY,
+        sparse_min_similarity: float = kernels.DEFAULT_SPARSE_MIN_SIMILARITY,
+    ) -> str:
+        """
+        Align `a` and `b` with a DP kernel and append the alignment (with token
+        indices shifted by `offset_a` and `offset_b`) to `aligned_tokidxs`
+
+        Returns the strategy that was used.
+        """
+        kernel: Union[kernels.AffineGapKernel, kernels.RunningGapKernel]
+        result = None
+        if strategy == "sparse":
+            sparse_kernel = kernels.SparseChainKernel(
+                a, b, similarity_func, cost_model, sparse_min_similarity
+            )
+            result = sparse_kernel.chain(int(sparse_density * len(a) * len(b)))
+            self.n_dp_cells += sparse_kernel.n_cells
+            self.n_similarity_calls += sparse_kernel.n_similarity_calls
+            if result is None:
+                # Too many candidates, use a dense kernel
+                strategy = "auto"
+        if result is not None:
+            rev_a, rev_b = result
+        elif gap_model == "affine":
+            strategy = "full"
+            kernel = kernels.AffineGapKernel(
+                a, b, similarity_func, cost_model, self.workspace
+            )
+            rev_a, rev_b = kernel.full()
+            self.n_dp_cells += kernel.n_cells
+            self.n_similarity_calls += kernel.n_cells
+        else:
+            # Select the DP strategy
+            if strategy == "auto":
+                strategy = kernels.select_strategy(
+                    len(a),
+                    len(b),
+                    memory_budget,
+                    band_width,
+                    self.workspace.spill_threshold,
+                )
+            kernel = kernels.RunningGapKernel(
+                a, b, similarity_func, cost_model, workspace=self.workspace
+            )
+            if strategy == "full":
+                rev_a, rev_b = kernel.full()
+            elif strategy == "banded":
+                rev_a, rev_b = kernel.banded(band_width)
+            elif strategy == "checkpoint":
+                rev_a, rev_b = kernel.checkpoint()
+            else:
+                raise ValueError(
+                    f"Unknown strategy: {strategy}, must be in {kernels.STRATEGIES}"
+                )
+            self.n_dp_cells += kernel.n_cells
+            self.n_similarity_calls += kernel.n_cells
+
+        # Reverse the sequences and shift the indices
+        aligned_tokidxs.extend(
+            AlignedPair(
+                a=i + offset_a if i is not None else None,
+                b=j + offset_b if j is not None else None,
+            )
+            for (i, j) in zip(rev_a[::-1], rev_b[::-1])
+        )
+        return strategy
+
+    def nw_score(
+        self,
+        a: Optional[List[str]] = None,
+        b: Optional[List[str]] = None,
+        similarity_func: Callable = jaro_rescored,
+        gap_cost_func: Callable = decreasing_gap_cost,
+        gap_cost_length_discount: Callable = length_discount,
+        gap_cost_initial: float = 0.5,
+        cost_reduction_factor: float = 0.1,
+        min_similarity: Optional[float] = None,
+        max_similarity: float = 1.0,
+    ) -> Optional[Tuple[float, float]]:
+        """
+        Score of the optimal global alignment (same as `nw_align` with the
+        `running` gap model), without traceback and pointers
+
+        Returns the score and the score normalized by the length of the longer
+        sequence (1.0 for identical sequences with similarity 1.0 per token).
+        With `min_similarity`, the computation stops and None is returned as
+        soon as the normalized score can no longer reach it (`max_similarity`
+        is the upper bound of `similarity_func`). Does not change the
+        alignment.
+        """
+        if a is None:
+            a = self._tokens_a
+        if b is None:
+            b = self._tokens_b
+
+        cost_model = kernels.GapCostModel.from_callables(
+            a,
+            b,
+            gap_cost_length_discount,
+            gap_cost_initial,
+            cost_reduction_factor,
+            None if gap_cost_func is decreasing_gap_cost else gap_cost_func,
+        )
+        kernel = kernels.RunningGapKernel(a, b, similarity_func, cost_model)
+        length = max(len(a), len(b), 1)
+        min_score = None if min_similarity is None else min_similarity * length
+        score = kernel.score(min_score, max_similarity)
+        self.n_dp_cells += kernel.n_cells
+        self.n_similarity_calls += kernel.n_cells
+        if score is None:
+            return None
+        return score, score / length
+
+    def local_align(
+        self,
+        a: Optional[List[str]] = None,
+        b: Optional[List[str]] = None,
+        similarity_func: Callable = jaro_rescored,
+        gap_cost_func: Callable = decreasing_gap_cost,
+        gap_cost_length_discount: Callable = length_discount,
+        gap_cost_initial: float = 0.5,
+        cost_reduction_factor: float = 0.1,
+        gap_model: str = "running",
+    ) -> Tuple[int, int]:
+        """
+        Smith-Waterman algorithm for local alignment, e.g. to find an excerpt
+        `a` in a full text `b`
+
+        Only the best matching parts of `a` and `b` are aligned (with the same
+        similarity function and gap model as in `nw_align`), tokens outside of
+        them are not in `aligned_tokidxs`. Returns the matching span
+        `b[start:end]` (empty if no tokens are similar).
+        """
+        if a is None:
+            a = self._tokens_a
+        if b is None:
+            b = self._tokens_b
+
+        if gap_model not in kernels.GAP_MODELS:
+            raise ValueError(
+                f"Unknown gap model: {gap_model}, must be in {kernels.GAP_MODELS}"
+            )
+        cost_model = kernels.GapCostModel.from_callables(
+            a,
+            b,
+            gap_cost_length_discount,
+            gap_cost_initial,
+            cost_reduction_factor,
+            None if gap_cost_func is decreasing_gap_cost else gap_cost_func,
+        )
+        kernel: Union[kernels.AffineGapKernel, kernels.RunningGapKernel]
+        if gap_model == "affine":
+            kernel = kernels.AffineGapKernel(
+                a, b, similarity_func, cost_model, self.workspace
+            )
+        else:
+            kernel = kernels.RunningGapKernel(
+                a, b, similarity_func, cost_model, True, self.workspace
+            )
+        rev_a, rev_b, _, end_b = kernel.local_full()
+        self.n_dp_cells += kernel.n_cells
+        self.n_similarity_calls += kernel.n_cells
+
+        self.strategy = "local"
         self.aligned_tokidxs = [
-            AlignedPair(a, b) for (a, b) in zip(rev_a[::-1], rev_b[::-1])
+            AlignedPair(i, j) for (i, j) in zip(rev_a[::-1], rev_b[::-1])
         ]
+        start_b = next((j for j in rev_b[::-1] if j is not None), end_b)
+        return start_b, end_b
 
-        return
+    def diff_align(
+        self,
+        a: Optional[List[str]] = None,
+        b: Optional[List[str]] = None,
+        **nw_kwargs,
+    ) -> None:
+        """
+        Alignment for near-identical sequences (e.g. two versions of an edition)
+
+        Runs a token diff (patience diff, see `anchors.matching_blocks`) first,
+        aligns identical blocks 1:1 and only runs `nw_align` (with `nw_kwargs`)
+        on the regions that were replaced. Inserted or deleted regions are
+        aligned to gaps.
+        """
+        if a is None:
+            a = self._tokens_a
+        if b is None:
+            b = self._tokens_b
+
+        aligned_tokidxs: List[AlignedPair] = []
+        end_a, end_b = 0, 0
+        for start_a, start_b, size in anchors.matching_blocks(a, b) + [
+            (len(a), len(b), 0)
+        ]:
+            # Region between the previous block and this one
+            if start_a > end_a and start_b > end_b:
+                self.nw_align(a[end_a:start_a], b[end_b:start_b], **nw_kwargs)
+                aligned_tokidxs.extend(
+                    AlignedPair(
+                        a=pair.a + end_a if pair.a is not None else None,
+                        b=pair.b + end_b if pair.b is not None else None,
+                    )
+                    for pair in self.aligned_tokidxs
+                )
+            else:
+                aligned_tokidxs.extend(
+                    AlignedPair(i, None) for i in range(end_a, start_a)
+                )
+                aligned_tokidxs.extend(
+                    AlignedPair(None, j) for j in range(end_b, start_b)
+                )
+            # Identical block
+            aligned_tokidxs.extend(
+                AlignedPair(start_a + k, start_b + k) for k in range(size)
+            )
+            end_a, end_b = start_a + size, start_b + size
+
+        self.strategy = "diff"
+        self.aligned_tokidxs = aligned_tokidxs
+
+    def realign_edit(
+        self,
+        side: str,
+        start: int,
+        end: int,
+        new_tokens: List[str],
+        translit_func: Optional[Callable] = None,
+        context: int = 2,
+        max_aligned_tokens: int = 1,
+        **nw_kwargs,
+    ) -> Tuple[int, int]:
+        """
+        Replace the tokens `start:end` on side `side` (`a` or `b`) by
+        `new_tokens` and re-align only the region affected by the edit
+
+        The region reaches from the `context`-th 1:1 aligned pair before the
+        edit to the `context`-th 1:1 aligned pair after it. It is aligned with
+        `nw_align` (with `nw_kwargs`) and cleaned `max_aligned_tokens - 1`
+        times (see `clean_bidirectional`); the indices of all following pairs
+        are shifted. `translit_func` is applied to `new_tokens`.
+
+        The token lists are modified in place. Returns the range of a-indices
+        (after the edit) whose alignment was recomputed.
+        """
+        if side not in ("a", "b"):
+            raise ValueError(f"Unkown side: {side}, must be in {'a', 'b'}")
+        pairs = self.aligned_tokidxs
+        n = len(pairs)
+
+        def idx(pair: AlignedPair) -> Optional[int]:
+            return pair.a if side == "a" else pair.b
+
+        def is_linked(k: int) -> bool:
+            """Do pairs k-1 and k share a token (1:n alignment)?"""
+            prev, pair = pairs[k - 1], pairs[k]
+            return (prev.a is not None and prev.a == pair.a) or (
+                prev.b is not None and prev.b == pair.b
+            )
+
+        def is_before(k: int, limit: int) -> bool:
+            """Is pair k a gap on `side` or before token `limit`?"""
+            i = idx(pairs[k])
+            return i is None or i < limit
+
+        # 1. Pairs that contain the edited tokens
+        p = 0
+        while p < n and is_before(p, start):
+            p += 1
+        q = p
+        while q < n and is_before(q, end):
+            q += 1
+
+        # 2. Extend by `context` 1:1 pairs on both sides, without splitting
+        # 1:n alignments
+        k = 0
+        while p > 0 and k < context:
+            p -= 1
+            k += None not in pairs[p]
+        while 0 < p < n and is_linked(p):
+            p -= 1
+        k = 0
+        while q < n and k < context:
+            k += None not in pairs[q]
+            q += 1
+        while 0 < q < n and is_linked(q):
+            q += 1
+
+        # 3. Token ranges of the region: between the neighbouring pairs
+        def before() -> Iterator[AlignedPair]:
+            return itertools.islice(reversed(pairs), n - p, None)
+
+        def after() -> Iterator[AlignedPair]:
+            return itertools.islice(pairs, q, None)
+
+        lo_a = next((pair.a + 1 for pair in before() if pair.a is not None), 0)
+        lo_b = next((pair.b + 1 for pair in before() if pair.b is not None), 0)
+        hi_a = next(
+            (pair.a for pair in after() if pair.a is not None), len(self.tokens_a)
+        )
+        hi_b = next(
+            (pair.b for pair in after() if pair.b is not None), len(self.tokens_b)
+        )
+
+        # 4. Apply the edit
+        delta = len(new_tokens) - (end - start)
+        if translit_func is not None:
+            new_tokens_translit = [translit_func(tok) for tok in new_tokens]
+        else:
+            new_tokens_translit = list(new_tokens)
+        if side == "a":
+            self.tokens_a[start:end] = new_tokens
+            self._tokens_a[start:end] = new_tokens_translit
+            hi_a += delta
+        else:
+            self.tokens_b[start:end] = new_tokens
+            self._tokens_b[start:end] = new_tokens_translit
+            hi_b += delta
+
+        # 5. Re-align the region
+        region = Aligner(self.tokens_a[lo_a:hi_a], self.tokens_b[lo_b:hi_b])
+        region._tokens_a = self._tokens_a[lo_a:hi_a]
+        region._tokens_b = self._tokens_b[lo_b:hi_b]
+        region.nw_align(**nw_kwargs)
+        for _ in range(max_aligned_tokens - 1):
+            region.clean_bidirectional()
+        self.n_dp_cells += region.n_dp_cells
+        self.n_similarity_calls += region.n_similarity_calls
+
+        # 6. Patch the alignment, shift the indices after the region
+        shift_a = delta if side == "a" else 0
+        shift_b = delta if side == "b" else 0
+        self.aligned_tokidxs = pairs[:p]
+        for pairs_, offset_a, offset_b in (
+            (region.aligned_tokidxs, lo_a, lo_b),
+            (pairs[q:], shift_a, shift_b),
+        ):
+            self.aligned_tokidxs.extend(
+                AlignedPair(
+                    a=pair.a + offset_a if pair.a is not None else None,
+                    b=pair.b + offset_b if pair.b is not None else None,
+                )
+                for pair in pairs_
+            )
+
+        return lo_a, hi_a
 
     def translit_tokens(self, function: Optional[Callable]) -> None:
         """
         Store transliterations of tokens in self._tokens_a|b
 
         Default transliteration is identity mapping (nothing is changed).
+        Every distinct token is transliterated only once.
         """
 
         if function is None:
-
-            def identity(s):
-                return s
-
-            function = identity
-        self._tokens_a = [function(t) for t in self.tokens_a]
-        self._tokens_b = [function(t) for t in self.tokens_b]
+            self._tokens_a = list(self.tokens_a)
+            self._tokens_b = list(self.tokens_b)
+            return
+        vocab = translit.translit_vocab(
+            itertools.chain(self.tokens_a, self.tokens_b), function
+        )
+        self._tokens_a = translit.translit_tokens(self.tokens_a, vocab=vocab)
+        self._tokens_b = translit.translit_tokens(self.tokens_b, vocab=vocab)
 
     def clean_alignments(self) -> None:
         """
@@ -303,8 +754,8 @@ class Aligner:
                 candidate = this_a + next_a
                 next_b = self._tokens_b[self.aligned_tokidxs[i + 1].b]
                 # Is it better than the current alignment?
-                dist = levdistance_normal(candidate, next_b)
-                if dist < levdistance_normal(next_a, next_b):
+                dist = self.distance_func(candidate, next_b)
+                if dist < self.distance_func(next_a, next_b):
                     return dist
 
         return float("inf")
@@ -322,8 +773,8 @@ class Aligner:
                 candidate = prev_a + this_a
                 prev_b = self._tokens_b[self.aligned_tokidxs[i - 1].b]
                 # Is it better than the current alignment?
-                dist = levdistance_normal(candidate, prev_b)
-                if dist < levdistance_normal(prev_a, prev_b):
+                dist = self.distance_func(candidate, prev_b)
+                if dist < self.distance_func(prev_a, prev_b):
                     return dist
 
         return float("inf")
@@ -422,3 +873,136 @@ class Aligner:
             self._tokens_a.extend(other._tokens_a)
         if hasattr(self, "_tokens_b") and hasattr(other, "_tokens_b"):
             self._tokens_b.extend(other._tokens_b)
+
+
+def memoize(func: Callable[[str, str], float]) -> Callable[[str, str], float]:
+    """Version of a similarity (or distance) function that caches its values"""
+    memo: Dict[Tuple[str, str], float] = {}
+
+    @functools.wraps(func)
+    def memoized_func(a: str, b: str) -> float:
+        try:
+            return memo[a, b]
+        except KeyError:
+            value = memo[a, b] = func(a, b)
+            return value
+
+    return memoized_func
+
+
+def align_batch(
+    pairs: List[Tuple[List[str], List[str]]],
+    translit_func: Optional[Callable] = None,
+    max_aligned_tokens: int = 4,
+    min_group_size: int = 4,
+    **nw_kwargs,
+) -> List[List[AlignedPair]]:
+    """
+    Align many (short) pairs of token lists, e.g. sentence pairs
+
+    Same results as `Aligner.get_bidirectional_alignments` for every pair, but
+    the transliteration of the batch's vocabulary and the values of the
+    similarity and distance functions are computed once for the whole batch.
+    Pairs with the same number of tokens (at least `min_group_size` of them)
+    are aligned together, with one array operation per DP cell for the group
+    (`kernels.batch_pointers`). This requires the defaults of `nw_align` for
+    the gap cost function, the gap model and the strategy (`auto`/`full`,
+    where `full` is selected); otherwise, every pair is aligned on its own.
+
+    Returns the alignments in the order of `pairs`.
+    """
+    # 1. Transliterate the vocabulary of the batch once
+    if translit_func is None:
+        vocab = {}
+    else:
+        vocab = translit.translit_vocab(
+            itertools.chain.from_iterable(a + b for a, b in pairs), translit_func
+        )
+
+    # 2. Share the values of the similarity and distance functions
+    nw_kwargs = dict(nw_kwargs)
+    similarity_func = memoize(nw_kwargs.get("similarity_func", jaro_rescored))
+    nw_kwargs["similarity_func"] = similarity_func
+    distance_func = memoize(levdistance_normal)
+
+    # One workspace for all DP kernels of the batch
+    workspace = kernels.Workspace()
+    aligners = []
+    for tokens_a, tokens_b in pairs:
+        aligner = Aligner(tokens_a, tokens_b, workspace=workspace)
+        aligner._tokens_a = [vocab.get(tok, tok) for tok in tokens_a]
+        aligner._tokens_b = [vocab.get(tok, tok) for tok in tokens_b]
+        aligner.distance_func = distance_func
+        aligners.append(aligner)
+
+    # 3. Group pairs by shape
+    groups: Dict[Tuple[int, int], List[Aligner]] = {}
+    batchable = (
+        nw_kwargs.get("gap_cost_func", decreasing_gap_cost) is decreasing_gap_cost
+        and nw_kwargs.get("gap_model", "running") == "running"
+        and not nw_kwargs.get("trim_identical", False)
+        and not nw_kwargs.get("anchor_unique", False)
+    )
+    for aligner in aligners:
+        n_a, n_b = len(aligner._tokens_a), len(aligner._tokens_b)
+        strategy = nw_kwargs.get("strategy", "auto")
+        if strategy == "auto":
+            strategy = kernels.select_strategy(
+                n_a,
+                n_b,
+                nw_kwargs.get("memory_budget", kernels.DEFAULT_MEMORY_BUDGET),
+                nw_kwargs.get("band_width", kernels.DEFAULT_BAND_WIDTH),
+            )
+        if batchable and strategy == "full" and n_a > 0 and n_b > 0:
+            groups.setdefault((n_a, n_b), []).append(aligner)
+    for (n_a, n_b), group in groups.items():
+        if len(group) < min_group_size:
+            continue
+
+        # 4. Compute the pointers of the whole group, trace back every pair
+        cost_models = [
+            kernels.GapCostModel.from_callables(
+                aligner._tokens_a,
+                aligner._tokens_b,
+                nw_kwargs.get("gap_cost_length_discount", length_discount),
+                nw_kwargs.get("gap_cost_initial", 0.5),
+                nw_kwargs.get("cost_reduction_factor", 0.1),
+            )
+            for aligner in group
+        ]
+        sims = np.array(
+            [
+                [
+                    [similarity_func(ai, bj) for bj in aligner._tokens_b]
+                    for ai in aligner._tokens_a
+                ]
+                for aligner in group
+            ],
+            dtype=float,
+        )
+        pointers = kernels.batch_pointers(
+            sims,
+            np.array([cost_model.discount_a for cost_model in cost_models]),
+            np.array([cost_model.discount_b for cost_model in cost_models]),
+            cost_models[0].initial_cost,
+            cost_models[0].cost_reduction_factor,
+            workspace,
+        )
+        for k, aligner in enumerate(group):
+            rev_a, rev_b = kernels.traceback(n_a, n_b, lambda r, c: pointers[k, r, c])
+            aligner.aligned_tokidxs = [
+                AlignedPair(i, j) for (i, j) in zip(rev_a[::-1], rev_b[::-1])
+            ]
+            aligner.strategy = "full"
+            aligner.n_dp_cells += n_a * n_b
+            aligner.n_similarity_calls += n_a * n_b
+
+    # 5. Align the remaining pairs on their own, clean all alignments
+    alignments: List[List[AlignedPair]] = []
+    for aligner in aligners:
+        if aligner.strategy is None:
+            aligner.nw_align(**nw_kwargs)
+        for _ in range(max_aligned_tokens - 1):
+            aligner.clean_bidirectional()
+        alignments.append(aligner.aligned_tokidxs)
+    return alignments
@@ -1,75 +1,400 @@
-from typing import Dict, List
+from typing import Callable, Dict, Generator, List, Optional, Tuple
+from dataclasses import dataclass, field
 
-from .aligner import Aligner
+import contextlib
+import itertools
+import time
+
+from .aligner import AlignedPair, Aligner, jaro_rescored, levdistance_normal
+from .cache import SplitCache, array_to_alignment
 
 from . import sentences
 from .docsplit import DocSplitter
+from .kernels import Workspace
+from .simstore import SimilarityStore
+from . import translit
 from . import util
+from . import workers
+
+
+@dataclass
+class PipelineStats:
+    """
+    Timings and counters of a pipeline call
+
+    `durations` : Seconds spent in every stage of the pipeline (for the per-split
+    stages `align` and `extend`: summed over all splits)
+
+    `split_sizes` : Number of tokens (a, b) in every split
+    """
+
+    durations: Dict[str, float] = field(default_factory=dict)
+    split_sizes: List[Tuple[int, int]] = field(default_factory=list)
+    # Number of DP cells computed and calls to the similarity function (Aligner)
+    dp_cells: int = 0
+    similarity_calls: int = 0
+    # Number of fuzzy searches and back-off steps (DocSplitter)
+    fuzzy_searches: int = 0
+    backoff_steps: int = 0
+    # Number of splits aligned with each DP strategy (Aligner)
+    strategies: Dict[str, int] = field(default_factory=dict)
+    # Number of split alignments taken from the cache (SplitCache)
+    cache_hits: int = 0
+    # Number of similarities loaded from and added to the store (SimilarityStore)
+    similarities_loaded: int = 0
+    similarities_computed: int = 0
+    # Number of splits that were split again (DocSplitter, `resplit_cells`)
+    resplits: int = 0
+    # Seconds every worker process spent aligning splits and wall-clock seconds
+    # of aligning all splits in workers (`n_workers`)
+    worker_durations: Dict[int, float] = field(default_factory=dict)
+    parallel_duration: float = 0.0
+
+    @property
+    def n_splits(self) -> int:
+        return len(self.split_sizes)
+
+    @property
+    def load_balance(self) -> float:
+        """Mean busy time of the workers relative to the busiest worker (1: even)"""
+        if not self.worker_durations or max(self.worker_durations.values()) == 0:
+            return 1.0
+        durations = self.worker_durations.values()
+        return sum(durations) / len(durations) / max(durations)
+
+
+@dataclass
+class PipelineResult:
+    """
+    Aligned sentences of a pipeline call and its intermediates
+
+    `docsplitter` is None in mode `diff`
+    """
+
+    file_a: str
+    file_b: str
+    # Sentencized versions of docs: List[List[util.Token]]
+    doc_a: List[List[util.Token]] = field(default_factory=list)
+    doc_b: List[List[util.Token]] = field(default_factory=list)
+    # Flat versions of docs (no sentences): List[util.Token]
+    doc_flat_a: List[util.Token] = field(default_factory=list)
+    doc_flat_b: List[util.Token] = field(default_factory=list)
+    aligner: Aligner = field(default_factory=Aligner)
+    docsplitter: Optional[DocSplitter] = None
+    stats: PipelineStats = field(default_factory=PipelineStats)
+    aligned_sentences: List[sentences.AlignedSentence] = field(default_factory=list)
 
 
 class AlignmentPipeline:
-    def __init__(self, config: Dict = {}):
+    def __init__(
+        self,
+        config: Dict = {},
+        hook: Optional[Callable[[str, float, PipelineStats], None]] = None,
+    ):
+        """
+        `hook` : Optional callable that is called after every stage of the
+        pipeline with the stage's name, its duration and the current stats
+
+        The pipeline keeps no state of its calls (see `run`), so one instance
+        (and its split cache) can be used by several threads at once.
+        """
         self.config: Dict = config
-        self.file_a: str
-        self.file_b: str
-        self.doc_a: List[List[util.Token]]
-        self.doc_b: List[List[util.Token]]
-        self.doc_flat_a: List[util.Token]
-        self.doc_flat_b: List[util.Token]
-        self.aligner: Aligner
-        self.docsplitter: DocSplitter
+        self.hook = hook
+        self.split_cache: Optional[SplitCache] = None
+        if self.config.get("cache_dir") is not None:
+            self.split_cache = SplitCache(self.config["cache_dir"])
+
+    @contextlib.contextmanager
+    def _stage(self, stats: PipelineStats, name: str) -> Generator[None, None, None]:
+        """Time a stage of the pipeline and add its duration to `stats`"""
+        start = time.perf_counter()
+        yield
+        self._record(stats, name, time.perf_counter() - start)
+
+    def _record(self, stats: PipelineStats, name: str, duration: float) -> None:
+        """Add the duration of a stage to `stats`"""
+        stats.durations[name] = stats.durations.get(name, 0.0) + duration
+        if self.hook is not None:
+            self.hook(name, duration, stats)
+
+    def _workspace(self) -> Workspace:
+        """DP buffers, large ones optionally spilled to disk (see config)"""
+        return Workspace(
+            self.config.get("spill_threshold"), self.config.get("spill_dir")
+        )
 
     def __call__(self, file_a: str, file_b: str) -> List[sentences.AlignedSentence]:
+        """Aligned sentences of `file_a` and `file_b` (see `run`)"""
+        return self.run(file_a, file_b).aligned_sentences
+
+    def run(self, file_a: str, file_b: str) -> PipelineResult:
+        """Align `file_a` and `file_b`, return the sentences, intermediates and stats"""
         # 1. Load files to documents
-        self.file_a = file_a
-        self.file_b = file_b
+        result = PipelineResult(file_a, file_b)
+        stats = result.stats
 
         # Sentencized versions of docs: List[List[util.Token]]
         # TODO: generalize to non-WASTE input
-        self.doc_a = util.parse_waste_output(self.file_a)
-        self.doc_b = util.parse_waste_output(self.file_b)
+        with self._stage(stats, "parse"):
+            result.doc_a = util.parse_waste_output(result.file_a)
+            result.doc_b = util.parse_waste_output(result.file_b)
 
         # Flat versions of docs (no sentences): List[util.Token]
-        self.doc_flat_a = [tok for sent in self.doc_a for tok in sent]
-        self.doc_flat_b = [tok for sent in self.doc_b for tok in sent]
+        with self._stage(stats, "flatten"):
+            result.doc_flat_a = [tok for sent in result.doc_a for tok in sent]
+            result.doc_flat_b = [tok for sent in result.doc_b for tok in sent]
+
+        # Optional: look up similarities in a persistent store
+        aligner_kwargs = self.config["aligner"]
+        store = None
+        if self.config.get("similarity_store") is not None:
+            store = SimilarityStore(self.config["similarity_store"])
+            similarity_func = aligner_kwargs.get("similarity_func", jaro_rescored)
+            aligner_kwargs = {
+                **aligner_kwargs,
+                "similarity_func": store.wrap(similarity_func),
+            }
+
+        # Close the store even if a stage fails
+        try:
+            # 2.-6. Align the documents, either split by split or (for
+            # near-identical documents) as a whole with a token diff
+            if self.config.get("mode", "split") == "diff":
+                self._align_diff(result, aligner_kwargs, store)
+            else:
+                self._align_splits(result, aligner_kwargs, store)
+
+            # 7. Clean alignments for whole document
+            # Clean the 1:1 alignments n-1 times to get possible 1:n/n:1 alignments
+            with self._stage(stats, "clean"):
+                if store is not None:
+                    # Distances of (concatenations of two) tokens on one side to
+                    # the tokens on the other side (see `Aligner.clean_alignments`)
+                    tokens_a = result.aligner._tokens_a
+                    tokens_b = result.aligner._tokens_b
+                    for tokens, other in ((tokens_a, tokens_b), (tokens_b, tokens_a)):
+                        pairs = map("".join, zip(tokens, tokens[1:]))
+                        store.prefetch(
+                            levdistance_normal, itertools.chain(tokens, pairs), other
+                        )
+                    result.aligner.distance_func = store.wrap(levdistance_normal)
+                n = self.config["max_aligned_tokens"]
+                for _ in range(n - 1):
+                    result.aligner.clean_bidirectional()
+
+            # 8. Create sentence-aligned serialization
+            # Create a representation where the bitext is
+            #   (1) aligned by sentence
+            #   (2) serializable (contains whitespace info: `util.Token`)
+            with self._stage(stats, "sentences"):
+                start_idxs_a = util.get_sentence_start_idxs(result.doc_a)
+                result.aligned_sentences = sentences.get_aligned_sentences(
+                    result.aligner.aligned_tokidxs,  # List[AlignedPair]
+                    start_idxs_a,  # List[int]
+                    result.doc_flat_a,  # List[util.Token]
+                    result.doc_flat_b,  # List[util.Token]
+                    reset_tok_idxs=True,
+                )
+        finally:
+            if store is not None:
+                stats.similarities_loaded += store.n_loaded
+                stats.similarities_computed += store.n_computed
+                store.close()
 
+        return result
+
+    def _align_splits(
+        self,
+        result: PipelineResult,
+        aligner_kwargs: Dict,
+        store: Optional[SimilarityStore] = None,
+    ) -> None:
+        """Split the documents and align every split (mode `split`)"""
+        stats = result.stats
         # 2. Create an Aligner object for the entire doc
-        self.aligner = Aligner()
+        result.aligner = Aligner()
 
         # 3. Get split positions of documents
-        self.docsplitter = DocSplitter(
-            [tok.text for tok in self.doc_flat_a],  # List[str]
-            [tok.text for tok in self.doc_flat_b],  # List[str]
-            **self.config["splitter"],  # kwargs
-        )
+        with self._stage(stats, "split"):
+            docsplitter = DocSplitter(
+                [tok.text for tok in result.doc_flat_a],  # List[str]
+                [tok.text for tok in result.doc_flat_b],  # List[str]
+                **self.config["splitter"],  # kwargs
+            )
+            split_positions = docsplitter.find_split_positions()
+        result.docsplitter = docsplitter
+        stats.fuzzy_searches = docsplitter.n_fuzzy_searches
+        stats.backoff_steps = docsplitter.n_backoff_steps
+
+        # Optional: split splits with too many DP cells again
+        bounds = docsplitter.split_bounds(split_positions)
+        if self.config.get("resplit_cells") is not None:
+            with self._stage(stats, "split"):
+                bounds = docsplitter.resplit_bounds(
+                    bounds, self.config["resplit_cells"]
+                )
+            stats.resplits = docsplitter.n_resplits
+
+        # Optional: align the splits in worker processes
+        n_workers = self.config.get("n_workers", 0)
+        if n_workers > 1:
+            self._align_splits_parallel(result, docsplitter, bounds, n_workers)
+            return
+        split_cache = self.split_cache
+
+        # DP buffers shared by the aligners of all splits
+        workspace = self._workspace()
 
         # 4. Iterate over splits
-        for split_a, split_b in self.docsplitter.split():
+        for start_a, end_a, start_b, end_b in bounds:
+            split_a = docsplitter.tokens_a[start_a:end_a]
+            split_b = docsplitter.tokens_b[start_b:end_b]
+            stats.split_sizes.append((len(split_a), len(split_b)))
+
             # 5. Create Aligner objects for every split
-            aligner_split = Aligner(split_a, split_b)
-            aligner_split.translit_tokens(self.config["translit_func"])
-            aligner_split.nw_align(**self.config["aligner"])
+            # (optional: take the alignment from the cache)
+            with self._stage(stats, "align"):
+                aligner_split = Aligner(split_a, split_b, workspace=workspace)
+                aligner_split.translit_tokens(self.config["translit_func"])
+                if split_cache is not None:
+                    key = split_cache.key(
+                        split_a,
+                        split_b,
+                        self.config["translit_func"],
+                        self.config["aligner"],
+                    )
+                    cached = split_cache.get(key)
+                if split_cache is None or cached is None:
+                    if store is not None:
+                        store.prefetch(
+                            aligner_kwargs["similarity_func"],
+                            aligner_split._tokens_a,
+                            aligner_split._tokens_b,
+                        )
+                    aligner_split.nw_align(**aligner_kwargs)
+                    if split_cache is not None:
+                        split_cache.put(key, aligner_split.aligned_tokidxs)
+                else:
+                    aligner_split.aligned_tokidxs = cached
+                    aligner_split.strategy = "cached"
+                    stats.cache_hits += 1
+            stats.dp_cells += aligner_split.n_dp_cells
+            stats.similarity_calls += aligner_split.n_similarity_calls
+            # Set by `nw_align` (or to "cached" above)
+            strategy = aligner_split.strategy
+            assert strategy is not None
+            stats.strategies[strategy] = stats.strategies.get(strategy, 0) + 1
 
             # 6. Append the alignment for the split to the large aligner
-            self.aligner.extend(aligner_split)
-
-        # 7. Clean alignments for whole document
-        # Clean the 1:1 alignments n-1 times to get possible 1:n/n:1 alignments
-        n = self.config["max_aligned_tokens"]
-        for _ in range(n - 1):
-            self.aligner.clean_bidirectional()
-
-        # 8. Create sentence-aligned serialization
-        # Create a representation where the bitext is
-        #   (1) aligned by sentence
-        #   (2) serializable (contains whitespace info: `util.Token`)
-        start_idxs_a = util.get_sentence_start_idxs(self.doc_a)
-        aligned_sents = sentences.get_aligned_sentences(
-            self.aligner.aligned_tokidxs,  # List[AlignedPair]
-            start_idxs_a,  # List[int]
-            self.doc_flat_a,  # List[util.Token]
-            self.doc_flat_b,  # List[util.Token]
-            reset_tok_idxs=True,
-        )
+            with self._stage(stats, "extend"):
+                result.aligner.extend(aligner_split)
+
+    def _align_splits_parallel(
+        self,
+        result: PipelineResult,
+        docsplitter: DocSplitter,
+        bounds: List[workers.SplitBounds],
+        n_workers: int,
+    ) -> None:
+        """Align the splits in `n_workers` worker processes (see `workers`)"""
+        stats = result.stats
+        split_cache = self.split_cache
+        tokens_a = docsplitter.tokens_a
+        tokens_b = docsplitter.tokens_b
+
+        # Transliterate the documents once, workers only get these tokens
+        translit_func = self.config["translit_func"]
+        if translit_func is None:
+            translit_a, translit_b = list(tokens_a), list(tokens_b)
+        else:
+            vocab = translit.translit_vocab(
+                itertools.chain(tokens_a, tokens_b), translit_func
+            )
+            translit_a = translit.translit_tokens(tokens_a, vocab=vocab)
+            translit_b = translit.translit_tokens(tokens_b, vocab=vocab)
+
+        # Only send splits that are not in the cache
+        keys: List[str] = []
+        cached: List[Optional[List[AlignedPair]]] = [None] * len(bounds)
+        if split_cache is not None:
+            for k, (start_a, end_a, start_b, end_b) in enumerate(bounds):
+                keys.append(
+                    split_cache.key(
+                        tokens_a[start_a:end_a],
+                        tokens_b[start_b:end_b],
+                        translit_func,
+                        self.config["aligner"],
+                    )
+                )
+                cached[k] = split_cache.get(keys[k])
+        stats.cache_hits = sum(alignment is not None for alignment in cached)
+        pending = [b for b, alignment in zip(bounds, cached) if alignment is None]
+
+        start = time.perf_counter()
+        with workers.SplitExecutor(
+            translit_a,
+            translit_b,
+            self.config["aligner"],
+            n_workers,
+            self.config.get("similarity_store"),
+            self.config.get("spill_threshold"),
+            self.config.get("spill_dir"),
+        ) as executor:
+            results = executor.map(pending)
+            for k, (start_a, end_a, start_b, end_b) in enumerate(bounds):
+                stats.split_sizes.append((end_a - start_a, end_b - start_b))
+                aligner_split = Aligner(
+                    tokens_a[start_a:end_a], tokens_b[start_b:end_b]
+                )
+                aligner_split._tokens_a = translit_a[start_a:end_a]
+                aligner_split._tokens_b = translit_b[start_b:end_b]
+                alignment = cached[k]
+                if alignment is None:
+                    # Results arrive in the order of the splits
+                    split_result = next(results)
+                    duration = split_result.duration
+                    self._record(stats, "align", duration)
+                    stats.worker_durations[split_result.worker] = (
+                        stats.worker_durations.get(split_result.worker, 0.0) + duration
+                    )
+                    alignment = array_to_alignment(split_result.alignment)
+                    strategy = split_result.strategy
+                    stats.dp_cells += split_result.dp_cells
+                    stats.similarity_calls += split_result.similarity_calls
+                    stats.similarities_loaded += split_result.similarities_loaded
+                    stats.similarities_computed += split_result.similarities_computed
+                    if split_cache is not None:
+                        split_cache.put(keys[k], alignment)
+                else:
+                    strategy = "cached"
+                aligner_split.aligned_tokidxs = alignment
+                stats.strategies[strategy] = stats.strategies.get(strategy, 0) + 1
+
+                with self._stage(stats, "extend"):
+                    result.aligner.extend(aligner_split)
+        stats.parallel_duration = time.perf_counter() - start
 
-        return aligned_sents
+    def _align_diff(
+        self,
+        result: PipelineResult,
+        aligner_kwargs: Dict,
+        store: Optional[SimilarityStore] = None,
+    ) -> None:
+        """Align the whole documents with `Aligner.diff_align` (mode `diff`)"""
+        stats = result.stats
+        tokens_a = [tok.text for tok in result.doc_flat_a]
+        tokens_b = [tok.text for tok in result.doc_flat_b]
+        stats.split_sizes.append((len(tokens_a), len(tokens_b)))
+        with self._stage(stats, "align"):
+            result.aligner = Aligner(tokens_a, tokens_b, workspace=self._workspace())
+            result.aligner.translit_tokens(self.config["translit_func"])
+            if store is not None:
+                store.prefetch(
+                    aligner_kwargs["similarity_func"],
+                    result.aligner._tokens_a,
+                    result.aligner._tokens_b,
+                )
+            result.aligner.diff_align(**aligner_kwargs)
+        stats.dp_cells += result.aligner.n_dp_cells
+        stats.similarity_calls += result.aligner.n_similarity_calls
+        stats.strategies["diff"] = 1
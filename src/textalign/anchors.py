@@ -0,0 +1,106 @@
+from typing import Hashable, List, Sequence, Tuple
+
+import bisect
+import collections
+
+
+def longest_increasing_chain(pairs: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    """
+    Longest chain of `pairs` that is strictly increasing in both positions
+
+    `pairs` must be sorted by their first position (without duplicates).
+    Patience sorting: O(n log n).
+    """
+    # tails[k] := index (in pairs) of the smallest last element of a chain of
+    # length k+1, tail_values[k] := its second position
+    tails: List[int] = []
+    tail_values: List[int] = []
+    predecessors: List[int] = []
+    for idx, (_, j) in enumerate(pairs):
+        k = bisect.bisect_left(tail_values, j)
+        predecessors.append(tails[k - 1] if k > 0 else -1)
+        if k == len(tails):
+            tails.append(idx)
+            tail_values.append(j)
+        else:
+            tails[k] = idx
+            tail_values[k] = j
+
+    # Follow the predecessors from the end of the longest chain
+    chain = []
+    idx = tails[-1] if tails else -1
+    while idx >= 0:
+        chain.append(pairs[idx])
+        idx = predecessors[idx]
+    return chain[::-1]
+
+
+def unique_anchors(
+    a: Sequence[Hashable], b: Sequence[Hashable]
+) -> List[Tuple[int, int]]:
+    """
+    Positions (i, j) of elements with `a[i] == b[j]` that occur exactly once
+    in both `a` and `b`, chained monotonically (longest increasing chain)
+    """
+    counts_a = collections.Counter(a)
+    counts_b = collections.Counter(b)
+    positions_b = {elem: j for j, elem in enumerate(b) if counts_b[elem] == 1}
+    pairs = [
+        (i, positions_b[elem])
+        for i, elem in enumerate(a)
+        if counts_a[elem] == 1 and elem in positions_b
+    ]
+    return longest_increasing_chain(pairs)
+
+
+def matching_blocks(
+    a: Sequence[Hashable], b: Sequence[Hashable]
+) -> List[Tuple[int, int, int]]:
+    """
+    Blocks (i, j, size) with `a[i:i+size] == b[j:j+size]`, increasing in i and j
+
+    Patience diff: identical prefix and suffix are matched, then elements that
+    are unique in both sequences are chained as anchors and the ranges between
+    consecutive anchors are matched the same way. Ranges without unique
+    elements remain unmatched.
+    """
+    matches: List[Tuple[int, int]] = []
+    ranges = [(0, len(a), 0, len(b))]
+    while ranges:
+        lo_a, hi_a, lo_b, hi_b = ranges.pop()
+        # Identical prefix and suffix
+        while lo_a < hi_a and lo_b < hi_b and a[lo_a] == b[lo_b]:
+            matches.append((lo_a, lo_b))
+            lo_a += 1
+            lo_b += 1
+        while lo_a < hi_a and lo_b < hi_b and a[hi_a - 1] == b[hi_b - 1]:
+            hi_a -= 1
+            hi_b -= 1
+            matches.append((hi_a, hi_b))
+        if lo_a == hi_a or lo_b == hi_b:
+            continue
+
+        # Unique anchors, continue with the ranges between them
+        chain = unique_anchors(a[lo_a:hi_a], b[lo_b:hi_b])
+        if not chain:
+            continue
+        prev_a, prev_b = lo_a, lo_b
+        for i, j in chain:
+            i += lo_a
+            j += lo_b
+            matches.append((i, j))
+            ranges.append((prev_a, i, prev_b, j))
+            prev_a, prev_b = i + 1, j + 1
+        ranges.append((prev_a, hi_a, prev_b, hi_b))
+
+    # Merge consecutive matches to blocks
+    matches.sort()
+    blocks: List[Tuple[int, int, int]] = []
+    for i, j in matches:
+        if blocks:
+            start_i, start_j, size = blocks[-1]
+            if i == start_i + size and j == start_j + size:
+                blocks[-1] = (start_i, start_j, size + 1)
+                continue
+        blocks.append((i, j, 1))
+    return blocks
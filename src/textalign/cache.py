@@ -0,0 +1,109 @@
+# Persistent, content-addressed cache for the alignments of document splits
+#
+# Splits that did not change since the last run (same tokens, same
+# transliteration function, same aligner parameters) don't have to be aligned
+# again. Every alignment is stored as a single `.npy` file (2 x n int32 array,
+# -1 for None), named after the hash of its key.
+
+from typing import Any, Dict, List, Optional
+
+import hashlib
+import os
+import tempfile
+
+import numpy as np
+
+from .aligner import AlignedPair
+
+# Increase when the alignment algorithm changes, invalidates all entries
+CACHE_VERSION = 1
+
+
+def _describe(value: Any) -> str:
+    """Stable description of a parameter value, functions by their name"""
+    if callable(value):
+        name = getattr(value, "__qualname__", repr(value))
+        return f"{getattr(value, '__module__', '')}.{name}"
+    if isinstance(value, dict):
+        items = (f"{k}:{_describe(value[k])}" for k in sorted(value))
+        return "{" + ",".join(items) + "}"
+    return repr(value)
+
+
+def alignment_to_array(alignment: List[AlignedPair]) -> np.ndarray:
+    """Alignment as 2 x n int32 array, -1 for None"""
+    return np.array(
+        [
+            [-1 if pair.a is None else pair.a for pair in alignment],
+            [-1 if pair.b is None else pair.b for pair in alignment],
+        ],
+        dtype=np.int32,
+    ).reshape(2, len(alignment))
+
+
+def array_to_alignment(idxs: np.ndarray) -> List[AlignedPair]:
+    """Inverse of `alignment_to_array`"""
+    return [
+        AlignedPair(a if a >= 0 else None, b if b >= 0 else None)
+        for a, b in zip(idxs[0].tolist(), idxs[1].tolist())
+    ]
+
+
+class SplitCache:
+    def __init__(self, directory: str):
+        """
+        Cache for split alignments in `directory`
+
+        Entries are never invalidated (except via `CACHE_VERSION`), as their
+        key covers everything the alignment depends on.
+        """
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+        # Counters
+        self.n_hits: int = 0
+        self.n_misses: int = 0
+
+    @staticmethod
+    def key(
+        tokens_a: List[str],
+        tokens_b: List[str],
+        translit_func: Optional[Any] = None,
+        params: Optional[Dict[str, Any]] = None,
+    ) -> str:
+        """Hash of a split's tokens, the transliteration and aligner parameters"""
+        h = hashlib.sha256()
+        h.update(f"{CACHE_VERSION}\n".encode())
+        h.update(f"{_describe(translit_func)}\n{_describe(params or {})}\n".encode())
+        for tokens in (tokens_a, tokens_b):
+            # Separate tokens and sides by characters that are not in tokens
+            h.update("\x1f".join(tokens).encode("utf-8", "surrogatepass"))
+            h.update(b"\x1e")
+        return h.hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.npy")
+
+    def get(self, key: str) -> Optional[List[AlignedPair]]:
+        """Return the cached alignment for `key` or None"""
+        try:
+            idxs = np.load(self._path(key))
+        except (FileNotFoundError, ValueError, OSError):
+            self.n_misses += 1
+            return None
+        self.n_hits += 1
+        return array_to_alignment(idxs)
+
+    def put(self, key: str, alignment: List[AlignedPair]) -> None:
+        """Store `alignment` for `key` (atomically)"""
+        idxs = alignment_to_array(alignment)
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.save(f, idxs)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
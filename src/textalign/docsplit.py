@@ -5,14 +5,20 @@
 
 from typing import Callable, Dict, Generator, List, Optional, Tuple
 
-from collections import namedtuple
+from collections import Counter, namedtuple
+
+import bisect
 
 import fuzzysearch
 
+from . import anchors
+from . import translit
 from . import util
 
 SplitPosition = namedtuple("SplitPosition", ["start_a", "end_a", "start_b", "end_b"])
 
+SPLIT_STRATEGIES = ("fuzzy", "ngram")
+
 
 class DocSplitter:
     def __init__(
@@ -24,6 +30,7 @@ class DocSplitter:
         max_lev_dist: int = 7,
         step_size: int = 20,  # TODO: maybe change dynamically (e.g. increase after each step)?
         translit_func: Optional[Callable] = None,
+        strategy: str = "fuzzy",
     ):
         """
         A class for splitting documents at positions where they match well
@@ -49,6 +56,12 @@ class DocSplitter:
 
         `apply_translit` : Whether to apply transliteration before fuzzy search
 
+        `strategy` : How to find split positions. `fuzzy` fuzzy-searches
+        character sequences of `subseq_len` tokens from text A in text B. `ngram`
+        hashes the (transliterated) token n-grams (n = `subseq_len`) of both
+        texts and chains the n-grams that occur exactly once in both texts
+        (single pass, no fuzzy search, but n-grams must match exactly)
+
         """
         # Texts, tokenized
         self.tokens_a: List[str] = tokens_a
@@ -73,6 +86,20 @@ class DocSplitter:
         self.step_size: int = step_size
         # Apply transliteration before fuzzy search
         self.translit_func: Optional[Callable] = translit_func
+        # How to find split positions
+        if strategy not in SPLIT_STRATEGIES:
+            raise ValueError(
+                f"Unknown strategy: {strategy}, must be in {SPLIT_STRATEGIES}"
+            )
+        self.strategy: str = strategy
+
+        # Counters
+        # Number of fuzzy searches run (in text A and B)
+        self.n_fuzzy_searches: int = 0
+        # Number of back-off steps (moving the search pattern back by `step_size`)
+        self.n_backoff_steps: int = 0
+        # Number of splits that were split again (`resplit_bounds`)
+        self.n_resplits: int = 0
 
     @staticmethod
     def _get_offset2tokidx(doc: List[str]) -> Dict[int, int]:
@@ -109,6 +136,7 @@ class DocSplitter:
         return tokidx_b
 
     def _unique_in_a(self, pattern_a) -> bool:
+        self.n_fuzzy_searches += 1
         near_matches = fuzzysearch.find_near_matches(
             pattern_a,
             self.a_joined,
@@ -116,6 +144,15 @@ class DocSplitter:
         )
         return len(near_matches) == 1
 
+    def _find_near_matches_b(self, pattern_a: str, last_charidx_b: int) -> List:
+        """Get near-matches of `pattern_a` in the remaining part of b"""
+        self.n_fuzzy_searches += 1
+        return fuzzysearch.find_near_matches(
+            pattern_a,
+            self.b_joined[last_charidx_b:],
+            max_l_dist=self.max_lev_dist,
+        )
+
     def find_split_positions(self) -> List[SplitPosition]:
         """
         Returns a list of pairs (start_a, start_b) where start_a [start_b] is the index of the first token in tokens_a [tokens_b] that should go in the next split.
@@ -125,6 +162,8 @@ class DocSplitter:
         Use the output as follows: Create a split from tokens_a[prev_start_a:start_a]
         (same for for tokens_b)
         """
+        if self.strategy == "ngram":
+            return self._find_split_positions_ngram()
 
         split_positions = []
 
@@ -145,11 +184,7 @@ class DocSplitter:
             if unique_in_a:
                 # Get offsets of near-matches of pattern_a in b
                 # only look at the remaining part of b
-                near_matches = fuzzysearch.find_near_matches(
-                    pattern_a,
-                    self.b_joined[last_charidx_b:],
-                    max_l_dist=self.max_lev_dist,
-                )
+                near_matches = self._find_near_matches_b(pattern_a, last_charidx_b)
 
             else:
                 near_matches = []  # empty list
@@ -158,6 +193,7 @@ class DocSplitter:
             while (not unique_in_a) or (len(near_matches) != 1):
                 # Decrease index (= look for a matching pattern earlier in the doc)
                 tokidx_a -= self.step_size
+                self.n_backoff_steps += 1
 
                 # If we didn't find a match before hitting the last index:
                 # Jump up to the next possible position to search for matches
@@ -180,11 +216,7 @@ class DocSplitter:
                 if not unique_in_a:
                     continue
                 # If the pattern is unique get near_matches
-                near_matches = fuzzysearch.find_near_matches(
-                    pattern_a,
-                    self.b_joined[last_charidx_b:],
-                    max_l_dist=self.max_lev_dist,
-                )
+                near_matches = self._find_near_matches_b(pattern_a, last_charidx_b)
 
             # while-loop finished because there is only a single near match
             else:
@@ -212,32 +244,164 @@ class DocSplitter:
 
         return split_positions
 
-    def split(self) -> Generator[Tuple[List[str], List[str]], None, None]:
-        """Generates document splits"""
+    def _unique_ngram_anchors(self) -> List[Tuple[int, int]]:
+        """
+        Start indices (i, j) of token n-grams (n = `subseq_len`) that are
+        identical in a and b and occur exactly once in both texts, chained
+        monotonically
+        """
+        n = self.subseq_len
+        if self.translit_func is not None:
+            vocab = translit.translit_vocab(
+                self.tokens_a + self.tokens_b, self.translit_func
+            )
+            tokens_a = translit.translit_tokens(self.tokens_a, vocab=vocab)
+            tokens_b = translit.translit_tokens(self.tokens_b, vocab=vocab)
+        else:
+            tokens_a, tokens_b = self.tokens_a, self.tokens_b
+
+        ngrams_a = [tuple(tokens_a[i : i + n]) for i in range(len(tokens_a) - n + 1)]
+        ngrams_b = [tuple(tokens_b[j : j + n]) for j in range(len(tokens_b) - n + 1)]
+        counts_a = Counter(ngrams_a)
+        counts_b = Counter(ngrams_b)
+        starts_b = {
+            ngram: j for j, ngram in enumerate(ngrams_b) if counts_b[ngram] == 1
+        }
+        pairs = [
+            (i, starts_b[ngram])
+            for i, ngram in enumerate(ngrams_a)
+            if counts_a[ngram] == 1 and ngram in starts_b
+        ]
+        return anchors.longest_increasing_chain(pairs)
+
+    def _find_split_positions_ngram(self) -> List[SplitPosition]:
+        """
+        Split positions from unique token n-grams (strategy `ngram`)
+
+        Like the `fuzzy` strategy, aims at a split position every `max_len_split`
+        tokens of a: takes the last anchor before that position or, if there
+        is none, the first one after it.
+        """
+        chain = self._unique_ngram_anchors()
+        starts_a = [i for i, _ in chain]
+
+        split_positions = []
+        last_start_a = 0
+        k = 0
+        while last_start_a + self.max_len_split <= len(self.tokens_a) - self.subseq_len:
+            target = last_start_a + self.max_len_split
+            # Last anchor up to the target position
+            k_next = bisect.bisect_right(starts_a, target, lo=k) - 1
+            if k_next < k or starts_a[k_next] <= last_start_a:
+                # No anchor before the target: take the first one after it
+                k_next = bisect.bisect_right(starts_a, target, lo=k)
+            if k_next >= len(chain):
+                break
+            start_a, start_b = chain[k_next]
+            split_positions.append(
+                SplitPosition(
+                    start_a=start_a,
+                    end_a=start_a + self.subseq_len,
+                    start_b=start_b,
+                    end_b=start_b + self.subseq_len,
+                )
+            )
+            last_start_a = start_a
+            k = k_next + 1
+
+        return split_positions
+
+    def split_bounds(
+        self, split_positions: Optional[List[SplitPosition]] = None
+    ) -> List[Tuple[int, int, int, int]]:
+        """
+        Token index bounds (start_a, end_a, start_b, end_b) of the document
+        splits, see `split`
+        """
         prev_start_idx_a = 0
         prev_start_idx_b = 0
 
-        split_positions = self.find_split_positions()
+        if split_positions is None:
+            split_positions = self.find_split_positions()
 
         if not len(split_positions):
             raise ValueError(
                 "DocSplitter cannot find any common splits for the two documents with given parameters."
             )
 
+        bounds = []
         for split_position in split_positions:
-            # print(f"Match: " )
-            # print(self.tokens_a[split_position.start_a:split_position.end_a])
-            # print(self.tokens_b[split_position.start_b:split_position.end_b])
-
-            split_a = self.tokens_a[prev_start_idx_a : split_position.start_a]
-            split_b = self.tokens_b[prev_start_idx_b : split_position.start_b]
-
+            bounds.append(
+                (
+                    prev_start_idx_a,
+                    split_position.start_a,
+                    prev_start_idx_b,
+                    split_position.start_b,
+                )
+            )
             prev_start_idx_a = split_position.start_a
             prev_start_idx_b = split_position.start_b
 
-            yield split_a, split_b
-
         # Final split
-        split_a = self.tokens_a[prev_start_idx_a:]
-        split_b = self.tokens_b[prev_start_idx_b:]
-        yield split_a, split_b
+        bounds.append(
+            (prev_start_idx_a, len(self.tokens_a), prev_start_idx_b, len(self.tokens_b))
+        )
+        return bounds
+
+    def resplit_bounds(
+        self, bounds: List[Tuple[int, int, int, int]], max_cells: int
+    ) -> List[Tuple[int, int, int, int]]:
+        """
+        Split splits with more than `max_cells` DP cells (tokens in a x tokens
+        in b) again, at tokens that occur exactly once in both parts of the
+        split (see `anchors.unique_anchors`)
+
+        The anchor that balances the cells of the two new splits best is used,
+        recursively. Splits without such tokens are kept.
+        """
+        if self.translit_func is not None:
+            vocab = translit.translit_vocab(
+                self.tokens_a + self.tokens_b, self.translit_func
+            )
+            tokens_a = translit.translit_tokens(self.tokens_a, vocab=vocab)
+            tokens_b = translit.translit_tokens(self.tokens_b, vocab=vocab)
+        else:
+            tokens_a, tokens_b = self.tokens_a, self.tokens_b
+
+        resplit = []
+        stack = list(reversed(bounds))
+        while stack:
+            start_a, end_a, start_b, end_b = stack.pop()
+            n_a, n_b = end_a - start_a, end_b - start_b
+            best = None
+            if n_a * n_b > max_cells:
+                chain = anchors.unique_anchors(
+                    tokens_a[start_a:end_a], tokens_b[start_b:end_b]
+                )
+                # Anchor with the smallest maximum of cells before and after it
+                costs = [
+                    (max(i * j, (n_a - i) * (n_b - j)), i, j)
+                    for i, j in chain
+                    if i > 0 or j > 0
+                ]
+                best = min(costs, default=None)
+            if best is None:
+                resplit.append((start_a, end_a, start_b, end_b))
+                continue
+            _, i, j = best
+            self.n_resplits += 1
+            stack.append((start_a + i, end_a, start_b + j, end_b))
+            stack.append((start_a, start_a + i, start_b, start_b + j))
+        return resplit
+
+    def split(
+        self, split_positions: Optional[List[SplitPosition]] = None
+    ) -> Generator[Tuple[List[str], List[str]], None, None]:
+        """
+        Generates document splits
+
+        Split positions are computed with `find_split_positions`, unless they
+        are passed as `split_positions`.
+        """
+        for start_a, end_a, start_b, end_b in self.split_bounds(split_positions):
+            yield self.tokens_a[start_a:end_a], self.tokens_b[start_b:end_b]
@@ -0,0 +1,1042 @@
+# Dynamic programming kernels for the Needleman-Wunsch algorithm (`Aligner.nw_align`)
+#
+# Kernels differ in how much of the DP matrix they keep in memory:
+#
+# * `full` : pointers for all cells (1 byte per cell), scores for two rows
+# * `banded` : only cells within a band around the diagonal
+# * `checkpoint` : scores/pointers for every k-th row, blocks of pointers are
+#   recomputed during traceback (~sqrt(n_a) rows in memory, twice the compute)
+#
+# `full` and `checkpoint` give identical alignments, `banded` is exact as long as
+# the optimal alignment stays within the band.
+#
+# Kernels also differ in their gap model:
+#
+# * `running` (`RunningGapKernel`) : a single running gap cost that is threaded
+#   through all cells (see `aligner.decreasing_gap_cost`), all strategies
+# * `affine` (`AffineGapKernel`) : position-independent affine gap costs with
+#   separate matrices per gap state (Gotoh), rows are computed with array
+#   operations, only strategy `full`
+#
+# Both gap models also have a local (Smith-Waterman) variant with all pointers
+# in memory (`local_full`, see `Aligner.local_align`).
+#
+# Pointer matrices are taken from a `Workspace`, which can be shared by many
+# alignments (e.g. all splits of a document) to reuse the buffers.
+#
+# Strategy `sparse` (`SparseChainKernel`) does not fill the DP matrix at all,
+# but chains candidate cells of similar tokens (linear gap costs). It falls back
+# to a dense strategy if there are too many candidates.
+
+from typing import Callable, Dict, List, Optional, Set, Tuple, Union
+from dataclasses import dataclass
+
+import logging
+import math
+import tempfile
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+STRATEGIES = ("full", "checkpoint", "banded")
+GAP_MODELS = ("running", "affine")
+
+# Default memory budget (in bytes) for a single alignment
+DEFAULT_MEMORY_BUDGET = 2**30
+# Default half-width of the band (in tokens) for the banded strategy
+DEFAULT_BAND_WIDTH = 100
+# Default maximum share of candidate cells for the sparse strategy
+DEFAULT_SPARSE_DENSITY = 0.1
+# Default minimum similarity of candidate cells for the sparse strategy
+DEFAULT_SPARSE_MIN_SIMILARITY = 0.5
+
+# Approximate memory per entry of a row kept as a Python list (pointer + float)
+ROW_ENTRY_BYTES = 40
+# Memory per cell of the pointer matrix (uint8)
+POINTER_BYTES = 1
+# Memory per entry of a stored checkpoint row (float64 score + uint8 pointer)
+CHECKPOINT_ENTRY_BYTES = 9
+
+# Pointer values, a cell can combine several directions:
+# diagonal (2), up (3, gap in b) and left (4, gap in a)
+DIAG = (2, 5, 6, 9)
+UP = (3, 5, 7, 9)
+LEFT = (4, 6, 7, 9)
+
+NEG_INF = float("-inf")
+
+
+def common_affixes(a: List[str], b: List[str]) -> Tuple[int, int]:
+    """
+    Lengths of the identical prefix and suffix of `a` and `b`
+
+    Prefix and suffix do not overlap.
+    """
+    n = min(len(a), len(b))
+    prefix = 0
+    while prefix < n and a[prefix] == b[prefix]:
+        prefix += 1
+    suffix = 0
+    while suffix < n - prefix and a[-1 - suffix] == b[-1 - suffix]:
+        suffix += 1
+    return prefix, suffix
+
+
+def band_half_width(n_a: int, n_b: int, band_width: int) -> int:
+    """Half-width of the band, wide enough to connect consecutive rows"""
+    if n_a == 0:
+        return n_b
+    return max(band_width, math.ceil(n_b / n_a) + 1)
+
+
+def checkpoint_interval(n_a: int) -> int:
+    """
+    Number of rows between two checkpoints, balances the memory for checkpoints
+    and for the pointers of a block
+    """
+    ratio = CHECKPOINT_ENTRY_BYTES / POINTER_BYTES
+    return max(1, math.ceil(math.sqrt(ratio * (n_a + 1))))
+
+
+def estimate_memory(
+    n_a: int,
+    n_b: int,
+    strategy: str,
+    band_width: int = DEFAULT_BAND_WIDTH,
+    spill_threshold: Optional[int] = None,
+) -> int:
+    """
+    Estimate the memory (in bytes) needed to align sequences of length `n_a`
+    and `n_b` with the given strategy
+
+    Pointer matrices larger than `spill_threshold` are memory-mapped files
+    (see `Workspace`) and do not count.
+    """
+
+    def pointer_bytes(n_cells: int) -> int:
+        nbytes = n_cells * POINTER_BYTES
+        if spill_threshold is not None and nbytes > spill_threshold:
+            return 0
+        return nbytes
+
+    if strategy == "full":
+        return pointer_bytes((n_a + 1) * (n_b + 1)) + 2 * (n_b + 1) * ROW_ENTRY_BYTES
+    elif strategy == "banded":
+        width = min(2 * band_half_width(n_a, n_b, band_width) + 1, n_b + 1)
+        return pointer_bytes((n_a + 1) * width) + 2 * width * ROW_ENTRY_BYTES
+    elif strategy == "checkpoint":
+        k = checkpoint_interval(n_a)
+        n_checkpoints = math.ceil((n_a + 1) / k)
+        return (
+            n_checkpoints * (n_b + 1) * CHECKPOINT_ENTRY_BYTES
+            + pointer_bytes((k + 1) * (n_b + 1))
+            + 2 * (n_b + 1) * ROW_ENTRY_BYTES
+        )
+    raise ValueError(f"Unknown strategy: {strategy}, must be in {STRATEGIES}")
+
+
+def select_strategy(
+    n_a: int,
+    n_b: int,
+    memory_budget: int = DEFAULT_MEMORY_BUDGET,
+    band_width: int = DEFAULT_BAND_WIDTH,
+    spill_threshold: Optional[int] = None,
+) -> str:
+    """
+    Select the first strategy that fits into `memory_budget`
+
+    Prefers exact strategies (`full`, then `checkpoint`) over `banded`. If
+    nothing fits, `banded` is returned with a warning. With `spill_threshold`,
+    large pointer matrices are memory-mapped files and don't count (so `full`
+    is selected for much larger alignments).
+    """
+    for strategy in STRATEGIES:
+        memory = estimate_memory(n_a, n_b, strategy, band_width, spill_threshold)
+        if memory <= memory_budget:
+            log = logger.debug if strategy == "full" else logger.info
+            log(
+                "Aligning %d x %d tokens with strategy '%s' (~%d MB)",
+                n_a,
+                n_b,
+                strategy,
+                memory // 2**20,
+            )
+            return strategy
+    logger.warning(
+        "Aligning %d x %d tokens exceeds the memory budget (%d MB) for all "
+        "strategies, using 'banded' (~%d MB)",
+        n_a,
+        n_b,
+        memory_budget // 2**20,
+        memory // 2**20,
+    )
+    return "banded"
+
+
+@dataclass
+class GapCostModel:
+    """
+    Gap costs of an alignment, precomputed once per pair of sequences
+
+    `discount_a`, `discount_b` : Per-token factors the gap cost is multiplied
+    with when a token of a (or b) is aligned to a gap
+
+    `gap_cost_func` : Function that updates the running gap cost (see
+    `aligner.decreasing_gap_cost`); None for the decreasing gap cost, which is
+    then computed inline by the kernels
+    """
+
+    initial_cost: float
+    cost_reduction_factor: float
+    discount_a: List[float]
+    discount_b: List[float]
+    gap_cost_func: Optional[Callable] = None
+
+    @classmethod
+    def from_callables(
+        cls,
+        a: List[str],
+        b: List[str],
+        gap_cost_length_discount: Optional[Callable],
+        initial_cost: float,
+        cost_reduction_factor: float,
+        gap_cost_func: Optional[Callable] = None,
+    ) -> "GapCostModel":
+        """
+        Wrap a length discount function `gap_cost_length_discount(cost, token)`,
+        assuming that it scales `cost` by a factor that depends on the token only
+        (as `aligner.length_discount` does)
+        """
+        if gap_cost_length_discount is None:
+            discount_a = [1.0] * len(a)
+            discount_b = [1.0] * len(b)
+        else:
+            discount_a = [gap_cost_length_discount(1.0, tok) for tok in a]
+            discount_b = [gap_cost_length_discount(1.0, tok) for tok in b]
+        return cls(
+            initial_cost, cost_reduction_factor, discount_a, discount_b, gap_cost_func
+        )
+
+    def slice(self, start_a: int, end_a: int, start_b: int, end_b: int):
+        """Gap costs for the tokens `a[start_a:end_a]` and `b[start_b:end_b]`"""
+        return GapCostModel(
+            self.initial_cost,
+            self.cost_reduction_factor,
+            self.discount_a[start_a:end_a],
+            self.discount_b[start_b:end_b],
+            self.gap_cost_func,
+        )
+
+    @property
+    def extend_cost(self) -> float:
+        """Cost of extending a gap in the affine gap model"""
+        return self.initial_cost * (1 - self.cost_reduction_factor)
+
+
+class Workspace:
+    def __init__(
+        self, spill_threshold: Optional[int] = None, spill_dir: Optional[str] = None
+    ):
+        """
+        Buffers for the DP kernels (e.g. pointer matrices), reused across
+        alignments
+
+        A buffer only grows when a larger alignment arrives, so aligning many
+        splits doesn't allocate (and page-fault) a new matrix for every split.
+        Arrays from a workspace are only valid until the next request for a
+        buffer of the same name.
+
+        `spill_threshold` : Buffers larger than this (in bytes) are memory-mapped
+        temporary files in `spill_dir` (default: the system's temporary
+        directory) instead of RAM. The kernels fill pointer matrices row by row,
+        so the pages are written (and read back during traceback) in order.
+        """
+        self.spill_threshold = spill_threshold
+        self.spill_dir = spill_dir
+        self._buffers: Dict[str, np.ndarray] = {}
+
+        # Counters
+        # Number of buffer (re-)allocations
+        self.n_allocations: int = 0
+        # Number of buffers allocated as memory-mapped files
+        self.n_spilled: int = 0
+
+    def spills(self, nbytes: int) -> bool:
+        """Whether a buffer of `nbytes` bytes is memory-mapped"""
+        return self.spill_threshold is not None and nbytes > self.spill_threshold
+
+    def empty(self, name: str, shape: Tuple[int, ...], dtype=np.uint8) -> np.ndarray:
+        """Uninitialized array of `shape`, a view of the buffer `name`"""
+        size = math.prod(shape)
+        spill = self.spills(size * np.dtype(dtype).itemsize)
+        buffer = self._buffers.get(name)
+        if (
+            buffer is None
+            or buffer.size < size
+            or buffer.dtype != dtype
+            or isinstance(buffer, np.memmap) != spill
+        ):
+            # Grow a RAM buffer by at least 25 % to avoid reallocating for every
+            # larger split, but not beyond the spill threshold
+            if (
+                buffer is not None
+                and buffer.dtype == dtype
+                and not isinstance(buffer, np.memmap)
+                and not spill
+            ):
+                size = max(size, buffer.size * 5 // 4)
+                if self.spill_threshold is not None:
+                    max_size = self.spill_threshold // np.dtype(dtype).itemsize
+                    size = max(math.prod(shape), min(size, max_size))
+            # Release the previous buffer (and its file) first
+            self._buffers.pop(name, None)
+            del buffer
+            if spill:
+                # The file is deleted when the mapping is released
+                with tempfile.TemporaryFile(dir=self.spill_dir) as f:
+                    buffer = np.memmap(f, dtype=dtype, mode="w+", shape=(size,))
+                self.n_spilled += 1
+            else:
+                buffer = np.empty(size, dtype=dtype)
+            self._buffers[name] = buffer
+            self.n_allocations += 1
+        return buffer[: math.prod(shape)].reshape(shape)
+
+    def zeros(self, name: str, shape: Tuple[int, ...], dtype=np.uint8) -> np.ndarray:
+        """Like `empty`, but filled with zeros"""
+        array = self.empty(name, shape, dtype)
+        array.fill(0)
+        return array
+
+    @property
+    def nbytes(self) -> int:
+        """Memory of all buffers in bytes"""
+        return sum(buffer.nbytes for buffer in self._buffers.values())
+
+
+@dataclass
+class Row:
+    """
+    Row `r` of the DP matrix, covering the columns `lo` to `lo + len(scores) - 1`
+
+    `gap_cost` is the running gap cost after the last cell of the row.
+    """
+
+    r: int
+    lo: int
+    scores: List[float]
+    pointers: List[int]
+    gap_cost: float
+
+    @property
+    def hi(self) -> int:
+        return self.lo + len(self.scores) - 1
+
+
+class RunningGapKernel:
+    def __init__(
+        self,
+        a: List[str],
+        b: List[str],
+        similarity_func: Callable,
+        cost_model: GapCostModel,
+        local: bool = False,
+        workspace: Optional[Workspace] = None,
+    ):
+        """
+        Needleman-Wunsch kernels with a running gap cost
+
+        The gap cost (see `aligner.decreasing_gap_cost`) is a state that is
+        threaded through the cells in the order they are computed (row by row)
+        and depends on the pointer of the previously computed diagonal cell.
+        All kernels compute the cells in this order.
+
+        `local` : Smith-Waterman recurrence instead, cells with a score <= 0
+        are reset to 0 and get pointer 0 (start of a local alignment). Only
+        with `local_full`.
+
+        `workspace` : Buffers to reuse for the pointers (default: new arrays)
+        """
+        self.a = a
+        self.b = b
+        self.n_a = len(a)
+        self.n_b = len(b)
+        self.similarity_func = similarity_func
+        self.cost_model = cost_model
+        self.local = local
+        self.workspace = Workspace() if workspace is None else workspace
+        gap_cost_initial = 0.0 if local else cost_model.initial_cost
+
+        # Scores of first column and first row
+        self.col0: List[float] = np.linspace(
+            0, -self.n_a * gap_cost_initial, self.n_a + 1
+        ).tolist()
+        self.row0: List[float] = np.linspace(
+            0, -self.n_b * gap_cost_initial, self.n_b + 1
+        ).tolist()
+
+        # Number of computed cells
+        self.n_cells = 0
+
+    def first_row(self, lo: int = 0, hi: Optional[int] = None) -> Row:
+        """Row 0 of the DP matrix (columns `lo` to `hi`)"""
+        hi = self.n_b if hi is None else hi
+        return Row(
+            0,
+            lo,
+            self.row0[lo : hi + 1],
+            [0 if self.local else 4] * (hi - lo + 1),
+            self.cost_model.initial_cost,
+        )
+
+    def next_row(self, prev: Row, lo: int = 0, hi: Optional[int] = None) -> Row:
+        """
+        Compute the row after `prev` (columns `lo` to `hi`)
+
+        Cells outside of `prev` count as unreachable.
+        """
+        hi = self.n_b if hi is None else hi
+        r = prev.r + 1
+        ai = self.a[r - 1]
+        b = self.b
+        similarity_func = self.similarity_func
+        gap_cost_func = self.cost_model.gap_cost_func
+        gap_cost_initial = self.cost_model.initial_cost
+        cost_reduction_factor = self.cost_model.cost_reduction_factor
+        discount_ai = self.cost_model.discount_a[r - 1]
+        discount_b = self.cost_model.discount_b
+        local = self.local
+
+        prev_lo, prev_hi = prev.lo, prev.hi
+        prev_s, prev_p = prev.scores, prev.pointers
+        gap_cost = prev.gap_cost
+
+        scores: List[float] = []
+        pointers: List[int] = []
+        if lo == 0:
+            # First column
+            scores.append(self.col0[r])
+            pointers.append(0 if local else 3)
+        left = scores[-1] if scores else NEG_INF
+
+        for c in range(max(lo, 1), hi + 1):
+            bj = b[c - 1]
+            sim = similarity_func(ai, bj)
+
+            # Scores (and pointer) of the neighbouring cells in the previous row
+            k = c - 1 - prev_lo
+            if 0 <= k and c - 1 <= prev_hi:
+                diag = prev_s[k]
+                diag_pointer = prev_p[k]
+            else:
+                diag = NEG_INF
+                diag_pointer = 0
+            up = prev_s[k + 1] if prev_lo <= c <= prev_hi else NEG_INF
+
+            # Similarity as score for moving down right in the matrix
+            t0 = diag + sim
+
+            # Set costs (decreasing gap cost, if no other function is given)
+            if gap_cost_func is not None:
+                gap_cost = gap_cost_func(
+                    pointer=diag_pointer,
+                    cost=gap_cost,
+                    initial_cost=gap_cost_initial,
+                    cost_reduction_factor=cost_reduction_factor,
+                )
+            elif diag_pointer == 3 or diag_pointer == 4 or diag_pointer == 7:
+                gap_cost -= gap_cost * cost_reduction_factor
+            else:
+                gap_cost = gap_cost_initial
+
+            # Cost discount per token (e.g. for short elements)
+            t1 = up - gap_cost * discount_ai
+            t2 = left - gap_cost * discount_b[c - 1]
+            tmax = max(t0, t1, t2)
+
+            # Adjust pointer
+            pointer = 0
+            if t0 == tmax:
+                pointer += 2
+            if t1 == tmax:
+                pointer += 3
+            if t2 == tmax:
+                pointer += 4
+            if local and tmax <= 0:
+                tmax = 0.0
+                pointer = 0
+
+            scores.append(tmax)
+            pointers.append(pointer)
+            left = tmax
+
+        self.n_cells += hi - max(lo, 1) + 1
+        return Row(r, lo, scores, pointers, gap_cost)
+
+    def full(self) -> Tuple[List[Union[int, None]], List[Union[int, None]]]:
+        """Keep the pointers of all cells in memory"""
+        pointers = self.workspace.empty("pointers", (self.n_a + 1, self.n_b + 1))
+        row = self.first_row()
+        pointers[0, :] = row.pointers
+        for r in range(1, self.n_a + 1):
+            row = self.next_row(row)
+            pointers[r, :] = row.pointers
+        return traceback(self.n_a, self.n_b, lambda r, c: pointers[r, c])
+
+    def score(
+        self, min_score: Optional[float] = None, max_similarity: float = 1.0
+    ) -> Optional[float]:
+        """
+        Score of the optimal alignment, computed with two rows and no pointers
+
+        Returns None as soon as the score can no longer reach `min_score`, i.e.
+        when no cell of the current row can reach it with the remaining tokens
+        all aligned diagonally with similarity `max_similarity` (upper bound
+        of the similarity function) and gaps for free.
+        """
+        row = self.first_row()
+        # Maximum number of diagonal steps left from every column
+        remaining_b = np.arange(self.n_b, -1, -1)
+        for r in range(1, self.n_a + 1):
+            row = self.next_row(row)
+            if min_score is not None:
+                steps_left = np.minimum(remaining_b, self.n_a - r)
+                bound = np.max(np.array(row.scores) + max_similarity * steps_left)
+                if bound < min_score:
+                    return None
+        score = row.scores[-1]
+        if min_score is not None and score < min_score:
+            return None
+        return score
+
+    def local_full(
+        self,
+    ) -> Tuple[List[Union[int, None]], List[Union[int, None]], int, int]:
+        """
+        Best local alignment (`local` kernel), keeps the pointers of all cells
+
+        Returns the aligned indices of a and b in reverse order and the cell
+        where the alignment ends (the first cell with the best score).
+        """
+        pointers = self.workspace.empty("pointers", (self.n_a + 1, self.n_b + 1))
+        row = self.first_row()
+        pointers[0, :] = row.pointers
+        best, end_a, end_b = 0.0, 0, 0
+        for r in range(1, self.n_a + 1):
+            row = self.next_row(row)
+            pointers[r, :] = row.pointers
+            c = int(np.argmax(row.scores))
+            if row.scores[c] > best:
+                best, end_a, end_b = row.scores[c], r, c
+
+        # Trace back until the start of the local alignment (pointer 0)
+        rev_a: List[Union[int, None]] = []
+        rev_b: List[Union[int, None]] = []
+        i, j = end_a, end_b
+        pointer = pointers[i, j]
+        while pointer != 0:
+            if pointer in DIAG:
+                rev_a.append(i - 1)
+                rev_b.append(j - 1)
+                i -= 1
+                j -= 1
+            elif pointer in UP:
+                rev_a.append(i - 1)
+                rev_b.append(None)
+                i -= 1
+            else:
+                rev_a.append(None)
+                rev_b.append(j - 1)
+                j -= 1
+            pointer = pointers[i, j]
+        return rev_a, rev_b, end_a, end_b
+
+    def banded(
+        self, band_width: int = DEFAULT_BAND_WIDTH
+    ) -> Tuple[List[Union[int, None]], List[Union[int, None]]]:
+        """Only compute cells within `band_width` tokens around the diagonal"""
+        if self.n_a == 0:
+            return self.full()
+        w = band_half_width(self.n_a, self.n_b, band_width)
+        centers = np.rint(np.arange(self.n_a + 1) * self.n_b / self.n_a).astype(int)
+        los = np.clip(centers - w, 0, self.n_b)
+        his = np.clip(centers + w, 0, self.n_b)
+        width = int((his - los).max()) + 1
+        pointers = self.workspace.zeros("pointers", (self.n_a + 1, width))
+
+        row = self.first_row(los[0], his[0])
+        pointers[0, : len(row.pointers)] = row.pointers
+        for r in range(1, self.n_a + 1):
+            row = self.next_row(row, los[r], his[r])
+            pointers[r, : len(row.pointers)] = row.pointers
+        return traceback(self.n_a, self.n_b, lambda r, c: pointers[r, c - los[r]])
+
+    def checkpoint(
+        self, interval: Optional[int] = None
+    ) -> Tuple[List[Union[int, None]], List[Union[int, None]]]:
+        """
+        Only keep every `interval`-th row in memory and recompute the pointers
+        of a block of rows during traceback
+        """
+        if interval is None:
+            interval = checkpoint_interval(self.n_a)
+
+        # 1. Forward pass: store checkpoints as arrays
+        checkpoints = {}
+        row = self.first_row()
+        for r in range(self.n_a + 1):
+            if r > 0:
+                row = self.next_row(row)
+            if r % interval == 0:
+                checkpoints[r] = (
+                    np.array(row.scores),
+                    np.array(row.pointers, dtype=np.uint8),
+                    row.gap_cost,
+                )
+
+        # 2. Traceback block by block, from the last checkpoint to the first
+        rev_a: List[Union[int, None]] = []
+        rev_b: List[Union[int, None]] = []
+        i, j = self.n_a, self.n_b
+        block = self.workspace.empty("block", (interval + 1, self.n_b + 1))
+        for start in sorted(checkpoints, reverse=True):
+            if start >= i and start > 0:
+                continue
+            end = min(start + interval, self.n_a)
+            scores, pointers_start, gap_cost = checkpoints[start]
+            row = Row(start, 0, scores.tolist(), pointers_start.tolist(), gap_cost)
+            block[0, :] = pointers_start
+            for r in range(start + 1, end + 1):
+                row = self.next_row(row)
+                block[r - start, :] = row.pointers
+            i, j = traceback_steps(
+                i, j, lambda r, c: block[r - start, c], rev_a, rev_b, stop=start
+            )
+        return rev_a, rev_b
+
+
+def traceback_steps(
+    i: int,
+    j: int,
+    pointer_at: Callable[[int, int], int],
+    rev_a: List[Union[int, None]],
+    rev_b: List[Union[int, None]],
+    stop: int = 0,
+) -> Tuple[int, int]:
+    """
+    Trace back from cell (i, j) until row `stop` is reached, appending to
+    `rev_a` and `rev_b`. Row 0 is traced back to cell (0, 0).
+
+    Returns the cell where the traceback stopped.
+    """
+    while (i > stop) or (stop == 0 and j > 0):
+        pointer = pointer_at(i, j)
+        if pointer in DIAG:
+            rev_a.append(i - 1)
+            rev_b.append(j - 1)
+            i -= 1
+            j -= 1
+        elif pointer in UP:
+            rev_a.append(i - 1)
+            rev_b.append(None)
+            i -= 1
+        elif pointer in LEFT:
+            rev_a.append(None)
+            rev_b.append(j - 1)
+            j -= 1
+    return i, j
+
+
+def traceback(
+    n_a: int, n_b: int, pointer_at: Callable[[int, int], int]
+) -> Tuple[List[Union[int, None]], List[Union[int, None]]]:
+    """
+    Trace through an optimal alignment from bottom-right to top-left
+
+    Returns the aligned indices of a and b in reverse order
+    """
+    rev_a: List[Union[int, None]] = []
+    rev_b: List[Union[int, None]] = []
+    traceback_steps(n_a, n_b, pointer_at, rev_a, rev_b)
+    return rev_a, rev_b
+
+
+def batch_pointers(
+    sims: np.ndarray,
+    discount_a: np.ndarray,
+    discount_b: np.ndarray,
+    initial_cost: float,
+    cost_reduction_factor: float,
+    workspace: Optional[Workspace] = None,
+) -> np.ndarray:
+    """
+    Pointer matrices of `RunningGapKernel.full` (decreasing gap cost) for a
+    batch of sequence pairs of the same shape
+
+    `sims` : Similarities, shape (n_pairs, n_a, n_b)
+
+    `discount_a`, `discount_b` : Gap cost factors per token, shape (n_pairs,
+    n_a) and (n_pairs, n_b)
+
+    Cells are computed in the same order and with the same floating point
+    operations as in `RunningGapKernel.next_row`, but every operation covers
+    all pairs of the batch. Returns an array of shape (n_pairs, n_a+1, n_b+1)
+    (from `workspace`, if given).
+    """
+    n_pairs, n_a, n_b = sims.shape
+    if workspace is None:
+        workspace = Workspace()
+    pointers = workspace.empty("pointers", (n_pairs, n_a + 1, n_b + 1))
+    pointers[:, 0, :] = 4
+    pointers[:, 1:, 0] = 3
+    col0 = np.linspace(0, -n_a * initial_cost, n_a + 1)
+    prev = np.tile(np.linspace(0, -n_b * initial_cost, n_b + 1), (n_pairs, 1))
+    gap_cost = np.full(n_pairs, float(initial_cost))
+    row = np.empty((n_pairs, n_b + 1))
+
+    for r in range(1, n_a + 1):
+        row[:, 0] = col0[r]
+        prev_p = pointers[:, r - 1, :]
+        discount_ai = discount_a[:, r - 1]
+        for c in range(1, n_b + 1):
+            t0 = prev[:, c - 1] + sims[:, r - 1, c - 1]
+            diag_pointer = prev_p[:, c - 1]
+            in_gap = (diag_pointer == 3) | (diag_pointer == 4) | (diag_pointer == 7)
+            gap_cost = np.where(
+                in_gap, gap_cost - gap_cost * cost_reduction_factor, initial_cost
+            )
+            t1 = prev[:, c] - gap_cost * discount_ai
+            t2 = row[:, c - 1] - gap_cost * discount_b[:, c - 1]
+            tmax = np.maximum(np.maximum(t0, t1), t2)
+            pointers[:, r, c] = 2 * (t0 == tmax) + 3 * (t1 == tmax) + 4 * (t2 == tmax)
+            row[:, c] = tmax
+        prev, row = row, prev
+    return pointers
+
+
+class AffineGapKernel:
+    def __init__(
+        self,
+        a: List[str],
+        b: List[str],
+        similarity_func: Callable,
+        cost_model: GapCostModel,
+        workspace: Optional[Workspace] = None,
+    ):
+        """
+        Needleman-Wunsch kernel with an affine gap model (Gotoh)
+
+        Opening a gap costs `cost_model.initial_cost`, every further position of
+        the same gap costs `cost_model.extend_cost`. Both are multiplied with the
+        discount factor of the dropped token.
+
+        The gap state is kept in separate matrices (M: last step was diagonal,
+        X: gap in b, Y: gap in a) instead of a single running gap cost, so the
+        recurrence does not depend on the order in which cells are computed and
+        every row is computed with array operations.
+
+        `workspace` : Buffers to reuse for the pointers (default: new arrays)
+        """
+        self.a = a
+        self.b = b
+        self.n_a = len(a)
+        self.n_b = len(b)
+        self.similarity_func = similarity_func
+        self.gap_open = cost_model.initial_cost
+        self.gap_extend = cost_model.extend_cost
+        self.discount_a = np.array(cost_model.discount_a, dtype=float)
+        self.discount_b = np.array(cost_model.discount_b, dtype=float)
+        self.workspace = Workspace() if workspace is None else workspace
+
+        # Number of computed cells
+        self.n_cells = 0
+
+    def full(self) -> Tuple[List[Union[int, None]], List[Union[int, None]]]:
+        """
+        Keep the pointers of all cells in memory (one matrix per gap state,
+        each cell points to the state of its predecessor: 0 = M, 1 = X, 2 = Y)
+        """
+        rev_a, rev_b, _, _ = self._align(local=False)
+        return rev_a, rev_b
+
+    def local_full(
+        self,
+    ) -> Tuple[List[Union[int, None]], List[Union[int, None]], int, int]:
+        """
+        Best local alignment (Smith-Waterman), like `full`
+
+        A diagonal step may start a new alignment instead of continuing one
+        with a score <= 0 (pointer 3). Returns the aligned indices of a and b
+        in reverse order and the cell where the alignment ends (the first cell
+        with the best score in M).
+        """
+        return self._align(local=True)
+
+    def _align(
+        self, local: bool
+    ) -> Tuple[List[Union[int, None]], List[Union[int, None]], int, int]:
+        n_a, n_b = self.n_a, self.n_b
+        open_a = self.gap_open * self.discount_a
+        extend_a = self.gap_extend * self.discount_a
+        open_b = self.gap_open * self.discount_b
+        extend_b = self.gap_extend * self.discount_b
+        # cum_extend_b[j] := extension costs of the tokens b[0] to b[j-1]
+        cum_extend_b = np.concatenate(([0.0], np.cumsum(extend_b)))
+
+        pointers = self.workspace.zeros("pointers", (3, n_a + 1, n_b + 1))
+
+        def fill_y(r: int, m: np.ndarray, x: np.ndarray) -> np.ndarray:
+            """Gap in a: Y[r, j] is the best gap over columns k+1..j, k < j"""
+            # Best of M and X (M first on ties)
+            x_better = x > m
+            mx = np.where(x_better, x, m)
+            y = np.full(n_b + 1, NEG_INF)
+            # Open a gap after column k and extend it to column j
+            opened = mx[:-1] - open_b + cum_extend_b[1:]
+            y[1:] = np.maximum.accumulate(opened) - cum_extend_b[1:]
+            # Pointer: gap opened in j-1 (from M or X) or extended (from Y)
+            from_y = y[:-1] - extend_b > mx[:-1] - open_b
+            pointers[2, r, 1:] = np.where(from_y, 2, x_better[:-1])
+            return y
+
+        # Best cell of a local alignment
+        best, end_a, end_b = 0.0, 0, 0
+
+        # Row 0
+        m = np.full(n_b + 1, NEG_INF)
+        m[0] = 0.0
+        x = np.full(n_b + 1, NEG_INF)
+        y = fill_y(0, m, x)
+
+        for r in range(1, n_a + 1):
+            ai = self.a[r - 1]
+            sims = np.fromiter(
+                (self.similarity_func(ai, bj) for bj in self.b), dtype=float, count=n_b
+            )
+            prev = np.stack((m, x, y))
+            # Best state of the previous row (M, X, Y on ties)
+            prev_state = prev.argmax(axis=0)
+            prev_best = np.take_along_axis(prev, prev_state[None], axis=0)[0]
+
+            # M: diagonal step
+            m = np.full(n_b + 1, NEG_INF)
+            if local:
+                # Start a new alignment instead of continuing one with score <= 0
+                start = prev_best[:-1] <= 0
+                m[1:] = np.where(start, 0.0, prev_best[:-1]) + sims
+                pointers[0, r, 1:] = np.where(start, 3, prev_state[:-1])
+                c = int(np.argmax(m))
+                if m[c] > best:
+                    best, end_a, end_b = m[c], r, c
+            else:
+                m[1:] = prev_best[:-1] + sims
+                pointers[0, r, 1:] = prev_state[:-1]
+
+            # X: gap in b, opened from M or Y, or extended from X
+            candidates = np.stack(
+                (
+                    prev[0] - open_a[r - 1],
+                    prev[1] - extend_a[r - 1],
+                    prev[2] - open_a[r - 1],
+                )
+            )
+            x_state = candidates.argmax(axis=0)
+            x = np.take_along_axis(candidates, x_state[None], axis=0)[0]
+            pointers[1, r, :] = x_state
+
+            # Y: gap in a
+            y = fill_y(r, m, x)
+
+        self.n_cells += n_a * n_b
+
+        # Traceback, starting from the best state in the last cell (global) or
+        # from M in the best cell (local)
+        if local:
+            state = 0
+            i, j = end_a, end_b
+        else:
+            final = np.array((m[n_b], x[n_b], y[n_b]))
+            state = int(final.argmax())
+            i, j = n_a, n_b
+        rev_a: List[Union[int, None]] = []
+        rev_b: List[Union[int, None]] = []
+        while i > 0 or j > 0:
+            prev_state = int(pointers[state, i, j])
+            if state == 0:
+                rev_a.append(i - 1)
+                rev_b.append(j - 1)
+                i -= 1
+                j -= 1
+            elif state == 1:
+                rev_a.append(i - 1)
+                rev_b.append(None)
+                i -= 1
+            else:
+                rev_a.append(None)
+                rev_b.append(j - 1)
+                j -= 1
+            if prev_state == 3:
+                # Start of a local alignment
+                break
+            state = prev_state
+        return rev_a, rev_b, end_a, end_b
+
+
+class SparseChainKernel:
+    def __init__(
+        self,
+        a: List[str],
+        b: List[str],
+        similarity_func: Callable,
+        cost_model: GapCostModel,
+        min_similarity: float = DEFAULT_SPARSE_MIN_SIMILARITY,
+        q: int = 2,
+    ):
+        """
+        Sparse alignment over candidate cells
+
+        Candidates are the cells (i, j) where `a[i]` and `b[j]` share at least
+        one character `q`-gram and have a similarity above `min_similarity`.
+        The alignment is the best chain of candidates (increasing in i and j),
+        all other tokens are aligned to gaps. Every token aligned to a gap costs
+        `cost_model.initial_cost` times its discount factor; the running gap
+        cost (`cost_model.gap_cost_func`) is not used, so the result may differ
+        from the dense kernels.
+
+        The similarity function is called once per pair of distinct tokens, the
+        chain is found in O(k log n_b) for k candidates.
+        """
+        self.a = a
+        self.b = b
+        self.n_a = len(a)
+        self.n_b = len(b)
+        self.similarity_func = similarity_func
+        self.min_similarity = min_similarity
+        self.q = q
+        # Cost of aligning a token to a gap
+        self.gap_a = [cost_model.initial_cost * d for d in cost_model.discount_a]
+        self.gap_b = [cost_model.initial_cost * d for d in cost_model.discount_b]
+
+        # Number of candidate cells and calls to the similarity function
+        self.n_cells = 0
+        self.n_similarity_calls = 0
+
+    def qgrams(self, token: str) -> Set[str]:
+        """Character q-grams of `token`, padded so that every token has some"""
+        padded = f"\x02{token}\x03"
+        return {padded[k : k + self.q] for k in range(len(padded) - self.q + 1)}
+
+    def candidates(self, max_candidates: int) -> Optional[List[Tuple[int, int, float]]]:
+        """
+        Candidate cells (i, j, similarity), sorted by i and j
+
+        Returns None as soon as there are more than `max_candidates`.
+        """
+        # 1. Positions of the distinct tokens
+        positions_a: Dict[str, List[int]] = {}
+        for i, tok in enumerate(self.a):
+            positions_a.setdefault(tok, []).append(i)
+        positions_b: Dict[str, List[int]] = {}
+        for j, tok in enumerate(self.b):
+            positions_b.setdefault(tok, []).append(j)
+
+        # 2. Index of the distinct tokens of b by q-gram
+        index: Dict[str, List[str]] = {}
+        for tok in positions_b:
+            for qgram in self.qgrams(tok):
+                index.setdefault(qgram, []).append(tok)
+
+        # 3. Similarity of the distinct token pairs that share a q-gram
+        cells: List[Tuple[int, int, float]] = []
+        for tok_a, idxs_a in positions_a.items():
+            shared: Set[str] = set()
+            for qgram in self.qgrams(tok_a):
+                shared.update(index.get(qgram, ()))
+            for tok_b in shared:
+                sim = self.similarity_func(tok_a, tok_b)
+                self.n_similarity_calls += 1
+                if sim <= self.min_similarity:
+                    continue
+                idxs_b = positions_b[tok_b]
+                if len(cells) + len(idxs_a) * len(idxs_b) > max_candidates:
+                    return None
+                cells.extend((i, j, sim) for i in idxs_a for j in idxs_b)
+        cells.sort()
+        return cells
+
+    def chain(
+        self, max_candidates: int
+    ) -> Optional[Tuple[List[Union[int, None]], List[Union[int, None]]]]:
+        """
+        Best chain of candidates, or None if there are more than
+        `max_candidates` (use a dense kernel then)
+        """
+        cells = self.candidates(max_candidates)
+        if cells is None:
+            return None
+        self.n_cells += len(cells)
+        gap_a, gap_b = self.gap_a, self.gap_b
+
+        # Aligning all tokens to gaps costs sum(gap_a) + sum(gap_b); matching a
+        # cell instead gains its similarity plus the two gap costs it saves.
+        # `keys[k]` is the best total gain of a chain ending in cell k; the
+        # predecessor of a cell is the cell with the best key above and left of
+        # it, found with a Fenwick tree (prefix maximum) over the columns.
+        keys: List[float] = [0.0] * len(cells)
+        preds: List[int] = [-1] * len(cells)
+        tree_keys = [NEG_INF] * (self.n_b + 1)
+        tree_idxs = [-1] * (self.n_b + 1)
+
+        start = 0
+        while start < len(cells):
+            # All cells of a row are computed before any of them is added to the
+            # tree, as cells in the same row cannot follow each other
+            end = start
+            while end < len(cells) and cells[end][0] == cells[start][0]:
+                end += 1
+            for k in range(start, end):
+                i, j, sim = cells[k]
+                # Prefix maximum over the columns 0 to j-1
+                best, pred = 0.0, -1
+                pos = j
+                while pos > 0:
+                    if tree_keys[pos] > best:
+                        best, pred = tree_keys[pos], tree_idxs[pos]
+                    pos -= pos & -pos
+                keys[k] = best + sim + gap_a[i] + gap_b[j]
+                preds[k] = pred
+            for k in range(start, end):
+                pos = cells[k][1] + 1
+                while pos <= self.n_b:
+                    if keys[k] > tree_keys[pos]:
+                        tree_keys[pos], tree_idxs[pos] = keys[k], k
+                    pos += pos & -pos
+            start = end
+
+        # Best end of the chain (or an empty chain, if no chain has a gain)
+        last, best = -1, 0.0
+        for k, key in enumerate(keys):
+            if key > best:
+                last, best = k, key
+
+        # Traceback: matches of the chain, gaps for the tokens in between
+        rev_a: List[Union[int, None]] = []
+        rev_b: List[Union[int, None]] = []
+        i, j = self.n_a, self.n_b
+        k = last
+        while True:
+            match_i, match_j = (cells[k][0], cells[k][1]) if k >= 0 else (-1, -1)
+            for jj in range(j - 1, match_j, -1):
+                rev_a.append(None)
+                rev_b.append(jj)
+            for ii in range(i - 1, match_i, -1):
+                rev_a.append(ii)
+                rev_b.append(None)
+            if k < 0:
+                break
+            rev_a.append(match_i)
+            rev_b.append(match_j)
+            i, j = match_i, match_j
+            k = preds[k]
+        return rev_a, rev_b
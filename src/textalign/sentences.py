@@ -1,6 +1,11 @@
-from typing import List, Optional, Tuple
+from typing import Generator, IO, Iterable, List, Optional, Tuple, Union
 from dataclasses import dataclass
 
+import bisect
+import json
+
+import numpy as np
+
 from . import AlignedPair
 from . import util
 
@@ -18,45 +23,250 @@ class AlignedSentence:
         self.alignment = alignment
 
     def serialize(
-        self, drop_unaligned: bool = False, gap_token: str = "[GAP]"
+        self, drop_unaligned: bool = False, gap_token: Optional[str] = "[GAP]"
     ) -> Tuple[str, str]:
         """
         Return both sentences as strings (serialized).
 
         `drop_unaligned`specifies whether tokens that have no alignment to the other side get excluded from the string.
+        `gap_token` is inserted where a token aligns with a gap. If None, gaps are not marked.
         TODO: this needs to be extended to allow exclusion of None-aligned tokens from a,b or both sides or including all and/or adding a GAP token
 
         """
 
-        str_a, str_b = "", ""
+        parts_a: List[str] = []
+        parts_b: List[str] = []
+        gap = f" {gap_token}" if gap_token is not None else ""
         last_idx_a: Optional[int] = -1
         last_idx_b: Optional[int] = -1
         # Iterate over AligendPair objects in list
         for aligned_idx in self.alignment:
+            idx_a, idx_b = aligned_idx.a, aligned_idx.b
             # Optional: exclude unaligned tokens (and gaps) from serialized sentence
-            if drop_unaligned and ((aligned_idx.a is None) or (aligned_idx.b is None)):
+            if drop_unaligned and ((idx_a is None) or (idx_b is None)):
                 continue
 
             # Add token and whitespace to serialized sentence for a
-            if aligned_idx.a is not None and aligned_idx.a != last_idx_a:
+            if idx_a is not None and idx_a != last_idx_a:
+                token = self.tokens_a[idx_a]
                 # Check whether to add initial whitespace
-                ws = " " if self.tokens_a[aligned_idx.a].initial_ws else ""
-                str_a += ws + self.tokens_a[aligned_idx.a].text
+                parts_a.append(" " + token.text if token.initial_ws else token.text)
             # If gaps get included: Add special GAP token
-            elif aligned_idx.a is None:
-                str_a += f" {gap_token}"
+            elif idx_a is None:
+                parts_a.append(gap)
 
             # Same for b
-            if aligned_idx.b is not None and aligned_idx.b != last_idx_b:
-                ws = " " if self.tokens_b[aligned_idx.b].initial_ws else ""
-                str_b += ws + self.tokens_b[aligned_idx.b].text
-            elif aligned_idx.b is None:
-                str_b += f" {gap_token}"
+            if idx_b is not None and idx_b != last_idx_b:
+                token = self.tokens_b[idx_b]
+                parts_b.append(" " + token.text if token.initial_ws else token.text)
+            elif idx_b is None:
+                parts_b.append(gap)
 
             # Move last index
-            last_idx_a, last_idx_b = aligned_idx.a, aligned_idx.b
+            last_idx_a, last_idx_b = idx_a, idx_b
+
+        return "".join(parts_a).strip(), "".join(parts_b).strip()
+
+
+@dataclass
+class SentenceSlices:
+    """
+    Sentence-wise slices of a document-wide token alignment
+
+    The alignment is stored as two int arrays `idxs_a` and `idxs_b`, where -1
+    stands for None. Sentence `i` covers the alignment pairs
+    `bounds[i]:bounds[i+1]`. `offsets_a`|`offsets_b` are the values to substract
+    from the indices of sentence `i` to let them start at 0.
+    """
+
+    idxs_a: np.ndarray
+    idxs_b: np.ndarray
+    bounds: np.ndarray
+    offsets_a: np.ndarray
+    offsets_b: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.bounds) - 1
+
+    def get(self, i: int, reset_tok_idxs: bool = True) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Return the token indices (a and b) of the alignment for sentence `i`
+
+        Without `reset_tok_idxs` the returned arrays are views on the
+        document-wide alignment.
+        """
+        start, end = self.bounds[i], self.bounds[i + 1]
+        idxs_a = self.idxs_a[start:end]
+        idxs_b = self.idxs_b[start:end]
+        if not reset_tok_idxs:
+            return idxs_a, idxs_b
+        return (
+            np.where(idxs_a >= 0, idxs_a - self.offsets_a[i], -1),
+            np.where(idxs_b >= 0, idxs_b - self.offsets_b[i], -1),
+        )
+
+    def rebased(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Return the token indices (a and b) of the entire alignment, where the
+        indices of every sentence start at 0
+        """
+        lengths = np.diff(self.bounds)
+        offsets_a = np.repeat(self.offsets_a, lengths)
+        offsets_b = np.repeat(self.offsets_b, lengths)
+        return (
+            np.where(self.idxs_a >= 0, self.idxs_a - offsets_a, -1),
+            np.where(self.idxs_b >= 0, self.idxs_b - offsets_b, -1),
+        )
+
+    def unique_idxs_b(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Return the sorted, unique b-indices (without -1) of every sentence
+
+        The indices of all sentences are returned concatenated, sentence `i`
+        covers `idxs[bounds[i]:bounds[i+1]]`.
+        """
+        sent_ids = np.repeat(np.arange(len(self)), np.diff(self.bounds))
+        valid = self.idxs_b >= 0
+        # Combine sentence id and b-index into a single key, so that a
+        # single sort separates the sentences and sorts the indices
+        width = int(self.idxs_b.max(initial=0)) + 1
+        keys = np.unique(sent_ids[valid] * width + self.idxs_b[valid])
+        bounds = np.searchsorted(keys, np.arange(len(self) + 1) * width)
+        return keys % width, bounds
+
+
+def alignment_to_arrays(
+    aligned_tokens: List[AlignedPair],
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Convert a list of AlignedPairs to two int arrays (a and b), None becomes -1
+    """
+    n = len(aligned_tokens)
+    idxs_a = np.fromiter(
+        (-1 if pair.a is None else pair.a for pair in aligned_tokens),
+        dtype=np.int64,
+        count=n,
+    )
+    idxs_b = np.fromiter(
+        (-1 if pair.b is None else pair.b for pair in aligned_tokens),
+        dtype=np.int64,
+        count=n,
+    )
+    return idxs_a, idxs_b
+
+
+def arrays_to_alignment(idxs_a: np.ndarray, idxs_b: np.ndarray) -> List[AlignedPair]:
+    """
+    Convert two int arrays (a and b) to a list of AlignedPairs, -1 becomes None
+    """
+    return [
+        AlignedPair(a if a >= 0 else None, b if b >= 0 else None)
+        for a, b in zip(idxs_a.tolist(), idxs_b.tolist())
+    ]
+
+
+def _last_valid_values(idxs: np.ndarray) -> np.ndarray:
+    """
+    For every position in `idxs` get the last value that is not -1 (up to and
+    including this position), or -1 if there is none
+    """
+    positions = np.where(idxs >= 0, np.arange(len(idxs)), -1)
+    positions = np.maximum.accumulate(positions)
+    return np.where(positions >= 0, idxs[positions], -1)
+
+
+def slice_alignment(
+    aligned_tokens: List[AlignedPair], start_idxs: List[int]
+) -> SentenceSlices:
+    """
+    Find the sentence boundaries in a document-wide token alignment
+
+    Sentences are aligned based on `a`. A sentence ends before the first
+    alignment pair whose a-index belongs to the next sentence, pairs where
+    `a` is None stay with the preceding sentence. The boundaries for all
+    sentences are found with a single `searchsorted` over the a-indices, which
+    requires the a-indices to be monotonic (as they are in an Aligner's output).
+    """
+    idxs_a, idxs_b = alignment_to_arrays(aligned_tokens)
+    starts = np.sort(np.asarray(start_idxs, dtype=np.int64))
+    n = len(idxs_a)
+
+    # (1) Let gaps in a take the index of the preceding a-token
+    last_a = _last_valid_values(idxs_a)
+    last_b = _last_valid_values(idxs_b)
+
+    # (2) The first pair whose a-index reaches the start of the next sentence
+    # is the boundary
+    bounds = np.empty(len(starts) + 1, dtype=np.int64)
+    bounds[0] = 0
+    bounds[1:-1] = np.searchsorted(np.maximum.accumulate(last_a), starts[1:])
+    bounds[-1] = n
+
+    # (3) Offsets are the last indices before the sentence's first pair (+1)
+    # If previous sentences are all None, the last index is carried over
+    prev = bounds[:-1] - 1
+    if n:
+        offsets_a = np.where(prev >= 0, last_a[prev], -1) + 1
+        offsets_b = np.where(prev >= 0, last_b[prev], -1) + 1
+    else:
+        offsets_a = np.zeros(len(starts), dtype=np.int64)
+        offsets_b = np.zeros(len(starts), dtype=np.int64)
+
+    return SentenceSlices(idxs_a, idxs_b, bounds, offsets_a, offsets_b)
+
+
+def iter_aligned_sentences(
+    aligned_tokens: List[AlignedPair],
+    start_idxs: List[int],
+    doc_a: List[util.Token],
+    doc_b: List[util.Token],
+    reset_tok_idxs: bool = True,
+) -> Generator[AlignedSentence, None, None]:
+    """
+    Generator version of `get_aligned_sentences`
+
+    AlignedSentences are created one at a time, so they can be serialized (see
+    `write_aligned_sentences`) as they are produced.
+    """
+    starts = sorted(start_idxs)
+    slices = slice_alignment(aligned_tokens, starts)
+    bounds = slices.bounds.tolist()
+
+    # Optional: Reset indices in token alignments to start at 0
+    # (done for the entire document at once)
+    if reset_tok_idxs:
+        idxs_a, idxs_b = (idxs.tolist() for idxs in slices.rebased())
+
+    # The b-tokens are given by the (unique, sorted) b-indices of a sentence
+    unique_b, bounds_b = slices.unique_idxs_b()
+    all_tokens_b = [doc_b[k] for k in unique_b.tolist()]
+    bounds_b = bounds_b.tolist()
+
+    for i, start_idx_a in enumerate(starts):
+        # Did we reach the end of a-tokens?
+        try:
+            next_start_idx_a = starts[i + 1]
+        except IndexError:
+            next_start_idx_a = len(doc_a)
+
+        # (1) Get the a-tokens for the sentence via index
+        tokens_a = doc_a[start_idx_a:next_start_idx_a]
+
+        # (2) Get the b-tokens via the alignment
+        tokens_b = all_tokens_b[bounds_b[i] : bounds_b[i + 1]]
 
-        return str_a.strip(), str_b.strip()
+        # (3) Get the alignment for the sentence
+        start, end = bounds[i], bounds[i + 1]
+        if reset_tok_idxs:
+            s_alignment = [
+                AlignedPair(a if a >= 0 else None, b if b >= 0 else None)
+                for a, b in zip(idxs_a[start:end], idxs_b[start:end])
+            ]
+        else:
+            s_alignment = aligned_tokens[start:end]
+
+        # (4) Create sentence object
+        yield AlignedSentence(tokens_a, tokens_b, s_alignment)
 
 
 def get_aligned_sentences(
@@ -76,89 +286,49 @@ def get_aligned_sentences(
 
     `reset_tok_idxs` : Whether to convert indices in sentence-wise token alignments to start at 0
     """
+    return list(
+        iter_aligned_sentences(aligned_tokens, start_idxs, doc_a, doc_b, reset_tok_idxs)
+    )
 
-    aligned_sentences = []
-    index_of_the_last_appended_alignment_pair = -1
-
-    # We need the following variables, if we want to convert indices in
-    # sentence-wise token alignments to start at 0
-    if reset_tok_idxs:
-        end_a_prev = -1
-        end_b_prev = -1
 
-    for i, start_idx_a in enumerate(sorted(start_idxs)):
-        # Did we reach the end of a-tokens?
-        try:
-            next_start_idx_a = start_idxs[i + 1]
-        except IndexError:
-            next_start_idx_a = len(doc_a)
-
-        # (1) Get the a-tokens for the sentence via index
-        tokens_a = doc_a[start_idx_a:next_start_idx_a]
+def patch_aligned_sentences(
+    aligned_sents: List[AlignedSentence],
+    aligned_tokens: List[AlignedPair],
+    start_idxs: List[int],
+    doc_a: List[util.Token],
+    doc_b: List[util.Token],
+    range_a: Tuple[int, int],
+) -> List[int]:
+    """
+    Re-create the AlignedSentences (with `reset_tok_idxs=True`) affected by a
+    change of the alignment of the a-tokens in `range_a` (see
+    `Aligner.realign_edit`), in place
 
-        # (2) Get the alignment via the known a-token indices
-        s_alignment = []
-        # k is the index into the token alignments for the entire doc
-        k = index_of_the_last_appended_alignment_pair + 1
-        # Stores the current a-token's index (can become None)
-        _index_a: Optional[int] = start_idx_a
-        # Only do this until we reached the end of token alignments for the entire doc
-        while k < len(aligned_tokens):
-            alignment_pair = aligned_tokens[k]
-            _index_a = alignment_pair.a  # Get the next a-token's index
-
-            # If we reached an a-index, where a new sentence starts, we break
-            # the loop (i.e. finish building the sentence alignemnt). Since we
-            # are one element to far ahead in the document alignments now, we
-            # have to decrease `k` by 1, before breaking.
-            if (_index_a is not None) and (_index_a >= next_start_idx_a):
-                k -= 1
-                break
-            s_alignment.append(alignment_pair)
-            k += 1
-        index_of_the_last_appended_alignment_pair = k
-
-        # (3) Get the b-tokens via the alignments
-        tokens_b = get_tokens_to_alignment(doc_b, s_alignment, side="b")
-
-        # (4) Optional: Reset indices in token alignments to start at 0
-        if reset_tok_idxs:
-            # Catch edge-case: empty alignments
-            if len(s_alignment) == 0:
-                end_a = -1
-                end_b = -1
-            # Catch None in last pair
-            else:
-                # Get the highest index of the current aligned_tokidxs (not None)
-                k = len(s_alignment) - 1
-                end_a, end_b = None, None
-                while ((end_a is None) or (end_b is None)) and (k > -1):
-                    a, b = s_alignment[k]
-                    if end_a is None:
-                        end_a = a
-                    if end_b is None:
-                        end_b = b
-                    # move one step away from the end of the alignment
-                    k -= 1
-                if end_a is None:
-                    end_a = -1
-                if end_b is None:
-                    end_b = -1
-            assert end_a is not None  # mypy
-            assert end_b is not None
-            s_alignment = let_idxs_start_at_zero(s_alignment, end_a_prev, end_b_prev)
-            # Get the last indices in the previous sentence to normalize next one
-            # If previous sentence was all None, don't move the last index
-            if end_a != -1:
-                end_a_prev = end_a
-            if end_b != -1:
-                end_b_prev = end_b
-
-        # (5) Create sentence object and add to list
-        aligned_sent = AlignedSentence(tokens_a, tokens_b, s_alignment)
-        aligned_sentences.append(aligned_sent)
-
-    return aligned_sentences
+    `aligned_tokens`, `start_idxs`, `doc_a` and `doc_b` must reflect the state
+    after the change, the number of sentences must not change. Returns the
+    indices of the re-created sentences.
+    """
+    starts = sorted(start_idxs)
+    if len(starts) != len(aligned_sents):
+        raise ValueError("Number of sentences must not change")
+
+    # Sentences overlapping with the range, plus one sentence on each side, as
+    # pairs with gaps in a can move across a sentence boundary
+    first = max(bisect.bisect_right(starts, range_a[0]) - 2, 0)
+    last = min(bisect.bisect_left(starts, range_a[1]) + 1, len(starts))
+    slices = slice_alignment(aligned_tokens, starts)
+    ends = starts[1:] + [len(doc_a)]
+
+    for i in range(first, last):
+        idxs_a, idxs_b = slices.get(i, reset_tok_idxs=True)
+        start, end = slices.bounds[i], slices.bounds[i + 1]
+        unique_b = np.unique(slices.idxs_b[start:end])
+        aligned_sents[i] = AlignedSentence(
+            doc_a[starts[i] : ends[i]],
+            [doc_b[k] for k in unique_b[unique_b >= 0].tolist()],
+            arrays_to_alignment(idxs_a, idxs_b),
+        )
+    return list(range(first, last))
 
 
 def let_idxs_start_at_zero(
@@ -202,3 +372,75 @@ def get_tokens_to_alignment(
     tok_indexes_cleaned = sorted(tok_indexes_cleaned)
     tokens = [doc[i] for i in tok_indexes_cleaned]
     return tokens
+
+
+def serialize_sentences(
+    aligned_sents: Iterable[AlignedSentence],
+    format: str = "tsv",
+    drop_unaligned: bool = False,
+    gap_token: Optional[str] = "[GAP]",
+    keys: Tuple[str, str] = ("a", "b"),
+) -> Generator[str, None, None]:
+    """
+    Generate one line (incl. newline) per serialized sentence pair
+
+    `format` must be one of `tsv` (sentence a and b separated by a tab) or `jsonl`
+    (JSON object per line with `keys` for sentence a and b).
+    `drop_unaligned` and `gap_token` are passed to `AlignedSentence.serialize`.
+    """
+    if format == "tsv":
+        for sent in aligned_sents:
+            str_a, str_b = sent.serialize(drop_unaligned, gap_token)
+            yield f"{str_a}\t{str_b}\n"
+    elif format == "jsonl":
+        key_a, key_b = keys
+        for sent in aligned_sents:
+            str_a, str_b = sent.serialize(drop_unaligned, gap_token)
+            yield json.dumps({key_a: str_a, key_b: str_b}, ensure_ascii=False) + "\n"
+    else:
+        raise ValueError(f"Unknown format: {format}, must be in {'tsv', 'jsonl'}")
+
+
+def write_aligned_sentences(
+    aligned_sents: Iterable[AlignedSentence],
+    file_or_stream: Union[str, IO[str]],
+    format: str = "tsv",
+    drop_unaligned: bool = False,
+    gap_token: Optional[str] = "[GAP]",
+    keys: Tuple[str, str] = ("a", "b"),
+    lines_per_write: int = 1000,
+) -> int:
+    """
+    Write serialized sentence pairs to a file (path) or a text stream
+
+    `aligned_sents` can be a generator (e.g. `iter_aligned_sentences`), so that
+    sentences are written as they are produced. Lines are collected and
+    written in chunks of `lines_per_write`. Returns the number of written lines.
+
+    See `serialize_sentences` for the other arguments.
+    """
+    if isinstance(file_or_stream, str):
+        with open(file_or_stream, "w", encoding="utf-8") as f:
+            return write_aligned_sentences(
+                aligned_sents,
+                f,
+                format,
+                drop_unaligned,
+                gap_token,
+                keys,
+                lines_per_write,
+            )
+
+    n = 0
+    chunk: List[str] = []
+    for line in serialize_sentences(
+        aligned_sents, format, drop_unaligned, gap_token, keys
+    ):
+        chunk.append(line)
+        if len(chunk) >= lines_per_write:
+            file_or_stream.write("".join(chunk))
+            n += len(chunk)
+            chunk = []
+    file_or_stream.write("".join(chunk))
+    n += len(chunk)
+    return n
@@ -0,0 +1,139 @@
+# Persistent store for similarities of token pairs
+#
+# Similarities (or distances) of transliterated token pairs are stored in a
+# SQLite database in WAL mode, so that many (short-lived) worker processes can
+# read it concurrently and results are kept across runs. Lookups go to an
+# in-process dictionary, which is filled from the database per split
+# (`prefetch`); new values are written in a single transaction (`flush`).
+
+from typing import Callable, Dict, Iterable, Optional, Tuple, Union
+
+import functools
+import sqlite3
+
+# Maximum number of parameters per SQLite query
+MAX_QUERY_PARAMS = 500
+
+
+def func_name(func: Callable) -> str:
+    """Name under which the values of a similarity function are stored"""
+    return f"{func.__module__}.{func.__qualname__}"
+
+
+class SimilarityStore:
+    def __init__(self, path: str, timeout: float = 60.0):
+        """
+        Disk-backed store for the values of similarity functions at `path`
+
+        `timeout` : Seconds to wait for other processes that write to the
+        database
+        """
+        self.path = path
+        self.connection = sqlite3.connect(path, timeout=timeout)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS similarity ("
+            "func TEXT, a TEXT, b TEXT, value REAL, PRIMARY KEY (func, a, b)"
+            ") WITHOUT ROWID"
+        )
+        # Tokens of b for `prefetch`, only visible to this connection
+        self.connection.execute(
+            "CREATE TEMP TABLE prefetch_b (b TEXT PRIMARY KEY) WITHOUT ROWID"
+        )
+        self.connection.commit()
+
+        # In-process values and values not yet written, per function name
+        self._memo: Dict[str, Dict[Tuple[str, str], float]] = {}
+        self._pending: Dict[str, Dict[Tuple[str, str], float]] = {}
+
+        # Counters
+        # Number of values computed (not found in the store)
+        self.n_computed: int = 0
+        # Number of values loaded from the database
+        self.n_loaded: int = 0
+
+    def wrap(self, func: Callable[[str, str], float]) -> Callable[[str, str], float]:
+        """
+        Return a version of `func` that looks up its values in the store and
+        adds new values to it
+        """
+        name = func_name(func)
+        memo = self._memo.setdefault(name, {})
+        pending = self._pending.setdefault(name, {})
+
+        @functools.wraps(func)
+        def stored_func(a: str, b: str) -> float:
+            try:
+                return memo[a, b]
+            except KeyError:
+                value = func(a, b)
+                memo[a, b] = value
+                pending[a, b] = value
+                self.n_computed += 1
+                return value
+
+        return stored_func
+
+    def prefetch(
+        self,
+        func: Union[Callable, str],
+        tokens_a: Optional[Iterable[str]] = None,
+        tokens_b: Optional[Iterable[str]] = None,
+    ) -> int:
+        """
+        Load the stored values of `func` for all pairs of `tokens_a` and
+        `tokens_b` (all values of `func` if they are None) into memory
+
+        Returns the number of values loaded.
+        """
+        name = func if isinstance(func, str) else func_name(func)
+        memo = self._memo.setdefault(name, {})
+        n_before = len(memo)
+        if tokens_a is None or tokens_b is None:
+            rows = self.connection.execute(
+                "SELECT a, b, value FROM similarity WHERE func = ?", (name,)
+            )
+            memo.update(((a, b), value) for a, b, value in rows)
+        else:
+            # Filter on both columns in SQLite: the tokens of b go to a
+            # temporary table, the tokens of a to the query (in chunks)
+            vocab_a = sorted(set(tokens_a))
+            with self.connection:
+                self.connection.execute("DELETE FROM temp.prefetch_b")
+                self.connection.executemany(
+                    "INSERT OR IGNORE INTO temp.prefetch_b VALUES (?)",
+                    ((b,) for b in set(tokens_b)),
+                )
+                for i in range(0, len(vocab_a), MAX_QUERY_PARAMS):
+                    chunk = vocab_a[i : i + MAX_QUERY_PARAMS]
+                    rows = self.connection.execute(
+                        "SELECT a, b, value FROM similarity "
+                        f"WHERE func = ? AND a IN ({','.join('?' * len(chunk))}) "
+                        "AND b IN (SELECT b FROM temp.prefetch_b)",
+                        (name, *chunk),
+                    )
+                    memo.update(
+                        ((a, b), value) for a, b, value in rows if (a, b) not in memo
+                    )
+        n_loaded = len(memo) - n_before
+        self.n_loaded += n_loaded
+        return n_loaded
+
+    def flush(self) -> int:
+        """Write new values to the database, returns the number of values"""
+        n = 0
+        with self.connection:
+            for name, pending in self._pending.items():
+                self.connection.executemany(
+                    "INSERT OR IGNORE INTO similarity VALUES (?, ?, ?, ?)",
+                    ((name, a, b, value) for (a, b), value in pending.items()),
+                )
+                n += len(pending)
+                pending.clear()
+        return n
+
+    def close(self) -> None:
+        """Write new values and close the database"""
+        self.flush()
+        self.connection.close()
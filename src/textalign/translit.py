@@ -1,3 +1,7 @@
+from typing import Callable, Dict, Iterable, List, Optional
+
+import functools
+
 import unidecode
 
 # Map Umlauts and 'ß' to private use codepoints
@@ -33,23 +37,64 @@ UNESCAPE = {
 }
 
 
+# Translation tables for `str.translate`
+# Note: keys in GERMAN_MAP, ESCAPE and UNESCAPE must be single characters
+GERMAN_TABLE = str.maketrans(GERMAN_MAP)
+ESCAPE_TABLE = str.maketrans(ESCAPE)
+UNESCAPE_TABLE = str.maketrans(UNESCAPE)
+# German map followed by escaping in a single pass
+GERMAN_ESCAPE_TABLE = str.maketrans(
+    {**ESCAPE, **{c: repl.translate(ESCAPE_TABLE) for c, repl in GERMAN_MAP.items()}}
+)
+
+# Maximum number of memoized transliterations
+MEMO_SIZE = 2**16
+
+
 def escape(token: str) -> str:
-    return "".join([ESCAPE[s] if s in ESCAPE else s for s in token])
+    return token.translate(ESCAPE_TABLE)
 
 
 def unescape(token: str) -> str:
-    return "".join([UNESCAPE[s] if s in UNESCAPE else s for s in token])
+    return token.translate(UNESCAPE_TABLE)
 
 
 def german_map(token: str) -> str:
-    for combi, repl in GERMAN_MAP.items():
-        if combi in token:
-            token = token.replace(combi, repl)
-    return token
+    return token.translate(GERMAN_TABLE)
 
 
+@functools.lru_cache(maxsize=MEMO_SIZE)
 def unidecode_ger(s: str):
     """Simple transliteration of characters, preserving Umlauts and ß"""
-    s = german_map(s)
-    s = unescape(unidecode.unidecode(escape(s), errors="preserve"))
+    # ASCII tokens are not changed by unidecode
+    if s.isascii():
+        return s.translate(GERMAN_TABLE)
+    s = s.translate(GERMAN_ESCAPE_TABLE)
+    s = unidecode.unidecode(s, errors="preserve").translate(UNESCAPE_TABLE)
     return s
+
+
+def translit_vocab(
+    tokens: Iterable[str], function: Callable[[str], str] = unidecode_ger
+) -> Dict[str, str]:
+    """
+    Transliterate the vocabulary of `tokens`, i.e. every distinct token once
+
+    Returns a mapping: token -> transliterated token
+    """
+    return {token: function(token) for token in set(tokens)}
+
+
+def translit_tokens(
+    tokens: List[str],
+    function: Callable[[str], str] = unidecode_ger,
+    vocab: Optional[Dict[str, str]] = None,
+) -> List[str]:
+    """
+    Transliterate a list of tokens via its vocabulary
+
+    Pass a mapping created with `translit_vocab` as `vocab` to reuse it.
+    """
+    if vocab is None:
+        vocab = translit_vocab(tokens, function)
+    return [vocab[token] for token in tokens]
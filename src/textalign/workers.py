@@ -0,0 +1,253 @@
+# Parallel alignment of document splits in worker processes
+#
+# The (transliterated) tokens of both documents are interned: the vocabulary
+# (UTF-8 with offsets) and the token ids of both documents are placed in a
+# single `multiprocessing.shared_memory` block once. Every worker attaches to
+# it when it starts, tasks only contain the bounds of a split and alignments
+# are returned as int32 arrays (see `cache.alignment_to_array`), so no token
+# lists or `AlignedPair` objects are pickled.
+#
+# Splits are dispatched one at a time, largest (estimated cost: DP cells) first,
+# so that a large split at the end of a document does not keep one worker busy
+# while the others are idle.
+
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from dataclasses import dataclass
+
+import multiprocessing
+import os
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from .aligner import Aligner, jaro_rescored
+from .cache import alignment_to_array
+from .kernels import Workspace
+from .simstore import SimilarityStore
+
+# Bounds of a split: start_a, end_a, start_b, end_b
+SplitBounds = Tuple[int, int, int, int]
+
+# Number of int64 values in the header of the shared memory block
+_HEADER_LEN = 4
+
+
+class SharedDocuments:
+    def __init__(self, tokens_a: List[str], tokens_b: List[str]):
+        """
+        Interned tokens of two documents in a shared memory block
+
+        Layout (all in one block): header (vocabulary size, number of tokens in
+        a and b, number of bytes of the vocabulary), vocabulary offsets
+        (int64), token ids of a and b (int32), vocabulary (UTF-8)
+        """
+        ids: Dict[str, int] = {}
+        ids_a = np.array([ids.setdefault(tok, len(ids)) for tok in tokens_a], np.int32)
+        ids_b = np.array([ids.setdefault(tok, len(ids)) for tok in tokens_b], np.int32)
+        encoded = [tok.encode("utf-8", "surrogatepass") for tok in ids]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(tok) for tok in encoded], out=offsets[1:])
+        header = np.array(
+            [len(encoded), len(ids_a), len(ids_b), offsets[-1]], dtype=np.int64
+        )
+
+        parts = [header.tobytes(), offsets.tobytes(), ids_a.tobytes()]
+        parts += [ids_b.tobytes(), b"".join(encoded)]
+        size = sum(len(part) for part in parts)
+        self.shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        buf = self.shm.buf
+        assert buf is not None
+        pos = 0
+        for part in parts:
+            buf[pos : pos + len(part)] = part
+            pos += len(part)
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    def close(self) -> None:
+        """Release and remove the shared memory block"""
+        self.shm.close()
+        self.shm.unlink()
+
+    @staticmethod
+    def attach(name: str) -> Tuple[List[str], List[str]]:
+        """Tokens of both documents from the shared memory block `name`"""
+        shm = shared_memory.SharedMemory(name=name)
+        buf = shm.buf
+        assert buf is not None
+        try:
+            n_vocab, n_a, n_b, n_bytes = np.frombuffer(
+                buf, dtype=np.int64, count=_HEADER_LEN
+            ).tolist()
+            pos = _HEADER_LEN * 8
+            offsets = np.frombuffer(buf, np.int64, n_vocab + 1, pos).tolist()
+            pos += (n_vocab + 1) * 8
+            ids_a = np.frombuffer(buf, np.int32, n_a, pos).tolist()
+            pos += n_a * 4
+            ids_b = np.frombuffer(buf, np.int32, n_b, pos).tolist()
+            pos += n_b * 4
+            data = bytes(buf[pos : pos + n_bytes])
+            vocab = [
+                data[start:end].decode("utf-8", "surrogatepass")
+                for start, end in zip(offsets[:-1], offsets[1:])
+            ]
+        finally:
+            del buf
+            shm.close()
+        return [vocab[i] for i in ids_a], [vocab[i] for i in ids_b]
+
+
+@dataclass
+class SplitResult:
+    """Alignment of a split (2 x n int32 array, -1 for gaps) and its counters"""
+
+    alignment: np.ndarray
+    strategy: str
+    dp_cells: int
+    similarity_calls: int
+    duration: float
+    similarities_loaded: int = 0
+    similarities_computed: int = 0
+    # Process id of the worker that aligned the split
+    worker: int = 0
+
+
+def split_cost(bounds: SplitBounds) -> int:
+    """Estimated cost of aligning a split: number of DP cells"""
+    start_a, end_a, start_b, end_b = bounds
+    return (end_a - start_a) * (end_b - start_b)
+
+
+# State of a worker process, set by `_init_worker`
+_worker: Dict[str, Any] = {}
+
+
+def _init_worker(
+    shm_name: str,
+    aligner_kwargs: Dict,
+    similarity_store: Optional[str],
+    spill_threshold: Optional[int],
+    spill_dir: Optional[str],
+) -> None:
+    tokens_a, tokens_b = SharedDocuments.attach(shm_name)
+    store = None
+    if similarity_store is not None:
+        store = SimilarityStore(similarity_store)
+        similarity_func = aligner_kwargs.get("similarity_func", jaro_rescored)
+        aligner_kwargs = {
+            **aligner_kwargs,
+            "similarity_func": store.wrap(similarity_func),
+        }
+    _worker.update(
+        tokens_a=tokens_a,
+        tokens_b=tokens_b,
+        aligner_kwargs=aligner_kwargs,
+        store=store,
+        workspace=Workspace(spill_threshold, spill_dir),
+    )
+
+
+def _align_split(bounds: SplitBounds) -> SplitResult:
+    start = time.perf_counter()
+    start_a, end_a, start_b, end_b = bounds
+    split_a = _worker["tokens_a"][start_a:end_a]
+    split_b = _worker["tokens_b"][start_b:end_b]
+    aligner_kwargs = _worker["aligner_kwargs"]
+    store: Optional[SimilarityStore] = _worker["store"]
+
+    n_loaded, n_computed = 0, 0
+    if store is not None:
+        n_loaded, n_computed = store.n_loaded, store.n_computed
+        store.prefetch(aligner_kwargs["similarity_func"], split_a, split_b)
+    aligner = Aligner(workspace=_worker["workspace"])
+    aligner.nw_align(split_a, split_b, **aligner_kwargs)
+    if store is not None:
+        store.flush()
+        n_loaded = store.n_loaded - n_loaded
+        n_computed = store.n_computed - n_computed
+
+    # Set by `nw_align`
+    assert aligner.strategy is not None
+    return SplitResult(
+        alignment_to_array(aligner.aligned_tokidxs),
+        aligner.strategy,
+        aligner.n_dp_cells,
+        aligner.n_similarity_calls,
+        time.perf_counter() - start,
+        n_loaded,
+        n_computed,
+        os.getpid(),
+    )
+
+
+def _align_indexed_split(task: Tuple[int, SplitBounds]) -> Tuple[int, SplitResult]:
+    return task[0], _align_split(task[1])
+
+
+class SplitExecutor:
+    def __init__(
+        self,
+        tokens_a: List[str],
+        tokens_b: List[str],
+        aligner_kwargs: Dict,
+        n_workers: int,
+        similarity_store: Optional[str] = None,
+        spill_threshold: Optional[int] = None,
+        spill_dir: Optional[str] = None,
+    ):
+        """
+        Pool of `n_workers` processes that align splits of `tokens_a` and
+        `tokens_b` (already transliterated) with `Aligner.nw_align`
+
+        `aligner_kwargs` must be picklable (e.g. module-level functions). With
+        `similarity_store`, every worker opens the store itself.
+
+        Use as a context manager, the shared memory is removed on exit.
+        """
+        self.documents = SharedDocuments(tokens_a, tokens_b)
+        try:
+            self.pool = multiprocessing.Pool(
+                n_workers,
+                initializer=_init_worker,
+                initargs=(
+                    self.documents.name,
+                    aligner_kwargs,
+                    similarity_store,
+                    spill_threshold,
+                    spill_dir,
+                ),
+            )
+        except BaseException:
+            self.documents.close()
+            raise
+
+    def map(self, bounds: List[SplitBounds]) -> Iterator[SplitResult]:
+        """
+        Align the splits with `bounds`, results in the same order
+
+        The splits are dispatched in descending order of `split_cost`, results
+        that arrive early are kept until all previous splits are done.
+        """
+        order = sorted(range(len(bounds)), key=lambda k: -split_cost(bounds[k]))
+        tasks = [(k, bounds[k]) for k in order]
+        done: Dict[int, SplitResult] = {}
+        next_k = 0
+        for k, result in self.pool.imap_unordered(_align_indexed_split, tasks):
+            done[k] = result
+            while next_k in done:
+                yield done.pop(next_k)
+                next_k += 1
+
+    def close(self) -> None:
+        self.pool.terminate()
+        self.pool.join()
+        self.documents.close()
+
+    def __enter__(self) -> "SplitExecutor":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
@@ -1,3 +1,5 @@
+import pytest
+
 from textalign import AlignedPair
 from textalign import translit
 import textalign
@@ -343,6 +345,27 @@ def test_levsim() -> None:
         assert target == output
 
 
+def test_rescored_bounds_exact() -> None:
+    words = ["Haus", "Maus", "ich", "nicht", "nichtnichtnicht", "a", "ab", "ba"]
+    words += ["Allmählig", "Allmählich", "ſeyn", "sein", "vnd", "und", "Xyz"]
+    for a in words:
+        for b in words:
+            sim = textalign.aligner.levsim(a, b)
+            target = -1 if sim < 0.33 else sim
+            assert textalign.aligner.levsim_rescored(a, b) == target
+
+            sim = textalign.aligner.lev.jaro(a, b)
+            target = -1 if sim < 0.33 else 0 if sim < 0.66 else 1
+            assert textalign.aligner.jaro_rescored(a, b) == target
+
+
+def test_levsim_max_distance() -> None:
+    for max_len in range(1, 200):
+        max_dist = textalign.aligner.levsim_max_distance(max_len)
+        assert 1 - (max_dist / max_len) >= 0.33
+        assert 1 - ((max_dist + 1) / max_len) < 0.33
+
+
 def test_aligner_extend_no_text() -> None:
     nw_alignments_01 = [
         AlignedPair(0, 0),  # Ein   <-> Eyn
@@ -407,3 +430,229 @@ def test_aligner_extend_empty() -> None:
 # TODO
 def test_aligner_extend_with_text() -> None:
     pass
+
+
+def test_nw_align_trim_identical() -> None:
+    tokens_a = ["Der", "Hausmann", "Eyn", "Haus", "mann", "riefs", "ſo", ".", "Ende"]
+    tokens_b = ["Der", "Hausmann", "Ein", "Hausmann", "rief", "es", "so", "Ende"]
+    kwargs = {
+        "similarity_func": textalign.aligner.jaro_rescored,
+        "gap_cost_initial": 1,
+    }
+
+    aligner = textalign.Aligner(tokens_a, tokens_b)
+    aligner.translit_tokens(translit.unidecode_ger)
+    aligner.nw_align(**kwargs)
+    target = aligner.aligned_tokidxs
+
+    aligner = textalign.Aligner(tokens_a, tokens_b)
+    aligner.translit_tokens(translit.unidecode_ger)
+    aligner.nw_align(trim_identical=True, **kwargs)
+    assert aligner.aligned_tokidxs == target
+    # Only the differing core is computed
+    assert aligner.n_dp_cells == 6 * 5
+
+    # Identical sequences: no DP
+    aligner = textalign.Aligner(tokens_b, list(tokens_b))
+    aligner.translit_tokens(translit.unidecode_ger)
+    aligner.nw_align(trim_identical=True, **kwargs)
+    assert aligner.strategy == "identical"
+    assert aligner.n_dp_cells == 0
+    assert aligner.aligned_tokidxs == [AlignedPair(i, i) for i in range(8)]
+
+
+def test_nw_align_anchor_unique() -> None:
+    tokens_a = ["Eyn", "Haus", "mann", "riefs", "ſo", ".", "Eyn", "Haus", "."]
+    tokens_b = ["Ein", "Hausmann", "rief", "es", "so", ".", "Ein", "Haus"]
+    kwargs = {
+        "similarity_func": textalign.aligner.jaro_rescored,
+        "gap_cost_initial": 1,
+    }
+    aligner = textalign.Aligner(tokens_a, tokens_b)
+    aligner.translit_tokens(translit.unidecode_ger)
+    aligner.nw_align(anchor_unique=True, **kwargs)
+
+    # "riefs"/"rief" is no anchor (not identical), "so" is
+    assert aligner.aligned_tokidxs == [
+        AlignedPair(0, 0),
+        AlignedPair(1, 1),
+        AlignedPair(2, None),
+        AlignedPair(3, 2),
+        AlignedPair(None, 3),
+        AlignedPair(4, 4),
+        AlignedPair(5, 5),
+        AlignedPair(6, 6),
+        AlignedPair(7, 7),
+        AlignedPair(8, None),
+    ]
+    # DPs before and after the anchor "so"
+    assert aligner.n_dp_cells == 4 * 4 + 4 * 3
+
+
+def test_diff_align() -> None:
+    tokens_a = [
+        "Ein",
+        "Hausmann",
+        "rief",
+        "ſo",
+        "laut",
+        ".",
+        "Ende",
+        "der",
+        "Geschichte",
+    ]
+    tokens_b = ["Ein", "Hausmann", "riefs", "so", "laut", "!", "Ende", "Geschichte"]
+    kwargs = {
+        "similarity_func": textalign.aligner.jaro_rescored,
+        "gap_cost_initial": 1,
+    }
+    aligner = textalign.Aligner(tokens_a, tokens_b)
+    aligner.translit_tokens(translit.unidecode_ger)
+    aligner.diff_align(**kwargs)
+
+    assert aligner.aligned_tokidxs == [
+        AlignedPair(0, 0),
+        AlignedPair(1, 1),
+        AlignedPair(2, 2),
+        AlignedPair(3, 3),
+        AlignedPair(4, 4),
+        AlignedPair(5, 5),
+        AlignedPair(6, 6),
+        AlignedPair(7, None),
+        AlignedPair(8, 7),
+    ]
+    assert aligner.strategy == "diff"
+    # DPs only for the replaced tokens ("rief"/"riefs" and "."/"!")
+    assert aligner.n_dp_cells == 2
+
+
+def test_realign_edit() -> None:
+    tokens_a = ["Eyn", "Haus", "mann", "riefs", "ſo", ".", "Der", "Hund", "bellt", "."]
+    tokens_b = ["Ein", "Hausmann", "rief", "es", "so", ".", "Der", "Hund", "bellt", "."]
+    kwargs = {
+        "similarity_func": textalign.aligner.jaro_rescored,
+        "gap_cost_initial": 1,
+    }
+    aligner = textalign.Aligner(tokens_a, tokens_b)
+    aligner.translit_tokens(translit.unidecode_ger)
+    aligner.nw_align(**kwargs)
+    n_dp_cells = aligner.n_dp_cells
+
+    # Replace "es so" by "so" in b
+    range_a = aligner.realign_edit(
+        "b", 3, 5, ["so"], translit_func=translit.unidecode_ger, context=1, **kwargs
+    )
+    assert aligner.tokens_b == [
+        "Ein",
+        "Hausmann",
+        "rief",
+        "so",
+        ".",
+        "Der",
+        "Hund",
+        "bellt",
+        ".",
+    ]
+    assert aligner._tokens_b[3] == "so"
+
+    # Same result as aligning from scratch, but only the region is re-aligned
+    target = textalign.Aligner(tokens_a, list(aligner.tokens_b))
+    target.translit_tokens(translit.unidecode_ger)
+    target.nw_align(**kwargs)
+    assert aligner.aligned_tokidxs == target.aligned_tokidxs
+    assert aligner.n_dp_cells - n_dp_cells < target.n_dp_cells
+    assert range_a[0] <= 4 and range_a[1] >= 5
+
+    # Insert a token in a
+    aligner.realign_edit("a", 8, 8, ["laut"], context=1, **kwargs)
+    assert aligner.tokens_a[8] == "laut"
+    assert AlignedPair(8, None) in aligner.aligned_tokidxs
+    assert aligner.aligned_tokidxs[-1] == AlignedPair(10, 8)
+
+    with pytest.raises(ValueError):
+        aligner.realign_edit("c", 0, 1, [])
+
+    # Append a token at the end of b, without context
+    aligner = textalign.Aligner(["a", "b", "c"], ["a", "b", "c"])
+    aligner.translit_tokens(None)
+    aligner.nw_align(**kwargs)
+    aligner.realign_edit("b", 3, 3, ["d"], context=0, **kwargs)
+    assert aligner.tokens_b == ["a", "b", "c", "d"]
+    assert aligner.aligned_tokidxs[-1] == AlignedPair(None, 3)
+    assert len(aligner.aligned_tokidxs) == 4
+
+
+def test_nw_score() -> None:
+    aligner = textalign.Aligner()
+    tokens = ["Ich", "bin", "ein", "Satz", "."]
+    kwargs = dict(similarity_func=textalign.aligner.levsim_rescored)
+    assert aligner.nw_score(tokens, tokens, **kwargs) == (5.0, 1.0)
+
+    a = ["Ich", "bin", "ein", "Satz", "."]
+    b = ["Jch", "bin", "ein", "kurtzer", "Satz", "."]
+    score, similarity = aligner.nw_score(a, b, **kwargs)
+    assert 0.5 < similarity < 1.0
+    assert score == pytest.approx(similarity * 6)
+    # Same result if the threshold can be reached
+    assert aligner.nw_score(a, b, min_similarity=0.5, **kwargs) == (
+        score,
+        similarity,
+    )
+    assert aligner.nw_score(a, b, min_similarity=0.99, **kwargs) is None
+    # Alignment is not changed
+    assert aligner.aligned_tokidxs == []
+
+    # Unrelated sequences are rejected early
+    c = ["Xyz"] * 50
+    n_cells = aligner.n_dp_cells
+    assert aligner.nw_score(a * 10, c, min_similarity=0.5, **kwargs) is None
+    assert aligner.n_dp_cells - n_cells < 50 * 50
+
+
+@pytest.mark.parametrize("gap_model", ["running", "affine"])
+def test_local_align(gap_model) -> None:
+    excerpt = ["Jch", "fuͤtterte", "mit", "meinen", "Kaͤlbern"]
+    text = ["Das", "VIII.", "Kapitel", "ich", "fütterte", "mit", "meinen"]
+    text += ["Kälbern", "und", "seiner", "Tischgesellschaft"]
+    aligner = textalign.Aligner(excerpt, text)
+    aligner.translit_tokens(translit.unidecode_ger)
+    span = aligner.local_align(
+        similarity_func=textalign.aligner.levsim_rescored, gap_model=gap_model
+    )
+    assert span == (3, 8)
+    assert aligner.strategy == "local"
+    assert aligner.aligned_tokidxs == [AlignedPair(i, i + 3) for i in range(5)]
+
+    # Nothing similar: empty span
+    aligner = textalign.Aligner(["Xyz"], ["und", "seiner"])
+    assert aligner.local_align(["Xyz"], ["und", "seiner"], gap_model=gap_model) == (
+        0,
+        0,
+    )
+    assert aligner.aligned_tokidxs == []
+
+
+def test_align_batch() -> None:
+    tokens_a = ["Eyn", "Haus", "mann", "riefs", "ſo", ".", "Jch", "bin", "hier"]
+    tokens_b = ["Ein", "Hausmann", "rief", "es", "so", "Ich", "bin", "da", "."]
+    # Pairs of the same shape (aligned together) and of other shapes
+    pairs = [(tokens_a[i : i + 5], tokens_b[i : i + 4]) for i in range(5)]
+    pairs += [(tokens_a, tokens_b[:7]), ([], tokens_b[:2]), (tokens_a[:3], [])]
+    kwargs = {
+        "similarity_func": textalign.aligner.levsim_rescored,
+        "gap_cost_initial": 0.5,
+    }
+    for min_group_size in (1, 100):
+        output = textalign.aligner.align_batch(
+            pairs,
+            translit.unidecode_ger,
+            max_aligned_tokens=2,
+            min_group_size=min_group_size,
+            **kwargs,
+        )
+        for (a, b), alignment in zip(pairs, output):
+            aligner = textalign.Aligner(a, b)
+            aligner.get_bidirectional_alignments(
+                translit.unidecode_ger, max_aligned_tokens=2, **kwargs
+            )
+            assert alignment == aligner.aligned_tokidxs
@@ -1,3 +1,5 @@
+from concurrent.futures import ThreadPoolExecutor
+
 import textalign
 from textalign import AlignmentPipeline
 from textalign import translit
@@ -27,10 +29,14 @@ def test_alignment_pipeline() -> None:
     }
     print()
     pipeline = AlignmentPipeline(config)
-    aligned_sents = pipeline(f_hist, f_norm)
+    result = pipeline.run(f_hist, f_norm)
+    aligned_sents = result.aligned_sentences
 
-    assert len(pipeline.aligner.tokens_a) == len(pipeline.doc_flat_a)
-    assert len(pipeline.aligner.tokens_b) == len(pipeline.doc_flat_b)
+    assert len(result.aligner.tokens_a) == len(result.doc_flat_a)
+    assert len(result.aligner.tokens_b) == len(result.doc_flat_b)
+    assert [sent.serialize() for sent in pipeline(f_hist, f_norm)] == [
+        sent.serialize() for sent in aligned_sents
+    ]
 
     with open("tests/testdata/out/pipeline.sent.02.out", "w", encoding="utf-8") as f:
         for sent in aligned_sents:
@@ -38,3 +44,109 @@ def test_alignment_pipeline() -> None:
             f.write(f"{sent_hist_ser}\n")
             f.write(f"{sent_norm_ser}\n")
             f.write("\n")
+
+
+def test_alignment_pipeline_stats() -> None:
+    f_hist = "tests/testdata/simplicissimus_hist.h200.txt"
+    f_norm = "tests/testdata/simplicissimus_norm.h200.txt"
+    config = {
+        "translit_func": translit.unidecode_ger,
+        "aligner": {
+            "similarity_func": textalign.aligner.levsim_rescored,
+            "gap_cost_initial": 0.5,
+        },
+        "max_aligned_tokens": 2,
+        "splitter": {
+            "max_lev_dist": 3,
+            "subseq_len": 7,
+            "step_size": 10,
+            "max_len_split": 100,
+            "translit_func": translit.unidecode_ger,
+        },
+    }
+    stages = []
+    pipeline = AlignmentPipeline(
+        config, hook=lambda name, duration, stats: stages.append(name)
+    )
+    result = pipeline.run(f_hist, f_norm)
+    stats = result.stats
+
+    assert set(stages) == set(stats.durations)
+    assert stages[:3] == ["parse", "flatten", "split"]
+    assert stages[-2:] == ["clean", "sentences"]
+    assert stages.count("align") == stats.n_splits
+    assert stats.n_splits > 1
+    assert sum(a for a, _ in stats.split_sizes) == len(result.doc_flat_a)
+    assert sum(b for _, b in stats.split_sizes) == len(result.doc_flat_b)
+    assert stats.dp_cells == sum(a * b for a, b in stats.split_sizes)
+    assert stats.similarity_calls == stats.dp_cells
+    assert stats.fuzzy_searches >= 2 * (stats.n_splits - 1)
+    assert stats.strategies == {"full": stats.n_splits}
+
+
+def test_alignment_pipeline_diff_mode() -> None:
+    f_hist = "tests/testdata/simplicissimus_hist.h200.txt"
+    f_norm = "tests/testdata/simplicissimus_norm.h200.txt"
+    config = {
+        "mode": "diff",
+        "translit_func": translit.unidecode_ger,
+        "aligner": {
+            "similarity_func": textalign.aligner.levsim_rescored,
+            "gap_cost_initial": 0.5,
+        },
+        "max_aligned_tokens": 2,
+    }
+    pipeline = AlignmentPipeline(config)
+    result = pipeline.run(f_hist, f_norm)
+    stats = result.stats
+
+    assert len(result.aligned_sentences)
+    assert result.docsplitter is None
+    assert stats.strategies == {"diff": 1}
+    assert stats.split_sizes == [(len(result.doc_flat_a), len(result.doc_flat_b))]
+    assert stats.dp_cells < len(result.doc_flat_a) * len(result.doc_flat_b)
+    aligned_a = [
+        pair.a for pair in result.aligner.aligned_tokidxs if pair.a is not None
+    ]
+    assert aligned_a == list(range(len(result.doc_flat_a)))
+
+
+def test_alignment_pipeline_threads() -> None:
+    files = [
+        (
+            "tests/testdata/simplicissimus_hist.h200.txt",
+            "tests/testdata/simplicissimus_norm.h200.txt",
+        ),
+        (
+            "tests/testdata/simplicissimus_norm.h200.txt",
+            "tests/testdata/simplicissimus_hist.h200.txt",
+        ),
+    ] * 2
+    config = {
+        "translit_func": translit.unidecode_ger,
+        "aligner": {
+            "similarity_func": textalign.aligner.levsim_rescored,
+            "gap_cost_initial": 0.5,
+        },
+        "max_aligned_tokens": 2,
+        "splitter": {
+            "max_lev_dist": 3,
+            "subseq_len": 7,
+            "step_size": 10,
+            "max_len_split": 100,
+            "translit_func": translit.unidecode_ger,
+        },
+    }
+    pipeline = AlignmentPipeline(config)
+    expected = [pipeline.run(f_a, f_b) for f_a, f_b in files]
+
+    # One pipeline, concurrent calls
+    with ThreadPoolExecutor(4) as executor:
+        results = list(executor.map(lambda f: pipeline.run(*f), files))
+    for result, expected_result in zip(results, expected):
+        assert result.file_a == expected_result.file_a
+        assert [sent.serialize() for sent in result.aligned_sentences] == [
+            sent.serialize() for sent in expected_result.aligned_sentences
+        ]
+        assert result.stats.split_sizes == expected_result.stats.split_sizes
+        assert result.stats.dp_cells == expected_result.stats.dp_cells
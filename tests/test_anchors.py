@@ -0,0 +1,30 @@
+from textalign import anchors
+
+
+def test_longest_increasing_chain() -> None:
+    pairs = [(0, 3), (1, 1), (2, 2), (3, 0), (4, 4), (5, 5)]
+    assert anchors.longest_increasing_chain(pairs) == [(1, 1), (2, 2), (4, 4), (5, 5)]
+    assert len(anchors.longest_increasing_chain([(0, 1), (1, 1)])) == 1
+    assert anchors.longest_increasing_chain([]) == []
+
+
+def test_unique_anchors() -> None:
+    a = ["der", "Hausmann", "rief", "der", "so", "laut", "."]
+    b = ["der", "Hausmann", "so", "rief", "laut", "der", "."]
+    # "der" is not unique, either "rief" or "so" is out of order
+    assert anchors.unique_anchors(a, b) == [(1, 1), (4, 2), (5, 4), (6, 6)]
+    assert anchors.unique_anchors(a, []) == []
+
+
+def test_matching_blocks() -> None:
+    a = ["Ein", "Hausmann", "rief", "so", "laut", ".", "Ende"]
+    b = ["Ein", "Hausmann", "rief", "es", "so", "laut", "!", "Ende"]
+    assert anchors.matching_blocks(a, b) == [(0, 0, 3), (3, 4, 2), (6, 7, 1)]
+    for i, j, size in anchors.matching_blocks(b, a):
+        assert b[i : i + size] == a[j : j + size]
+
+    # Repeated elements in between anchors are matched recursively
+    a = ["x", "a", "a", "y", "b"]
+    b = ["x", "c", "a", "y", "b"]
+    assert anchors.matching_blocks(a, b) == [(0, 0, 1), (2, 2, 3)]
+    assert anchors.matching_blocks(a, []) == []
@@ -0,0 +1,73 @@
+import textalign
+from textalign import AlignedPair, AlignmentPipeline
+from textalign import translit
+from textalign.cache import SplitCache
+
+
+def test_split_cache(tmp_path) -> None:
+    cache = SplitCache(str(tmp_path))
+    params = {
+        "similarity_func": textalign.aligner.levsim_rescored,
+        "gap_cost_initial": 0.5,
+    }
+    key = cache.key(["Eyn", "Haus"], ["Ein", "Haus"], translit.unidecode_ger, params)
+
+    assert cache.get(key) is None
+    alignment = [AlignedPair(0, 0), AlignedPair(1, None), AlignedPair(None, 1)]
+    cache.put(key, alignment)
+    assert cache.get(key) == alignment
+    assert (cache.n_hits, cache.n_misses) == (1, 1)
+
+    # Empty alignment
+    cache.put("00", [])
+    assert cache.get("00") == []
+
+    # The key depends on tokens, transliteration and parameters
+    keys = {
+        key,
+        cache.key(["Eyn", "Haus"], ["Ein", "Hau"], translit.unidecode_ger, params),
+        cache.key(["EynHaus"], ["Ein", "Haus"], translit.unidecode_ger, params),
+        cache.key(["Eyn", "Haus"], ["Ein", "Haus"], None, params),
+        cache.key(
+            ["Eyn", "Haus"],
+            ["Ein", "Haus"],
+            translit.unidecode_ger,
+            {**params, "gap_cost_initial": 1},
+        ),
+    }
+    assert len(keys) == 5
+    assert key == cache.key(
+        ["Eyn", "Haus"], ["Ein", "Haus"], translit.unidecode_ger, dict(params)
+    )
+
+
+def test_alignment_pipeline_cache(tmp_path) -> None:
+    f_hist = "tests/testdata/simplicissimus_hist.h200.txt"
+    f_norm = "tests/testdata/simplicissimus_norm.h200.txt"
+    config = {
+        "translit_func": translit.unidecode_ger,
+        "aligner": {
+            "similarity_func": textalign.aligner.levsim_rescored,
+            "gap_cost_initial": 0.5,
+        },
+        "max_aligned_tokens": 2,
+        "splitter": {
+            "max_lev_dist": 3,
+            "subseq_len": 7,
+            "step_size": 10,
+            "max_len_split": 100,
+            "translit_func": translit.unidecode_ger,
+        },
+        "cache_dir": str(tmp_path),
+    }
+    pipeline = AlignmentPipeline(config)
+    result = pipeline.run(f_hist, f_norm)
+    target = [sent.serialize() for sent in result.aligned_sentences]
+    assert result.stats.cache_hits == 0
+
+    result = pipeline.run(f_hist, f_norm)
+    output = [sent.serialize() for sent in result.aligned_sentences]
+    assert output == target
+    assert result.stats.cache_hits == result.stats.n_splits
+    assert result.stats.dp_cells == 0
+    assert result.stats.strategies == {"cached": result.stats.n_splits}
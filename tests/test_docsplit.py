@@ -1,4 +1,5 @@
 from Levenshtein import distance
+import pytest
 
 from textalign import docsplit
 from textalign.docsplit import SplitPosition
@@ -464,3 +465,130 @@ def test_docsplit_split_with_unalignable_stretch_in_b() -> None:
         pass
         # print(split_a)
         # print(split_b)
+
+
+def test_docsplit_find_split_positions_ngram() -> None:
+    tokens_a = [
+        "Um",
+        "den",
+        "Vorrath",
+        "grüner",
+        "Olivenäſte",
+        ".",
+        "Den",
+        "er",
+        "ſich",
+        "zur",
+        "Seite",
+        "hatte",
+        "hinlegen",
+        "laſſen",
+        ".",
+        "Allmählig",
+        "in",
+        "die",
+        "Flamme",
+        "zu",
+        "ſchieben",
+        ".",
+    ]
+    tokens_b = [
+        "Um",
+        "den",
+        "Vorrat",
+        "grüner",
+        "Olivenäste",
+        ".",
+        "Den",
+        "er",
+        "sich",
+        "zur",
+        "Seite",
+        "hatte",
+        "hinlegen",
+        "lassen",
+        ".",
+        "Allmählich",
+        "in",
+        "die",
+        "Flamme",
+        "zu",
+        "schieben",
+        ".",
+    ]
+
+    docsplitter = docsplit.DocSplitter(
+        tokens_a,
+        tokens_b,
+        subseq_len=3,
+        max_len_split=5,
+        translit_func=translit.unidecode_ger,
+        strategy="ngram",
+    )
+    split_positions = docsplitter.find_split_positions()
+    target = [
+        SplitPosition(start_a=5, end_a=8, start_b=5, end_b=8),
+        SplitPosition(start_a=10, end_a=13, start_b=10, end_b=13),
+        # "Allmählig" and "Allmählich" do not match: take the last anchor before
+        # position 15
+        SplitPosition(start_a=12, end_a=15, start_b=12, end_b=15),
+        SplitPosition(start_a=17, end_a=20, start_b=17, end_b=20),
+    ]
+    assert split_positions == target
+    assert docsplitter.n_fuzzy_searches == 0
+
+    # Without translit, only n-grams without "ſ" can match
+    docsplitter.translit_func = None
+    for start_a, end_a, start_b, end_b in docsplitter.find_split_positions():
+        assert tokens_a[start_a:end_a] == tokens_b[start_b:end_b]
+
+    with pytest.raises(ValueError):
+        docsplit.DocSplitter(tokens_a, tokens_b, strategy="unknown")
+
+
+def test_docsplit_find_split_positions_ngram_realdoc() -> None:
+    f_hist = "tests/testdata/simplicissimus_hist.txt"
+    f_norm = "tests/testdata/simplicissimus_norm.txt"
+    with open(f_hist, "r", encoding="utf-8") as f:
+        hist = [line.split()[0] for line in f if len(line.split())]
+    with open(f_norm, "r", encoding="utf-8") as f:
+        norm = [line.split()[0] for line in f if len(line.split())]
+
+    docsplitter = docsplit.DocSplitter(
+        hist,
+        norm,
+        subseq_len=4,
+        max_len_split=500,
+        translit_func=translit.unidecode_ger,
+        strategy="ngram",
+    )
+    split_positions = docsplitter.find_split_positions()
+    assert len(split_positions)
+    for start_a, end_a, start_b, end_b in split_positions:
+        a = [translit.unidecode_ger(tok) for tok in hist[start_a:end_a]]
+        b = [translit.unidecode_ger(tok) for tok in norm[start_b:end_b]]
+        assert a == b
+    for split_a, _ in docsplitter.split(split_positions):
+        assert len(split_a) <= 500
+
+
+def test_docsplit_resplit_bounds() -> None:
+    tokens_a = ["Eyn", "Haus", "mann", "riefs", "ſo", ".", "Jch", "bin", "hier"]
+    tokens_b = ["Ein", "Hausmann", "rief", "es", "so", "Ich", "bin", "da", "."]
+    docsplitter = docsplit.DocSplitter(
+        tokens_a, tokens_b, translit_func=translit.unidecode_ger
+    )
+    bounds = [(0, 9, 0, 9)]
+
+    # No split is larger than `max_cells`
+    assert docsplitter.resplit_bounds(bounds, 81) == bounds
+    assert docsplitter.n_resplits == 0
+
+    # Cut at the unique tokens "so" (after translit) and "bin"
+    resplit = docsplitter.resplit_bounds(bounds, 20)
+    assert resplit == [(0, 4, 0, 4), (4, 7, 4, 6), (7, 9, 6, 9)]
+    assert docsplitter.n_resplits == 2
+
+    # Splits without unique tokens are kept
+    docsplitter = docsplit.DocSplitter(["a", "a", "b", "b"], ["b", "a", "b", "a"])
+    assert docsplitter.resplit_bounds([(0, 4, 0, 4)], 1) == [(0, 4, 0, 4)]
@@ -0,0 +1,374 @@
+import random
+
+import numpy as np
+import pytest
+
+import textalign
+from textalign import kernels
+from textalign import translit
+
+
+def _get_tokens(n: int = 200):
+    f_hist = "tests/testdata/simplicissimus_hist.txt"
+    f_norm = "tests/testdata/simplicissimus_norm.txt"
+    with open(f_hist, "r", encoding="utf-8") as f:
+        hist = f.read()
+    with open(f_norm, "r", encoding="utf-8") as f:
+        norm = f.read()
+    hist_tok = [line.split()[0] for line in hist.split("\n")[:n] if len(line.split())]
+    norm_tok = [line.split()[0] for line in norm.split("\n")[:n] if len(line.split())]
+    return hist_tok, norm_tok
+
+
+def _align(tokens_a, tokens_b, **kwargs) -> textalign.Aligner:
+    aligner = textalign.Aligner(tokens_a, tokens_b)
+    aligner.translit_tokens(translit.unidecode_ger)
+    aligner.nw_align(
+        similarity_func=textalign.aligner.levsim_rescored,
+        gap_cost_initial=0.5,
+        **kwargs,
+    )
+    return aligner
+
+
+def test_estimate_memory() -> None:
+    full = kernels.estimate_memory(10000, 10000, "full")
+    checkpoint = kernels.estimate_memory(10000, 10000, "checkpoint")
+    banded = kernels.estimate_memory(10000, 10000, "banded", band_width=100)
+    assert full > 10000 * 10000
+    assert checkpoint < full / 10
+    assert banded < full / 10
+
+    with pytest.raises(ValueError):
+        kernels.estimate_memory(10, 10, "unknown")
+
+
+def test_select_strategy() -> None:
+    assert kernels.select_strategy(100, 100) == "full"
+    budget = kernels.estimate_memory(5000, 5000, "full") - 1
+    assert kernels.select_strategy(5000, 5000, budget) == "checkpoint"
+    budget = kernels.estimate_memory(5000, 5000, "checkpoint") - 1
+    assert kernels.select_strategy(5000, 5000, budget) == "banded"
+    # Nothing fits
+    assert kernels.select_strategy(5000, 5000, 0) == "banded"
+
+
+def test_strategies_identical_alignment() -> None:
+    hist_tok, norm_tok = _get_tokens()
+
+    aligner = _align(hist_tok, norm_tok, strategy="full")
+    target = aligner.aligned_tokidxs
+    assert aligner.strategy == "full"
+    assert aligner.n_dp_cells == len(hist_tok) * len(norm_tok)
+
+    aligner = _align(hist_tok, norm_tok, strategy="checkpoint")
+    assert aligner.aligned_tokidxs == target
+    # Pointers are computed twice
+    assert aligner.n_dp_cells > len(hist_tok) * len(norm_tok)
+
+    # The band is wide enough to contain the optimal alignment
+    aligner = _align(hist_tok, norm_tok, strategy="banded", band_width=50)
+    assert aligner.aligned_tokidxs == target
+    assert aligner.n_dp_cells < len(hist_tok) * len(norm_tok)
+
+
+def test_auto_strategy() -> None:
+    hist_tok, norm_tok = _get_tokens()
+    target = _align(hist_tok, norm_tok, strategy="full").aligned_tokidxs
+
+    budget = kernels.estimate_memory(len(hist_tok), len(norm_tok), "full") - 1
+    aligner = _align(hist_tok, norm_tok, memory_budget=budget)
+    assert aligner.strategy == "checkpoint"
+    assert aligner.aligned_tokidxs == target
+
+
+def test_strategies_empty_sequences() -> None:
+    for strategy in kernels.STRATEGIES:
+        aligner = _align(["a", "b"], [], strategy=strategy)
+        assert [tuple(pair) for pair in aligner.aligned_tokidxs] == [
+            (0, None),
+            (1, None),
+        ]
+        aligner = _align([], ["a"], strategy=strategy)
+        assert [tuple(pair) for pair in aligner.aligned_tokidxs] == [(None, 0)]
+
+
+def _affine_score(a, b, alignment, gap_open, gap_extend) -> float:
+    """Score of an alignment under the affine gap model"""
+    score = 0.0
+    state = None
+    for i, j in alignment:
+        if i is not None and j is not None:
+            score += textalign.aligner.levsim_rescored(a[i], b[j])
+            state = "M"
+        elif j is None:
+            cost = gap_extend if state == "X" else gap_open
+            score -= cost * textalign.aligner.length_discount(1.0, a[i])
+            state = "X"
+        else:
+            cost = gap_extend if state == "Y" else gap_open
+            score -= cost * textalign.aligner.length_discount(1.0, b[j])
+            state = "Y"
+    return score
+
+
+def _affine_optimum(a, b, gap_open, gap_extend) -> float:
+    """Optimal score under the affine gap model, computed cell by cell"""
+    n_a, n_b = len(a), len(b)
+    m = [[kernels.NEG_INF] * (n_b + 1) for _ in range(n_a + 1)]
+    x = [[kernels.NEG_INF] * (n_b + 1) for _ in range(n_a + 1)]
+    y = [[kernels.NEG_INF] * (n_b + 1) for _ in range(n_a + 1)]
+    m[0][0] = 0.0
+    for i in range(n_a + 1):
+        for j in range(n_b + 1):
+            if i and j:
+                sim = textalign.aligner.levsim_rescored(a[i - 1], b[j - 1])
+                m[i][j] = max(m[i - 1][j - 1], x[i - 1][j - 1], y[i - 1][j - 1]) + sim
+            if i:
+                f = textalign.aligner.length_discount(1.0, a[i - 1])
+                x[i][j] = max(
+                    m[i - 1][j] - gap_open * f,
+                    x[i - 1][j] - gap_extend * f,
+                    y[i - 1][j] - gap_open * f,
+                )
+            if j:
+                f = textalign.aligner.length_discount(1.0, b[j - 1])
+                y[i][j] = max(
+                    m[i][j - 1] - gap_open * f,
+                    y[i][j - 1] - gap_extend * f,
+                    x[i][j - 1] - gap_open * f,
+                )
+    return max(m[n_a][n_b], x[n_a][n_b], y[n_a][n_b])
+
+
+def test_affine_gap_model_optimal() -> None:
+    hist_tok, norm_tok = _get_tokens(80)
+    aligner = _align(hist_tok, norm_tok, gap_model="affine")
+    assert aligner.strategy == "full"
+    assert aligner.n_dp_cells == len(hist_tok) * len(norm_tok)
+
+    alignment = [tuple(pair) for pair in aligner.aligned_tokidxs]
+    # Every token is aligned exactly once, in order
+    assert [i for i, _ in alignment if i is not None] == list(range(len(hist_tok)))
+    assert [j for _, j in alignment if j is not None] == list(range(len(norm_tok)))
+
+    a, b = aligner._tokens_a, aligner._tokens_b
+    score = _affine_score(a, b, alignment, 0.5, 0.45)
+    assert score == pytest.approx(_affine_optimum(a, b, 0.5, 0.45))
+
+
+def test_affine_gap_model_gaps() -> None:
+    tokens_a = ["Eyn", "Haus", "mann", "riefs", "ſo", "."]
+    tokens_b = ["Ein", "Hausmann", "rief", "es", "so"]
+    aligner = _align(tokens_a, tokens_b, gap_model="affine")
+    alignment = [tuple(pair) for pair in aligner.aligned_tokidxs]
+    assert (0, 0) in alignment
+    assert (4, 4) in alignment
+
+    for tokens_a, tokens_b, target in (
+        (["a", "b"], [], [(0, None), (1, None)]),
+        ([], ["a"], [(None, 0)]),
+        ([], [], []),
+    ):
+        aligner = _align(tokens_a, tokens_b, gap_model="affine")
+        assert [tuple(pair) for pair in aligner.aligned_tokidxs] == target
+
+    with pytest.raises(ValueError):
+        _align(tokens_a, tokens_b, gap_model="affine", strategy="banded")
+    with pytest.raises(ValueError):
+        _align(tokens_a, tokens_b, gap_model="unknown")
+
+
+def test_gap_cost_model() -> None:
+    model = kernels.GapCostModel.from_callables(
+        ["a", "Haus"], ["Hausmann"], textalign.aligner.length_discount, 0.5, 0.1
+    )
+    assert model.discount_a == [0.5, 1.0]
+    assert model.discount_b == [1.0]
+    assert model.gap_cost_func is None
+    assert model.extend_cost == pytest.approx(0.45)
+
+    model = kernels.GapCostModel.from_callables(["a"], ["b", "c"], None, 0.5, 0.1)
+    assert model.discount_a == [1.0]
+    assert model.discount_b == [1.0, 1.0]
+
+
+def test_gap_cost_func_wrapped() -> None:
+    # A custom gap cost function gives the same result as the inlined one
+    def gap_cost_func(**kwargs) -> float:
+        return textalign.aligner.decreasing_gap_cost(**kwargs)
+
+    hist_tok, norm_tok = _get_tokens()
+    target = _align(hist_tok, norm_tok).aligned_tokidxs
+    aligner = _align(hist_tok, norm_tok, gap_cost_func=gap_cost_func)
+    assert aligner.aligned_tokidxs == target
+
+
+def test_common_affixes() -> None:
+    assert kernels.common_affixes(["a", "b", "c"], ["a", "x", "c"]) == (1, 1)
+    assert kernels.common_affixes(["a", "b"], ["a", "b"]) == (2, 0)
+    # Prefix and suffix do not overlap
+    assert kernels.common_affixes(["a", "a"], ["a", "a", "a"]) == (2, 0)
+    assert kernels.common_affixes(["x", "a"], ["a"]) == (0, 1)
+    assert kernels.common_affixes([], ["a"]) == (0, 0)
+
+
+def test_sparse_chain_optimal() -> None:
+    words = ["Haus", "Maus", "und", "vnd", "nicht", "nit", "ſeyn", "sein", "a"]
+    similarity_func = textalign.aligner.levsim_rescored
+    for seed in range(5):
+        rng = random.Random(seed)
+        a = [rng.choice(words) for _ in range(12)]
+        b = [rng.choice(words) for _ in range(10)]
+        cost_model = kernels.GapCostModel.from_callables(
+            a, b, textalign.aligner.length_discount, 0.5, 0.1
+        )
+        kernel = kernels.SparseChainKernel(a, b, similarity_func, cost_model)
+        rev_a, rev_b = kernel.chain(max_candidates=len(a) * len(b))
+
+        # Every token is aligned exactly once, in order
+        assert [i for i in rev_a[::-1] if i is not None] == list(range(len(a)))
+        assert [j for j in rev_b[::-1] if j is not None] == list(range(len(b)))
+
+        # Gain of a cell: its similarity plus the gap costs it saves
+        def gain(i, j):
+            sim = similarity_func(a[i], b[j])
+            if sim <= kernels.DEFAULT_SPARSE_MIN_SIMILARITY:
+                return None
+            return sim + kernel.gap_a[i] + kernel.gap_b[j]
+
+        # Best chain by a dense DP over all cells
+        best = [[0.0] * (len(b) + 1) for _ in range(len(a) + 1)]
+        for i in range(1, len(a) + 1):
+            for j in range(1, len(b) + 1):
+                best[i][j] = max(best[i - 1][j], best[i][j - 1])
+                if gain(i - 1, j - 1) is not None:
+                    best[i][j] = max(
+                        best[i][j], best[i - 1][j - 1] + gain(i - 1, j - 1)
+                    )
+        chain = [gain(i, j) for i, j in zip(rev_a, rev_b) if None not in (i, j)]
+        assert sum(chain) == pytest.approx(best[-1][-1])
+
+
+def test_sparse_strategy() -> None:
+    hist_tok, norm_tok = _get_tokens()
+    dense = _align(hist_tok, norm_tok, strategy="full")
+    sparse = _align(hist_tok, norm_tok, strategy="sparse", sparse_density=0.5)
+    assert sparse.strategy == "sparse"
+    assert sparse.n_dp_cells < dense.n_dp_cells / 10
+    assert sparse.n_similarity_calls < dense.n_similarity_calls / 2
+    matches_dense = {tuple(p) for p in dense.aligned_tokidxs if None not in p}
+    matches_sparse = {tuple(p) for p in sparse.aligned_tokidxs if None not in p}
+    assert len(matches_dense & matches_sparse) > 0.9 * len(matches_dense)
+
+    # Too many candidates: fall back to a dense strategy
+    fallback = _align(hist_tok, norm_tok, strategy="sparse", sparse_density=0.001)
+    assert fallback.strategy == "full"
+    assert fallback.aligned_tokidxs == dense.aligned_tokidxs
+
+    with pytest.raises(ValueError):
+        _align(hist_tok, norm_tok, strategy="unknown")
+
+
+def test_batch_pointers() -> None:
+    hist_tok, norm_tok = _get_tokens()
+    similarity_func = textalign.aligner.levsim_rescored
+    pairs = [(hist_tok[i : i + 8], norm_tok[i + 1 : i + 11]) for i in range(0, 60, 6)]
+    cost_models = [
+        kernels.GapCostModel.from_callables(
+            a, b, textalign.aligner.length_discount, 0.5, 0.1
+        )
+        for a, b in pairs
+    ]
+    sims = np.array(
+        [[[similarity_func(ai, bj) for bj in b] for ai in a] for a, b in pairs]
+    )
+    pointers = kernels.batch_pointers(
+        sims,
+        np.array([cost_model.discount_a for cost_model in cost_models]),
+        np.array([cost_model.discount_b for cost_model in cost_models]),
+        0.5,
+        0.1,
+    )
+    for k, (a, b) in enumerate(pairs):
+        kernel = kernels.RunningGapKernel(a, b, similarity_func, cost_models[k])
+        row = kernel.first_row()
+        assert pointers[k, 0].tolist() == row.pointers
+        for r in range(1, len(a) + 1):
+            row = kernel.next_row(row)
+            assert pointers[k, r].tolist() == row.pointers
+
+
+def test_workspace() -> None:
+    workspace = kernels.Workspace()
+    pointers = workspace.empty("pointers", (10, 20))
+    assert pointers.shape == (10, 20)
+    assert workspace.n_allocations == 1
+    # Smaller arrays reuse the buffer, larger ones grow it
+    assert workspace.zeros("pointers", (5, 5)).sum() == 0
+    assert workspace.n_allocations == 1
+    workspace.empty("pointers", (20, 20))
+    assert workspace.n_allocations == 2
+    workspace.empty("block", (2, 2))
+    assert workspace.n_allocations == 3
+    assert workspace.nbytes == 20 * 20 + 2 * 2
+
+    # Same alignments with a shared workspace
+    hist_tok, norm_tok = _get_tokens()
+    shared = kernels.Workspace()
+    for strategy in ("full", "checkpoint", "banded"):
+        for end in (200, 50, 120):
+            expected = _align(
+                hist_tok[:end], norm_tok[:end], strategy=strategy, band_width=20
+            )
+            aligner = textalign.Aligner(
+                hist_tok[:end], norm_tok[:end], workspace=shared
+            )
+            aligner.translit_tokens(translit.unidecode_ger)
+            aligner.nw_align(
+                similarity_func=textalign.aligner.levsim_rescored,
+                gap_cost_initial=0.5,
+                strategy=strategy,
+                band_width=20,
+            )
+            assert aligner.aligned_tokidxs == expected.aligned_tokidxs
+    assert shared.n_allocations == 2
+
+
+def test_workspace_spill(tmp_path) -> None:
+    workspace = kernels.Workspace(spill_threshold=1000, spill_dir=str(tmp_path))
+    assert isinstance(workspace.empty("pointers", (100, 100)), np.memmap)
+    assert not isinstance(workspace.empty("pointers", (10, 10)), np.memmap)
+    assert workspace.n_spilled == 1
+    # Temporary files are deleted right away
+    assert list(tmp_path.iterdir()) == []
+
+    # A small buffer after a spilled one is not grown from the spilled size,
+    # RAM buffers are not grown beyond the threshold
+    large_workspace = kernels.Workspace(spill_threshold=10_000_000)
+    assert isinstance(large_workspace.empty("pointers", (5000, 5000)), np.memmap)
+    assert not isinstance(large_workspace.empty("pointers", (10, 10)), np.memmap)
+    assert large_workspace.nbytes == 100
+    large_workspace.empty("pointers", (3000, 3000))
+    large_workspace.empty("pointers", (3000, 3100))
+    assert large_workspace.nbytes == 10_000_000
+
+    # Pointers on disk don't count for the memory budget
+    assert kernels.select_strategy(1000, 1000, memory_budget=500_000) != "full"
+    assert (
+        kernels.select_strategy(1000, 1000, memory_budget=500_000, spill_threshold=1000)
+        == "full"
+    )
+
+    hist_tok, norm_tok = _get_tokens()
+    expected = _align(hist_tok, norm_tok, strategy="full")
+    aligner = textalign.Aligner(hist_tok, norm_tok, workspace=workspace)
+    aligner.translit_tokens(translit.unidecode_ger)
+    aligner.nw_align(
+        similarity_func=textalign.aligner.levsim_rescored,
+        gap_cost_initial=0.5,
+        memory_budget=50_000,
+    )
+    assert aligner.strategy == "full"
+    assert aligner.aligned_tokidxs == expected.aligned_tokidxs
+    assert workspace.n_spilled == 2
@@ -1,5 +1,10 @@
 from typing import List
 
+import io
+import json
+
+import pytest
+
 from textalign import sentences
 from textalign import util
 from textalign import AlignedPair
@@ -387,3 +392,168 @@ def test_let_idxs_start_at_zero() -> None:
     # end_b_prev = 3
     # s_alignment = sentences.let_idxs_start_at_zero(s_alignment, end_a_prev, end_b_prev)
     # assert s_alignment[0].a == 0 and s_alignment[0].b == 0
+
+
+def test_slice_alignment() -> None:
+    sentence_start_idxs = [0, 6, 9]
+    doc_aligned_tokidxs = [
+        AlignedPair(0, 0),
+        AlignedPair(1, 1),
+        AlignedPair(2, 2),
+        AlignedPair(3, 2),
+        AlignedPair(4, None),
+        AlignedPair(5, 3),
+        AlignedPair(6, 4),
+        AlignedPair(6, 5),
+        AlignedPair(7, 6),
+        AlignedPair(None, 7),
+        AlignedPair(8, 8),
+        AlignedPair(9, 9),
+    ]
+    slices = sentences.slice_alignment(doc_aligned_tokidxs, sentence_start_idxs)
+
+    assert len(slices) == 3
+    assert slices.bounds.tolist() == [0, 6, 11, 12]
+
+    idxs_a, idxs_b = slices.get(1)
+    assert idxs_a.tolist() == [0, 0, 1, -1, 2]
+    assert idxs_b.tolist() == [0, 1, 2, 3, 4]
+
+    # Without reset, we get the document-wide indices
+    idxs_a, idxs_b = slices.get(1, reset_tok_idxs=False)
+    assert idxs_a.tolist() == [6, 6, 7, -1, 8]
+    assert idxs_b.tolist() == [4, 5, 6, 7, 8]
+
+
+def test_slice_alignment_empty() -> None:
+    slices = sentences.slice_alignment([], [0, 3])
+    assert len(slices) == 2
+    idxs_a, idxs_b = slices.get(1)
+    assert len(idxs_a) == len(idxs_b) == 0
+
+
+def test_alignment_arrays_roundtrip() -> None:
+    alignment = [AlignedPair(0, None), AlignedPair(1, 0), AlignedPair(None, 1)]
+    idxs_a, idxs_b = sentences.alignment_to_arrays(alignment)
+    assert idxs_a.tolist() == [0, 1, -1]
+    assert idxs_b.tolist() == [-1, 0, 1]
+    assert sentences.arrays_to_alignment(idxs_a, idxs_b) == alignment
+
+
+def _get_sentence_with_gaps() -> sentences.AlignedSentence:
+    tokens_a = [
+        util.Token("Gehts", False),
+        util.Token("noch", True),
+        util.Token("?", False),
+    ]
+    tokens_b = [
+        util.Token("Geht", False),
+        util.Token("es", True),
+        util.Token("noch", True),
+        util.Token("[NUR IN NORM]", True),
+        util.Token("?", False),
+    ]
+    alignment = [
+        AlignedPair(0, 0),
+        AlignedPair(0, 1),
+        AlignedPair(1, 2),
+        AlignedPair(None, 3),
+        AlignedPair(2, 4),
+    ]
+    return sentences.AlignedSentence(tokens_a, tokens_b, alignment)
+
+
+def test_serialize_aligned_sentence_gaps() -> None:
+    sent_aligned = _get_sentence_with_gaps()
+
+    serialized_a, serialized_b = sent_aligned.serialize()
+    assert serialized_a == "Gehts noch [GAP]?"
+    assert serialized_b == "Geht es noch [NUR IN NORM]?"
+
+    serialized_a, serialized_b = sent_aligned.serialize(gap_token=None)
+    assert serialized_a == "Gehts noch?"
+    assert serialized_b == "Geht es noch [NUR IN NORM]?"
+
+    serialized_a, serialized_b = sent_aligned.serialize(drop_unaligned=True)
+    assert serialized_a == "Gehts noch?"
+    assert serialized_b == "Geht es noch?"
+
+
+def test_serialize_sentences() -> None:
+    sents = [_get_sentence_with_gaps()] * 2
+
+    lines = list(sentences.serialize_sentences(sents, drop_unaligned=True))
+    assert lines == ["Gehts noch?\tGeht es noch?\n"] * 2
+
+    lines = list(
+        sentences.serialize_sentences(
+            sents, format="jsonl", drop_unaligned=True, keys=("orig", "norm")
+        )
+    )
+    assert json.loads(lines[0]) == {"orig": "Gehts noch?", "norm": "Geht es noch?"}
+
+    with pytest.raises(ValueError):
+        list(sentences.serialize_sentences(sents, format="xml"))
+
+
+def test_write_aligned_sentences() -> None:
+    sents = (_get_sentence_with_gaps() for _ in range(5))
+    stream = io.StringIO()
+    n = sentences.write_aligned_sentences(
+        sents, stream, format="jsonl", lines_per_write=2
+    )
+    assert n == 5
+    lines = stream.getvalue().splitlines()
+    assert len(lines) == 5
+    assert json.loads(lines[-1]) == {
+        "a": "Gehts noch [GAP]?",
+        "b": "Geht es noch [NUR IN NORM]?",
+    }
+
+
+def test_iter_aligned_sentences() -> None:
+    sentence_start_idxs = [0, 2]
+    doc_aligned_tokidxs = [
+        AlignedPair(0, 0),
+        AlignedPair(1, None),
+        AlignedPair(2, 1),
+        AlignedPair(None, 2),
+    ]
+    doc_a = [util.Token("A"), util.Token("B"), util.Token("C")]
+    doc_b = [util.Token("a"), util.Token("c"), util.Token("d")]
+
+    generated = sentences.iter_aligned_sentences(
+        doc_aligned_tokidxs, sentence_start_idxs, doc_a, doc_b
+    )
+    first = next(generated)
+    assert first.alignment == [AlignedPair(0, 0), AlignedPair(1, None)]
+    target = sentences.get_aligned_sentences(
+        doc_aligned_tokidxs, sentence_start_idxs, doc_a, doc_b
+    )
+    assert list(generated) == target[1:]
+
+
+def test_patch_aligned_sentences() -> None:
+    doc_a = [util.Token(t, i > 0) for i, t in enumerate("a b c d e f g h".split())]
+    doc_b = [util.Token(t, i > 0) for i, t in enumerate("a b x d e f g h".split())]
+    start_idxs = [0, 3, 6]
+    alignment = [AlignedPair(i, i) for i in range(8)]
+    aligned_sents = sentences.get_aligned_sentences(alignment, start_idxs, doc_a, doc_b)
+
+    # Token 2 of b was dropped
+    del doc_b[2]
+    alignment = [AlignedPair(0, 0), AlignedPair(1, 1), AlignedPair(2, None)] + [
+        AlignedPair(i, i - 1) for i in range(3, 8)
+    ]
+    patched = sentences.patch_aligned_sentences(
+        aligned_sents, alignment, start_idxs, doc_a, doc_b, (2, 3)
+    )
+    assert patched == [0, 1]
+    target = sentences.get_aligned_sentences(alignment, start_idxs, doc_a, doc_b)
+    assert [s.serialize() for s in aligned_sents] == [s.serialize() for s in target]
+    assert [s.alignment for s in aligned_sents] == [s.alignment for s in target]
+
+    with pytest.raises(ValueError):
+        sentences.patch_aligned_sentences(
+            aligned_sents, alignment, [0, 3], doc_a, doc_b, (2, 3)
+        )
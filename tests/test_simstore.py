@@ -0,0 +1,151 @@
+import pytest
+
+import textalign
+from textalign import translit
+from textalign.simstore import SimilarityStore, func_name
+
+
+def test_similarity_store(tmp_path) -> None:
+    path = str(tmp_path / "similarity.db")
+    func = textalign.aligner.levsim_rescored
+
+    store = SimilarityStore(path)
+    stored_func = store.wrap(func)
+    assert stored_func.__name__ == func.__name__
+    assert stored_func("Hausmann", "Haus") == func("Hausmann", "Haus")
+    assert stored_func("Hausmann", "Haus") == func("Hausmann", "Haus")
+    assert stored_func("so", "es") == func("so", "es")
+    assert store.n_computed == 2
+    assert store.flush() == 2
+    assert store.flush() == 0
+
+    # A second process reads the values while the first one is still open
+    other = SimilarityStore(path)
+    assert other.prefetch(func, ["Hausmann", "rief"], ["Haus", "Hausmann"]) == 1
+    assert other.prefetch(func_name(func)) == 1
+    other_func = other.wrap(func)
+    assert other_func("Hausmann", "Haus") == func("Hausmann", "Haus")
+    assert other_func("so", "es") == func("so", "es")
+    assert other.n_computed == 0
+    other.close()
+    store.close()
+
+
+class _RowCounter:
+    """Connection wrapper that counts the rows returned by queries"""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.n_rows = 0
+
+    def execute(self, *args):
+        rows = list(self.connection.execute(*args))
+        self.n_rows += len(rows)
+        return iter(rows)
+
+    def __getattr__(self, name):
+        return getattr(self.connection, name)
+
+    def __enter__(self):
+        return self.connection.__enter__()
+
+    def __exit__(self, *exc_info):
+        return self.connection.__exit__(*exc_info)
+
+
+def test_similarity_store_prefetch_split(tmp_path) -> None:
+    path = str(tmp_path / "similarity.db")
+    func = textalign.aligner.levsim_rescored
+    split_a = ["Ein", "Hausmann", "rief"]
+    split_b = ["Ein", "Hausmann", "rief", "es"]
+
+    # Pairs of the split and unrelated pairs (of other documents) that share a
+    # token of a or b with the split
+    store = SimilarityStore(path)
+    stored_func = store.wrap(func)
+    for a in split_a:
+        for b in split_b:
+            stored_func(a, b)
+    for other in ["Hund", "bellt", "laut", "Katze", "miaut"]:
+        for tok in split_a:
+            stored_func(tok, other)
+            stored_func(other, tok)
+    store.close()
+
+    store = SimilarityStore(path)
+    counter = _RowCounter(store.connection)
+    store.connection = counter
+    assert store.prefetch(func, split_a, split_b) == len(split_a) * len(split_b)
+    assert counter.n_rows == len(split_a) * len(split_b)
+    # Values already in memory are not loaded again
+    assert store.prefetch(func, split_a, split_b) == 0
+    assert store.n_loaded == len(split_a) * len(split_b)
+    store.close()
+
+
+def test_alignment_pipeline_similarity_store(tmp_path) -> None:
+    f_hist = "tests/testdata/simplicissimus_hist.h200.txt"
+    f_norm = "tests/testdata/simplicissimus_norm.h200.txt"
+    config = {
+        "translit_func": translit.unidecode_ger,
+        "aligner": {
+            "similarity_func": textalign.aligner.levsim_rescored,
+            "gap_cost_initial": 0.5,
+        },
+        "max_aligned_tokens": 3,
+        "splitter": {
+            "max_lev_dist": 3,
+            "subseq_len": 7,
+            "step_size": 10,
+            "max_len_split": 100,
+            "translit_func": translit.unidecode_ger,
+        },
+    }
+    target = [
+        s.serialize() for s in textalign.AlignmentPipeline(config)(f_hist, f_norm)
+    ]
+
+    config["similarity_store"] = str(tmp_path / "similarity.db")
+    pipeline = textalign.AlignmentPipeline(config)
+    result = pipeline.run(f_hist, f_norm)
+    assert [s.serialize() for s in result.aligned_sentences] == target
+    assert result.stats.similarities_computed > 0
+    assert result.stats.similarities_loaded == 0
+
+    # Second run: all similarities are loaded from the store
+    result = pipeline.run(f_hist, f_norm)
+    assert [s.serialize() for s in result.aligned_sentences] == target
+    assert result.stats.similarities_computed == 0
+    assert result.stats.similarities_loaded > 0
+
+    # Distances of tokens of other documents are not loaded
+    store = SimilarityStore(config["similarity_store"])
+    store.wrap(textalign.aligner.levdistance_normal)("Xylophon", "Zither")
+    store.close()
+    n_loaded = result.stats.similarities_loaded
+    result = pipeline.run(f_hist, f_norm)
+    assert result.stats.similarities_computed == 0
+    assert result.stats.similarities_loaded == n_loaded
+
+
+def test_alignment_pipeline_similarity_store_error(tmp_path) -> None:
+    f_hist = "tests/testdata/simplicissimus_hist.h200.txt"
+    f_norm = "tests/testdata/simplicissimus_norm.h200.txt"
+    config = {
+        "translit_func": translit.unidecode_ger,
+        "aligner": {"similarity_func": textalign.aligner.levsim_rescored},
+        "max_aligned_tokens": 2,
+        "splitter": {"max_len_split": 100, "translit_func": translit.unidecode_ger},
+        "similarity_store": str(tmp_path / "similarity.db"),
+    }
+
+    def hook(name, duration, stats) -> None:
+        if name == "clean":
+            raise RuntimeError
+
+    # The store is closed (and new values written) if a stage fails
+    with pytest.raises(RuntimeError):
+        textalign.AlignmentPipeline(config, hook=hook).run(f_hist, f_norm)
+    store = SimilarityStore(config["similarity_store"])
+    assert store.prefetch(textalign.aligner.levsim_rescored) > 0
+    store.close()
@@ -1,3 +1,4 @@
+from textalign import translit
 from textalign.translit import unidecode_ger
 
 
@@ -15,3 +16,28 @@ def test_unidecode_ger_02():
     token_out = unidecode_ger(token_in)
     assert token_out == target
     assert len(token_out) == len(target)
+
+
+def test_unidecode_ger_ascii():
+    assert unidecode_ger("Haus") == "Haus"
+    assert unidecode_ger("/") == ","
+
+
+def test_unidecode_ger_preserves_umlauts():
+    token_in = "Äpfel Öl Übel äöüß café"
+    target = "Äpfel Öl Übel äöüß cafe"
+    assert unidecode_ger(token_in) == target
+
+
+def test_translit_tables():
+    token_in = "ſcho\u0364n/æ"
+    assert translit.german_map(token_in) == "scho\u0308n,ä"
+    assert translit.unescape(translit.escape("Grüße")) == "Grüße"
+
+
+def test_translit_tokens():
+    tokens = ["ſo", "ſo", "Haus", "ſo"]
+    vocab = translit.translit_vocab(tokens)
+    assert vocab == {"ſo": "so", "Haus": "Haus"}
+    assert translit.translit_tokens(tokens) == ["so", "so", "Haus", "so"]
+    assert translit.translit_tokens(tokens, vocab=vocab) == ["so", "so", "Haus", "so"]
@@ -0,0 +1,141 @@
+import pytest
+
+import textalign
+from textalign import AlignmentPipeline
+from textalign import translit
+from textalign.cache import array_to_alignment
+from textalign.workers import SharedDocuments, SplitExecutor, split_cost
+
+
+def test_shared_documents() -> None:
+    tokens_a = ["Eyn", "Haus", "mann", "ſo", "Haus", ""]
+    tokens_b = ["Ein", "Hausmann", "so", "Ein", "\udcff"]
+    documents = SharedDocuments(tokens_a, tokens_b)
+    try:
+        assert SharedDocuments.attach(documents.name) == (tokens_a, tokens_b)
+    finally:
+        documents.close()
+
+    documents = SharedDocuments([], [])
+    try:
+        assert SharedDocuments.attach(documents.name) == ([], [])
+    finally:
+        documents.close()
+
+
+def test_split_executor() -> None:
+    tokens_a = ["Eyn", "Haus", "mann", "riefs", "ſo", ".", "Jch", "bin", "hier"]
+    tokens_b = ["Ein", "Hausmann", "rief", "es", "so", "Ich", "bin", "da", "."]
+    aligner_kwargs = {"similarity_func": textalign.aligner.levsim_rescored}
+    bounds = [(0, 6, 0, 5), (6, 9, 5, 9), (0, 0, 0, 2)]
+    with SplitExecutor(tokens_a, tokens_b, aligner_kwargs, 2) as executor:
+        results = list(executor.map(bounds))
+    for (start_a, end_a, start_b, end_b), result in zip(bounds, results):
+        aligner = textalign.Aligner()
+        aligner.nw_align(
+            tokens_a[start_a:end_a], tokens_b[start_b:end_b], **aligner_kwargs
+        )
+        assert array_to_alignment(result.alignment) == aligner.aligned_tokidxs
+        assert result.dp_cells == (end_a - start_a) * (end_b - start_b)
+        assert result.dp_cells == split_cost((start_a, end_a, start_b, end_b))
+        assert result.worker > 0
+
+
+def test_split_executor_largest_first() -> None:
+    tokens = [str(i) for i in range(20)]
+    aligner_kwargs = {"similarity_func": textalign.aligner.levsim_rescored}
+    bounds = [(0, 2, 0, 2), (2, 20, 2, 20), (0, 0, 0, 0), (2, 8, 2, 5)]
+    with SplitExecutor(tokens, tokens, aligner_kwargs, 1) as executor:
+        # Record the tasks handed to the pool
+        dispatched = []
+        imap_unordered = executor.pool.imap_unordered
+
+        def spy(func, tasks, *args, **kwargs):
+            dispatched.extend(tasks)
+            return imap_unordered(func, dispatched, *args, **kwargs)
+
+        executor.pool.imap_unordered = spy  # type: ignore[method-assign]
+        results = list(executor.map(bounds))
+    # Dispatched largest first, results in the order of the splits
+    assert [bounds for _, bounds in dispatched] == [
+        (2, 20, 2, 20),
+        (2, 8, 2, 5),
+        (0, 2, 0, 2),
+        (0, 0, 0, 0),
+    ]
+    assert [result.dp_cells for result in results] == [4, 324, 0, 18]
+    assert len({result.worker for result in results}) == 1
+
+
+def test_alignment_pipeline_workers() -> None:
+    f_hist = "tests/testdata/simplicissimus_hist.h200.txt"
+    f_norm = "tests/testdata/simplicissimus_norm.h200.txt"
+    config = {
+        "translit_func": translit.unidecode_ger,
+        "aligner": {
+            "similarity_func": textalign.aligner.levsim_rescored,
+            "gap_cost_initial": 0.5,
+        },
+        "max_aligned_tokens": 2,
+        "splitter": {
+            "max_lev_dist": 3,
+            "subseq_len": 7,
+            "step_size": 10,
+            "max_len_split": 100,
+            "translit_func": translit.unidecode_ger,
+        },
+    }
+    expected_result = AlignmentPipeline(config).run(f_hist, f_norm)
+    expected = expected_result.aligned_sentences
+    expected_stats = expected_result.stats
+
+    pipeline = AlignmentPipeline({**config, "n_workers": 2})
+    result = pipeline.run(f_hist, f_norm)
+    aligned_sents = result.aligned_sentences
+    stats = result.stats
+    assert [sent.serialize() for sent in aligned_sents] == [
+        sent.serialize() for sent in expected
+    ]
+    assert stats.split_sizes == expected_stats.split_sizes
+    assert stats.dp_cells == expected_stats.dp_cells
+    assert stats.strategies == expected_stats.strategies
+    assert sum(stats.worker_durations.values()) == pytest.approx(
+        stats.durations["align"]
+    )
+    assert 0 < stats.load_balance <= 1
+    assert stats.parallel_duration > 0
+
+    # Split large splits again
+    pipeline = AlignmentPipeline({**config, "n_workers": 2, "resplit_cells": 2500})
+    stats = pipeline.run(f_hist, f_norm).stats
+    assert stats.resplits > 0
+    assert stats.n_splits == expected_stats.n_splits + stats.resplits
+    assert max(n_a * n_b for n_a, n_b in stats.split_sizes) < max(
+        n_a * n_b for n_a, n_b in expected_stats.split_sizes
+    )
+
+
+def test_alignment_pipeline_workers_similarity_store(tmp_path) -> None:
+    f_hist = "tests/testdata/simplicissimus_hist.h200.txt"
+    f_norm = "tests/testdata/simplicissimus_norm.h200.txt"
+    # Default similarity function
+    config = {
+        "translit_func": translit.unidecode_ger,
+        "aligner": {"gap_cost_initial": 0.5},
+        "max_aligned_tokens": 2,
+        "splitter": {
+            "max_lev_dist": 3,
+            "subseq_len": 7,
+            "step_size": 10,
+            "max_len_split": 100,
+            "translit_func": translit.unidecode_ger,
+        },
+    }
+    expected = AlignmentPipeline(config)(f_hist, f_norm)
+
+    config["similarity_store"] = str(tmp_path / "similarity.db")
+    result = AlignmentPipeline({**config, "n_workers": 2}).run(f_hist, f_norm)
+    assert [sent.serialize() for sent in result.aligned_sentences] == [
+        sent.serialize() for sent in expected
+    ]
+    assert result.stats.similarities_computed > 0